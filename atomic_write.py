@@ -0,0 +1,33 @@
+"""Files written aside and renamed into place.
+
+Outputs are written to a temporary file next to the target and renamed over
+it only when complete, so an error or an interrupted run leaves the old
+file as it was. The rename replaces the directory entry, not the content,
+so a hard link to the old file, such as a compression_cache object, is
+never written through.
+"""
+
+import contextlib
+import os
+
+
+@contextlib.contextmanager
+def replacing(path):
+    """Yield a temporary path to write, renamed over ``path`` when the block completes"""
+    # Through a symlink, the file it points to is replaced, not the link
+    path = os.path.realpath(path)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        yield temporary
+        os.replace(temporary, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temporary)
+        raise
+
+
+@contextlib.contextmanager
+def open_output(path, mode="wb", **kwargs):
+    """open() ``path`` for writing, through replacing()"""
+    with replacing(path) as temporary, open(temporary, mode, **kwargs) as f:
+        yield f
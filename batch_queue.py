@@ -0,0 +1,149 @@
+import os
+import time
+
+# How often the Tk loop checks on running jobs, in milliseconds
+POLL_INTERVAL = 200
+
+
+def split_drop(widget, data):
+    """Split a drag and drop payload into paths.
+
+    tkinterdnd2 hands over every dropped path in one Tcl list, with braces
+    around paths that contain spaces, so the list is split by Tcl itself.
+    """
+    return [str(path) for path in widget.tk.splitlist(data)]
+
+
+def expand_paths(paths, accept=None):
+    """Yield the files among ``paths``, walking into any folders.
+
+    ``accept(path)`` filters the files found inside folders, paths given
+    directly are always kept.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                if accept is None or accept(file_path):
+                    yield file_path
+
+
+class BatchJob:
+    def __init__(self, source, target, future):
+        self.source = source
+        self.target = target
+        self.future = future
+        self.input_size = 0
+        self.output_size = 0
+        self.seconds = 0.0
+        self.error = None
+
+    @property
+    def status(self):
+        if self.future.cancelled():
+            return "cancelled"
+        if not self.future.done():
+            return "running" if self.future.running() else "queued"
+        return "failed" if self.error else "done"
+
+
+class BatchQueue:
+    """Run file jobs on a process pool and report them from the Tk event loop.
+
+    ``function(source, target, *args)`` must be a module level function, so
+    it can be sent to the worker processes, and return (input size, output
+    size, seconds, error message) like huffman._run_file. The pool is started
+    with the first job of a batch and shut down when the batch drains, so a
+    change to ``workers`` applies from the next batch.
+
+    ``on_job(job)`` is called as each job finishes and ``on_update(queue)``
+    after every poll, both on the Tk thread.
+    """
+
+    def __init__(self, root, function, workers=None, on_job=None, on_update=None):
+        self.root = root
+        self.function = function
+        self.workers = workers or os.cpu_count() or 1
+        self.on_job = on_job
+        self.on_update = on_update
+        self.pool = None
+        self.jobs = []
+        self.pending = []
+        self.start_time = None
+
+    @property
+    def running(self):
+        return self.pool is not None
+
+    def submit(self, source, target, *args):
+        if self.pool is None:
+            # Imported here so the GUI starts without loading multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+            self.jobs = []
+            self.start_time = time.perf_counter()
+            self.root.after(POLL_INTERVAL, self._poll)
+        job = BatchJob(source, target, self.pool.submit(self.function, source, target, *args))
+        self.jobs.append(job)
+        self.pending.append(job)
+        return job
+
+    def cancel(self):
+        """Drop the jobs that have not started, running ones are left to finish"""
+        for job in self.pending:
+            job.future.cancel()
+
+    def counts(self):
+        counts = dict.fromkeys(("queued", "running", "done", "failed", "cancelled"), 0)
+        for job in self.jobs:
+            counts[job.status] += 1
+        return counts
+
+    def summary(self):
+        """One line with the batch's progress, throughput and bytes saved"""
+        counts = self.counts()
+        finished = counts["done"] + counts["failed"] + counts["cancelled"]
+        input_size = sum(job.input_size for job in self.jobs)
+        output_size = sum(job.output_size for job in self.jobs)
+        elapsed = time.perf_counter() - self.start_time if self.start_time else 0
+        speed = input_size / elapsed if elapsed > 0 else 0
+        text = f"{finished}/{len(self.jobs)} finished, {counts['running']} running"
+        if counts["failed"]:
+            text += f", {counts['failed']} failed"
+        if counts["cancelled"]:
+            text += f", {counts['cancelled']} cancelled"
+        text += f"  {speed / 1e6:.1f} MB/s  "
+        if output_size <= input_size:
+            text += f"saved {(input_size - output_size) / 1e6:.1f} MB"
+        else:
+            text += f"grew {(output_size - input_size) / 1e6:.1f} MB"
+        return text
+
+    def _poll(self):
+        still_pending = []
+        for job in self.pending:
+            if not job.future.done():
+                still_pending.append(job)
+                continue
+            if not job.future.cancelled():
+                try:
+                    job.input_size, job.output_size, job.seconds, job.error = job.future.result()
+                except Exception as e:
+                    # A worker process that died takes its job with it
+                    job.error = str(e) or type(e).__name__
+            if self.on_job:
+                self.on_job(job)
+        self.pending = still_pending
+
+        if not self.pending:
+            self.pool.shutdown(wait=False)
+            self.pool = None
+        else:
+            self.root.after(POLL_INTERVAL, self._poll)
+        if self.on_update:
+            self.on_update(self)
@@ -0,0 +1,294 @@
+"""Persistent cache of compressed outputs, keyed by input content and settings.
+
+Nightly runs over mostly unchanged inputs spend their time compressing the
+same bytes again. Here each output is stored under the SHA-256 of its
+input's content together with the parameters that shaped it, so an input
+seen before, at any path, is served by copying (or hard linking) the
+earlier output: an unchanged tree costs one read of every file to hash it.
+
+Outputs live in a content-addressed directory next to an SQLite index of
+their sizes, SHA-256 and last use. An output is checked against its hash
+before it is served, and a damaged index is started afresh. The least
+recently used are evicted beyond a size limit, and hit, miss and eviction
+counts are kept across runs:
+
+    python compression_cache.py stats
+    python compression_cache.py clear
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+
+from atomic_write import replacing
+
+# Total size of the cached outputs before the least recently used are evicted
+DEFAULT_MAX_BYTES = 1 << 30
+
+# Bytes read at a time when hashing
+HASH_CHUNK_SIZE = 1 << 20
+
+# Seconds to wait for another process's write to the index
+LOCK_TIMEOUT = 60
+
+COUNTERS = ("hits", "misses", "evictions")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    detail TEXT,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    digest TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+
+
+def cache_directory():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "file-compression", "outputs")
+
+
+def file_digest(path):
+    """SHA-256 of a file's content, as hex"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parse_size(text):
+    """Parse a byte count with an optional k, M or G suffix (powers of 1024)"""
+    multiplier = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}.get(text[-1:].lower())
+    if multiplier:
+        return int(float(text[:-1]) * multiplier)
+    return int(text)
+
+
+def _place(path, target, link):
+    """Put a copy of ``path`` at ``target``, replacing it in one step"""
+    with replacing(target) as temporary:
+        if link:
+            try:
+                os.link(path, temporary)
+                # A fresh mtime, so the output counts as newer than its input
+                os.utime(temporary)
+            except OSError:
+                shutil.copyfile(path, temporary)
+        else:
+            shutil.copyfile(path, temporary)
+
+
+class CompressionCache:
+    """Outputs keyed by input content and parameters, in ``directory``.
+
+    Several processes may share a cache; the index is SQLite in WAL mode and
+    every change is a short transaction. Outputs are copied in, never linked,
+    so rewriting an output cannot change the cache. Hits are copied out too,
+    unless ``link`` is set, which hard links them where the filesystem allows:
+    faster and free of extra space. The writers in this project replace such
+    outputs rather than write through them, and an object changed by another
+    program fails its hash check and is dropped.
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES, link=False):
+        self.directory = directory or cache_directory()
+        self.max_bytes = max_bytes
+        self.link = link
+        os.makedirs(os.path.join(self.directory, "objects"), exist_ok=True)
+        self.db = None
+        try:
+            self._connect()
+        except sqlite3.DatabaseError:
+            # Outputs are only worth their index entries: start again without both
+            if self.db is not None:
+                self.db.close()
+            for suffix in ("", "-wal", "-shm"):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(self.directory, "index.sqlite3" + suffix))
+            shutil.rmtree(os.path.join(self.directory, "objects"), ignore_errors=True)
+            os.makedirs(os.path.join(self.directory, "objects"), exist_ok=True)
+            self._connect()
+
+    def _connect(self):
+        self.db = sqlite3.connect(os.path.join(self.directory, "index.sqlite3"), timeout=LOCK_TIMEOUT,
+                                  isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        with self._transaction():
+            for statement in _SCHEMA.split(";"):
+                self.db.execute(statement)
+            self.db.executemany("INSERT OR IGNORE INTO counters VALUES (?, 0)", [(name,) for name in COUNTERS])
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    def _count(self, name, amount=1):
+        self.db.execute("UPDATE counters SET value = value + ? WHERE name = ?", (amount, name))
+
+    def _object_path(self, key):
+        return os.path.join(self.directory, "objects", key[:2], key)
+
+    def key(self, source, params, digest=None):
+        """Cache key of compressing ``source`` with ``params``, a JSON-serializable dict.
+
+        ``digest`` saves hashing the source again when its file_digest is
+        already known.
+        """
+        content = digest or file_digest(source)
+        return hashlib.sha256((content + json.dumps(params, sort_keys=True)).encode()).hexdigest()
+
+    def fetch(self, key, target):
+        """Write the output cached under ``key`` to ``target``.
+
+        Returns (hit, the detail stored with it). An entry whose file is
+        missing or does not match the size and SHA-256 recorded for it is
+        dropped and counts as a miss.
+        """
+        row = self.db.execute("SELECT size, detail, digest FROM entries WHERE key = ?", (key,)).fetchone()
+        found = False
+        if row is not None:
+            path = self._object_path(key)
+            try:
+                if os.path.getsize(path) == row[0] and file_digest(path) == row[2]:
+                    _place(path, target, self.link)
+                    found = True
+            except OSError:
+                pass
+        with self._transaction():
+            if found:
+                self.db.execute("UPDATE entries SET last_used = ?, hits = hits + 1 WHERE key = ?",
+                                (time.time(), key))
+            elif row is not None:
+                self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._count("hits" if found else "misses")
+        return found, json.loads(row[1]) if found else None
+
+    def store(self, key, output_path, detail=None):
+        """Cache a copy of ``output_path`` under ``key``, with a JSON-serializable ``detail``"""
+        size = os.path.getsize(output_path)
+        if size > self.max_bytes:
+            return
+        path = self._object_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with replacing(path) as temporary:
+            shutil.copyfile(output_path, temporary)
+            digest = file_digest(temporary)
+        now = time.time()
+        with self._transaction():
+            self.db.execute("INSERT OR REPLACE INTO entries (key, size, detail, created, last_used, hits, digest) "
+                            "VALUES (?, ?, ?, ?, ?, 0, ?)", (key, size, json.dumps(detail), now, now, digest))
+            self._evict()
+
+    def _evict(self):
+        """Remove the least recently used outputs until the cache fits in max_bytes"""
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for key, size in self.db.execute("SELECT key, size FROM entries ORDER BY last_used"):
+            if total <= self.max_bytes:
+                break
+            evicted.append(key)
+            total -= size
+        self.db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in evicted])
+        for key in evicted:
+            with contextlib.suppress(OSError):
+                os.remove(self._object_path(key))
+        self._count("evictions", len(evicted))
+
+    def run(self, source, target, params, produce, digest=None):
+        """Make ``target`` from ``source`` through the cache; returns (detail, hit).
+
+        On a miss ``produce()`` writes ``target`` and its return value is
+        stored as the detail; exceptions from it propagate and nothing is
+        cached.
+        """
+        key = self.key(source, params, digest)
+        hit, detail = self.fetch(key, target)
+        if hit:
+            return detail, True
+        # A hard linked output from an earlier hit is replaced, not written
+        # through, even by a producer that writes in place
+        with contextlib.suppress(FileNotFoundError):
+            if os.stat(target).st_nlink > 1:
+                os.remove(target)
+        detail = produce()
+        self.store(key, target, detail)
+        return detail, False
+
+    def stats(self):
+        """Entries, bytes, the size limit and the hit, miss and eviction counts so far"""
+        entries, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        result = {"entries": entries, "bytes": size, "max_bytes": self.max_bytes}
+        result.update(self.db.execute("SELECT name, value FROM counters"))
+        return result
+
+    def clear(self):
+        """Remove every output and reset the counters"""
+        with self._transaction():
+            self.db.execute("DELETE FROM entries")
+            self.db.execute("UPDATE counters SET value = 0")
+            shutil.rmtree(os.path.join(self.directory, "objects"), ignore_errors=True)
+            os.makedirs(os.path.join(self.directory, "objects"), exist_ok=True)
+
+    def close(self):
+        self.db.close()
+
+
+_open_caches = {}
+
+
+def open_cache(directory=None, max_bytes=DEFAULT_MAX_BYTES, link=False):
+    """A CompressionCache shared by the calls in this process.
+
+    Worker processes get their own, as SQLite connections must not be
+    inherited across fork.
+    """
+    key = (os.getpid(), directory, max_bytes, link)
+    if key not in _open_caches:
+        _open_caches[key] = CompressionCache(directory, max_bytes, link)
+    return _open_caches[key]
+
+
+def format_stats(stats):
+    lookups = stats["hits"] + stats["misses"]
+    rate = 100 * stats["hits"] / lookups if lookups else 0.0
+    return (f"{stats['entries']:,} outputs, {stats['bytes']:,} of {stats['max_bytes']:,} bytes; "
+            f"{stats['hits']:,} hits, {stats['misses']:,} misses ({rate:.1f}% hit rate), "
+            f"{stats['evictions']:,} evictions")
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="compression_cache", description="Inspect the compression cache")
+    parser.add_argument("command", choices=("stats", "clear"))
+    parser.add_argument("--cache-dir", help=f"cache directory (default: {cache_directory()})")
+    args = parser.parse_args(argv)
+
+    cache = CompressionCache(args.cache_dir)
+    if args.command == "clear":
+        cache.clear()
+    print(f"{cache.directory}: {format_stats(cache.stats())}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
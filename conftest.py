@@ -0,0 +1 @@
+# The modules live at the top of the repository; this file puts it on sys.path for the tests
@@ -1,8 +1,127 @@
+import contextlib
+import errno
+import bisect
+import codecs
+import functools
 import heapq
-from collections import defaultdict
+import io
+import itertools
+import math
+import os
+import re
+import stat
+import struct
+import sys
+import zlib
+from collections import Counter, defaultdict, deque
+
+from atomic_write import open_output
+
+# Number of bits resolved by one lookup in the primary decode table
+DECODE_TABLE_BITS = 12
+
+# Longest code written by compress_file. Bounded codes keep the second level
+# of the decode table to one flat lookup of 1 << MAX_CODE_LENGTH entries.
+MAX_CODE_LENGTH = 15
+
+# Size of the reads and writes done by the buffered encoder and decoder
+IO_CHUNK_SIZE = 1 << 20
+
+# The encoder looks up codes for this many symbols at a time
+ENCODE_GRAM = 2
+
+# Alphabet modes recorded in the container header
+MODE_BYTES = 0
+MODE_TEXT = 1
+MODES = {"bytes": MODE_BYTES, "text": MODE_TEXT}
+
+# Container layout: MAGIC and a version byte, then the alphabet mode and
+# option flags. Blocks follow, each with its own code table, then an end
+# marker, an index of block offsets and a trailer. Counts, sizes and offsets
+# are LEB128 varints, so small files are not mostly header.
+MAGIC = b"HUF"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct(">BB")
+
+# Header flag: the file was written in one pass by the adaptive encoder
+FLAG_ADAPTIVE = 0x01
+# Header flag: the file uses a trained dictionary instead of its own table.
+# The header is followed by the dictionary ID, the symbol count and the
+# CRC-32 of the original data, and the payload runs to the end of the file
+# with no blocks or index.
+FLAG_DICTIONARY = 0x02
+_DICTIONARY_ID = struct.Struct(">I")
+_KNOWN_FLAGS = FLAG_ADAPTIVE | FLAG_DICTIONARY
+
+# Every block record, the dictionary reference and the trailer end with a
+# CRC-32: of the record, and of the original data (UTF-8 in text mode)
+_CHECKSUM = struct.Struct(">I")
+
+# Block record: type, symbol count, alphabet size, size of the encoded
+# alphabet and payload size, followed by the code lengths, the alphabet and
+# the payload. Stored and repeat records leave out the alphabet sizes, and
+# the end marker is the type byte alone.
+BLOCK_END = 0
+BLOCK_HUFFMAN = 1
+# Same as BLOCK_HUFFMAN but reusing the code table of the previous block, so
+# the alphabet sizes are zero and no table follows the header
+BLOCK_REPEAT = 2
+# Symbols copied as they are (UTF-8 in text mode), with no table. Stored
+# blocks leave the table in force for a following BLOCK_REPEAT unchanged.
+BLOCK_STORED = 3
+
+# Index entry: offset of a block in the container, a bit offset into its
+# payload and the offset of the symbol that starts there. Every block has an
+# entry at bit 0 plus a checkpoint every CHECKPOINT_INTERVAL symbols, except
+# BLOCK_REPEAT blocks, which are reached from the block holding their table,
+# and stored blocks written by the adaptive encoder. Entries are three
+# varints each.
+CHECKPOINT_INTERVAL = 1 << 18
+
+# Trailer: offset of the index, total symbol count and block count as
+# varints, then the CRC-32 of the original data, the size of the varints, a
+# CRC-32 of the index and the trailer up to here, and a tag, so a damaged
+# index is found before it sends a read to the wrong place.
+INDEX_MAGIC = b"HIDX"
+_TRAILER = struct.Struct(">IBI4s")
+# Bytes read from the end of a file to find the trailer, enough for any
+_TRAILER_MAX_SIZE = 64
+
+# Default number of symbols per block in block mode
+BLOCK_SIZE = 1 << 20
+
+# Larger payloads are decoded as a stream in the main process instead of
+# being loaded whole and sent to a worker
+MAX_WORKER_PAYLOAD = 16 << 20
+
+# Files of fewer blocks than this are coded and decoded in-process whatever
+# the number of workers: starting a pool and shipping blocks to it costs
+# more than a few blocks take to code
+MIN_PARALLEL_BLOCKS = 4
+
+# Blocks are stored raw unless coding them is estimated to save at least
+# this fraction of their size, which skips compressed or random input
+STORE_THRESHOLD = 1 / 32
+
+# The adaptive encoder considers a new code table after this many bytes
+ADAPTIVE_INTERVAL = 1 << 16
+
+# Dictionary file: magic, version, alphabet mode and dictionary ID, then the
+# alphabet and table sizes and the table. Dictionaries are looked up by ID
+# as <id>.hufdict in the directories listed in HUFFMAN_DICTIONARY_PATH.
+DICTIONARY_MAGIC = b"HUFD"
+DICTIONARY_VERSION = 1
+DICTIONARY_SUFFIX = ".hufdict"
+_DICTIONARY = struct.Struct(">BBIII")
+
+# Loaded dictionaries and decode tables kept in memory, least recently used
+# first out
+TABLE_CACHE_SIZE = 32
 
 
 class HuffmanNode:
+    __slots__ = ("char", "freq", "left", "right")
+
     def __init__(self, char, freq):
         self.char = char
         self.freq = freq
@@ -14,36 +133,303 @@ class HuffmanNode:
 
 
 def build_huffman_tree(frequency):
-    heap = [HuffmanNode(char, freq) for char, freq in frequency.items()]
+    # Heap entries carry a sequence number so equal frequencies are merged
+    # in a fixed order and nodes are never compared
+    heap = [(freq, order, HuffmanNode(char, freq))
+            for order, (char, freq) in enumerate(sorted(frequency.items()))]
     heapq.heapify(heap)
+    order = len(heap)
 
     while len(heap) > 1:
-        node1 = heapq.heappop(heap)
-        node2 = heapq.heappop(heap)
-        merged = HuffmanNode(None, node1.freq + node2.freq)
+        freq1, _, node1 = heapq.heappop(heap)
+        freq2, _, node2 = heapq.heappop(heap)
+        merged = HuffmanNode(None, freq1 + freq2)
         merged.left = node1
         merged.right = node2
-        heapq.heappush(heap, merged)
+        heapq.heappush(heap, (merged.freq, order, merged))
+        order += 1
 
-    return heap[0]
+    return heap[0][2]
 
 
 def build_huffman_codes(tree):
     codes = {}
-
-    def generate_codes(node, current_code):
+    # Walk the tree with an explicit stack: skewed inputs make trees deeper
+    # than the recursion limit
+    stack = [(tree, "")]
+    while stack:
+        node, current_code = stack.pop()
         if node is None:
-            return
+            continue
         if node.char is not None:
             codes[node.char] = current_code
-        generate_codes(node.left, current_code + "0")
-        generate_codes(node.right, current_code + "1")
+        stack.append((node.right, current_code + "1"))
+        stack.append((node.left, current_code + "0"))
+    return codes
+
+
+def build_code_lengths(frequency, max_length=None):
+    """Return the Huffman {symbol: code length} mapping for a frequency table.
+
+    Works on flat lists instead of a node tree: leaves sorted by (frequency,
+    symbol) and merged nodes, which are created in non-decreasing order, form
+    two queues, so the two smallest weights are always at their fronts. Ties
+    go to the leaf, so the same frequency table always gives the same
+    lengths whatever order it was counted in. A lone symbol gets a one bit
+    code.
+
+    With ``max_length`` no code is longer than that many bits. If the optimal
+    code is longer, the lengths are rebuilt with package-merge, which gives
+    the best code within the limit. The limit is raised to the shortest that
+    can hold the alphabet.
+    """
+    leaves = sorted(frequency.items(), key=lambda item: (item[1], item[0]))
+    count = len(leaves)
+    if count <= 1:
+        return {char: 1 for char, _ in leaves}
+
+    weights = [freq for _, freq in leaves] + [0] * (count - 1)
+    parents = [0] * (2 * count - 1)
+    leaf = 0
+    merged = count
+    for node in range(count, 2 * count - 1):
+        weight = 0
+        # Take the two lightest of the next leaf and the next merged node
+        for _ in range(2):
+            if leaf < count and (merged == node or weights[leaf] <= weights[merged]):
+                child = leaf
+                leaf += 1
+            else:
+                child = merged
+                merged += 1
+            parents[child] = node
+            weight += weights[child]
+        weights[node] = weight
+
+    # Children are numbered before their parent, so depths can be filled in
+    # from the root (the last node) down
+    depths = [0] * (2 * count - 1)
+    for node in range(2 * count - 3, -1, -1):
+        depths[node] = depths[parents[node]] + 1
+    if max_length is not None and max(depths[:count]) > max_length:
+        depths = _package_merge([freq for _, freq in leaves], max(max_length, (count - 1).bit_length()))
+    return {char: depths[index] for index, (char, _) in enumerate(leaves)}
+
+
+def _package_merge(weights, max_length):
+    """Optimal code lengths of at most ``max_length`` bits for sorted weights.
+
+    Each of the ``max_length`` levels merges the leaves with the pairs
+    ("packages") of the level below. The 2n - 2 lightest items of the last
+    level are the coins to spend, and a leaf's code length is the number of
+    times it occurs in them. Packages are nested tuples of leaf indexes.
+    """
+    count = len(weights)
+    leaves = [(weight, index) for index, weight in enumerate(weights)]
+    items = leaves
+    for _ in range(max_length - 1):
+        packages = [(items[i][0] + items[i + 1][0], (items[i][1], items[i + 1][1]))
+                    for i in range(0, len(items) - 1, 2)]
+        # Stable sort: on equal weights leaves come before packages
+        items = sorted(leaves + packages, key=lambda item: item[0])
+
+    lengths = [0] * count
+    stack = [node for _, node in items[:2 * count - 2]]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, tuple):
+            stack.extend(node)
+        else:
+            lengths[node] += 1
+    return lengths
+
+
+def length_limit_cost(frequency, max_length=MAX_CODE_LENGTH):
+    """Return how much larger the payload gets when codes are limited to ``max_length`` bits.
+
+    The result is a fraction of the optimal payload size: 0.0 when the
+    optimal code already fits.
+    """
+    optimal = build_code_lengths(frequency)
+    limited = build_code_lengths(frequency, max_length)
+    optimal_bits = sum(freq * optimal[char] for char, freq in frequency.items())
+    limited_bits = sum(freq * limited[char] for char, freq in frequency.items())
+    return limited_bits / optimal_bits - 1 if optimal_bits else 0.0
+
+
+def entropy_bits(frequency):
+    """Shannon entropy of a frequency table in bits, summed over all symbols.
+
+    No prefix code can do better, and a Huffman code is within one bit per
+    symbol of it, so it estimates the payload size without building a code.
+    """
+    total = sum(frequency.values())
+    if not total:
+        return 0.0
+    return total * math.log2(total) - sum(count * math.log2(count) for count in frequency.values())
+
+
+def _raw_size(mode, frequency):
+    """Size in bytes of the symbols counted in frequency, stored as they are."""
+    if mode == MODE_BYTES:
+        return sum(frequency.values())
+    return sum(count * len(char.encode('utf-8')) for char, count in frequency.items())
+
+
+def _worth_coding(frequency, raw_size):
+    """Whether coding is estimated to save STORE_THRESHOLD of raw_size.
 
-    generate_codes(tree, "")
+    The estimate is the entropy plus about two bytes per symbol for the table.
+    """
+    estimate = entropy_bits(frequency) / 8 + 2 * len(frequency)
+    return raw_size - estimate >= raw_size * STORE_THRESHOLD
+
+
+def code_lengths(huffman_codes):
+    """Return {char: code length}, giving a lone symbol a one bit code."""
+    return {char: max(len(code), 1) for char, code in huffman_codes.items()}
+
+
+def canonical_codes(lengths):
+    """Assign canonical Huffman codes from a {char: code length} mapping.
+
+    Symbols are ordered by (length, symbol) and given consecutive code
+    values, so the codes can be rebuilt from the lengths alone.
+    """
+    codes = {}
+    code = 0
+    previous_length = 0
+    for char, length in sorted(lengths.items(), key=lambda item: (item[1], item[0])):
+        code <<= length - previous_length
+        if code >> length:
+            raise ValueError("Code lengths do not form a valid prefix code")
+        codes[char] = format(code, f"0{length}b")
+        code += 1
+        previous_length = length
     return codes
 
-def compress_file(file_path, compressed_file):
-    with open(file_path, 'r', encoding='utf-8') as f:
+
+class _GramCodes(dict):
+    """Lazily filled {symbols: (value, length)} map for runs of symbols.
+
+    Looking codes up for several symbols at once keeps the number of Python
+    level iterations in the encoder down. The map is reset when it grows past
+    ``limit`` entries so large alphabets cannot blow up memory.
+    """
+
+    def __init__(self, huffman_codes, limit=1 << 16):
+        super().__init__()
+        self.codes = {char: (int(code, 2), len(code)) for char, code in huffman_codes.items()}
+        self.limit = limit
+
+    def __missing__(self, gram):
+        value = 0
+        length = 0
+        for char in gram:
+            code, code_length = self.codes[char]
+            value = (value << code_length) | code
+            length += code_length
+        if len(self) >= self.limit:
+            self.clear()
+        self[gram] = (value, length)
+        return value, length
+
+
+def _byte_pair_codes(huffman_codes):
+    """Flat table of (value, length) indexed by a big-endian pair of bytes.
+
+    Entries 0x10000 + byte hold the code of a single trailing byte.
+    """
+    single = [None] * 256
+    for byte, code in huffman_codes.items():
+        single[byte] = (int(code, 2), len(code))
+    present = [byte for byte in range(256) if single[byte]]
+
+    table = [None] * (0x10000 + 256)
+    for first in present:
+        first_value, first_length = single[first]
+        base = first << 8
+        for second in present:
+            value, length = single[second]
+            table[base | second] = ((first_value << length) | value, first_length + length)
+    table[0x10000:] = single
+    return table
+
+
+def _split_byte_pairs(data):
+    pairs = struct.unpack_from(f">{len(data) // 2}H", data)
+    if len(data) & 1:
+        pairs += (0x10000 | data[-1],)
+    return pairs
+
+
+def _symbol_encoder(huffman_codes, text, gram=ENCODE_GRAM):
+    """Return the (codes, split) lookup pair encode_chunks uses for a code table.
+
+    Text whose alphabet has at most 256 characters, which is nearly all of
+    it, is turned into one byte per character (Latin-1 directly, otherwise
+    the character's index in the alphabet) and coded through the same byte
+    pair table as bytes. Larger alphabets are looked up ``gram`` characters
+    at a time.
+    """
+    if not text:
+        return _byte_pair_codes(huffman_codes), _split_byte_pairs
+    if len(huffman_codes) > 256:
+        return _GramCodes(huffman_codes), re.compile(".{1,%d}" % gram, re.S).findall
+    if all(ord(char) < 256 for char in huffman_codes):
+        codes = {ord(char): code for char, code in huffman_codes.items()}
+        return _byte_pair_codes(codes), lambda data: _split_byte_pairs(data.encode('latin-1'))
+    alphabet = sorted(huffman_codes)
+    index = str.maketrans({char: chr(number) for number, char in enumerate(alphabet)})
+    codes = {number: huffman_codes[char] for number, char in enumerate(alphabet)}
+    return _byte_pair_codes(codes), lambda data: _split_byte_pairs(data.translate(index).encode('latin-1'))
+
+
+def encode_chunks(chunks, huffman_codes, gram=ENCODE_GRAM, checkpoints=None, encoder=None):
+    """Encode an iterable of text or bytes chunks, yielding packed bytearrays.
+
+    Codes are shifted into an integer accumulator and flushed as whole bytes
+    whenever 64 bits or more are pending, so no '0'/'1' string is ever built.
+    Bytes, and text with small alphabets, are looked up through a flat
+    table of byte pairs, see _symbol_encoder. The final partial byte is padded with zero bits.
+    If ``checkpoints`` is a list, (bit offset, symbol offset) is appended to
+    it after every chunk. ``encoder`` is a lookup pair from _symbol_encoder,
+    for callers that encode many payloads with the same table.
+    """
+    codes = None
+    acc = 0
+    nbits = 0
+    written = 0
+    symbols_done = 0
+    for data in chunks:
+        if codes is None:
+            codes, split = encoder or _symbol_encoder(huffman_codes, isinstance(data, str), gram)
+        out = bytearray()
+        append = out.extend
+        for start in range(0, len(data), 1 << 16):
+            for symbols in split(data[start:start + (1 << 16)]):
+                value, length = codes[symbols]
+                acc = (acc << length) | value
+                nbits += length
+                if nbits >= 64:
+                    extra = nbits & 7
+                    append((acc >> extra).to_bytes(nbits >> 3, "big"))
+                    acc &= (1 << extra) - 1
+                    nbits = extra
+        if out:
+            written += len(out)
+            yield out
+        if checkpoints is not None:
+            symbols_done += len(data)
+            checkpoints.append((written * 8 + nbits, symbols_done))
+    if nbits:
+        extra = (8 - nbits % 8) % 8
+        yield (acc << extra).to_bytes((nbits + extra) // 8, "big")
+
+
+def compress_file_reference(file_path, compressed_file):
+    """String-based encoder kept as a reference for compress_file."""
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
         data = f.read()
 
     # Calculate frequency of each character
@@ -75,85 +461,1809 @@ def compress_file(file_path, compressed_file):
     with open(compressed_file, 'wb') as f:
         f.write(byte_array)
 
-    # Save Huffman codes to a file for decompression
-    codes_file = compressed_file + ".codes"
+    _save_codes(compressed_file + ".codes", huffman_codes)
+
+    print(f"File compressed successfully: {compressed_file}")
+
+
+def _save_codes(codes_file, huffman_codes):
+    """Save Huffman codes to a file for decompression."""
     with open(codes_file, 'w', encoding='utf-8') as f:
         for char, code in huffman_codes.items():
             # Write each char and its code separated by a tab
             f.write(f"{char.encode('utf-8').hex()}\t{code}\n")
 
-    print(f"File compressed successfully: {compressed_file}")
 
+def _pack_table(mode, lengths):
+    """Return (alphabet_size, symbols_size, table bytes) for a code table.
+
+    The table is one code length byte per symbol followed by the alphabet,
+    both in symbol order.
+    """
+    chars = sorted(lengths)
+    symbols = bytes(chars) if mode == MODE_BYTES else "".join(chars).encode('utf-8')
+    return len(chars), len(symbols), bytes(lengths[char] for char in chars) + symbols
+
+
+def _pack_varints(*values):
+    """LEB128: seven bits a byte, low bits first, the top bit set on all but the last"""
+    out = bytearray()
+    for value in values:
+        while value > 0x7F:
+            out.append(value & 0x7F | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+
+def _unpack_varints(data):
+    """Return the list of varints that make up ``data``."""
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            if shift >= 63:
+                raise ValueError("Corrupt compressed file: varint is too long")
+            continue
+        values.append(value)
+        value = shift = 0
+    if shift:
+        raise ValueError("Compressed file is truncated")
+    return values
+
+
+def _read_varints(f, count):
+    """Read ``count`` varints from f, returning (values, the bytes they took)."""
+    raw = bytearray()
+    for _ in range(count):
+        while True:
+            byte = _read_exact(f, 1)[0]
+            raw.append(byte)
+            if not byte & 0x80:
+                break
+    return _unpack_varints(raw), bytes(raw)
+
+
+def _pack_record(block_type, symbol_count, payload_size):
+    """Return the header of a stored or repeat block."""
+    return bytes([block_type]) + _pack_varints(symbol_count, payload_size)
+
+
+def _pack_block(mode, symbol_count, lengths, payload_size):
+    """Return the block header and code table that precede a payload."""
+    alphabet_size, symbols_size, table = _pack_table(mode, lengths)
+    return bytes([BLOCK_HUFFMAN]) + _pack_varints(symbol_count, alphabet_size, symbols_size, payload_size) + table
+
+
+class _Checksum:
+    """Running CRC-32 of bytes or text, text as UTF-8."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, data=b""):
+        self.value = zlib.crc32(data)
+
+    def update(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.value = zlib.crc32(data, self.value)
+
+    def feed(self, chunks):
+        """Yield chunks unchanged, adding each to the checksum."""
+        for data in chunks:
+            self.update(data)
+            yield data
+
+
+def _seal(record):
+    """Append the CRC-32 that ends every block record."""
+    return record + _CHECKSUM.pack(zlib.crc32(record))
+
+
+def _pack_stored(symbol_count, payload_size):
+    """Return the header of a stored block."""
+    return _pack_record(BLOCK_STORED, symbol_count, payload_size)
+
+
+def _stored_size(symbol_count):
+    """Size after the header of a container holding ``symbol_count`` bytes in one stored block."""
+    offset = len(MAGIC) + 1 + _HEADER.size
+    block = len(_pack_stored(symbol_count, symbol_count)) + symbol_count + _CHECKSUM.size
+    return block + len(_pack_index([(offset, 0, 0)], offset + block, symbol_count, 0))
+
+
+def _pack_header(mode, flags=0):
+    return MAGIC + bytes([FORMAT_VERSION]) + _HEADER.pack(mode, flags)
+
+
+def _pack_index(index, offset, symbol_count, checksum):
+    """Return the end marker, block index and trailer for blocks ending at offset."""
+    entries = b"".join(_pack_varints(*entry) for entry in index)
+    block_count = sum(1 for entry in index if not entry[1])
+    fields = _pack_varints(offset + 1, symbol_count, block_count)
+    index = entries + fields + _CHECKSUM.pack(checksum) + bytes([len(fields)])
+    return bytes([BLOCK_END]) + index + _CHECKSUM.pack(zlib.crc32(index)) + INDEX_MAGIC
+
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) < size:
+        raise ValueError("Compressed file is truncated")
+    return data
+
+
+def _read_table(f, mode, alphabet_size, symbols_size, checksum=None):
+    lengths = _read_exact(f, alphabet_size)
+    symbols = _read_exact(f, symbols_size)
+    if checksum is not None:
+        checksum.update(lengths + symbols)
+    if mode == MODE_TEXT:
+        symbols = symbols.decode('utf-8')
+    if len(symbols) != alphabet_size:
+        raise ValueError("Compressed file header is corrupt")
+    return dict(zip(symbols, lengths))
+
+
+def _read_header(f, prefix=b"", dictionary=None, resolve_dictionary=True):
+    """Read the container header, returning (mode, flags, stream).
+
+    Files that use a trained dictionary have no blocks: ``stream`` is then a
+    (symbol_count, lengths, checksum) tuple, with the lengths of the
+    dictionary found through ``dictionary`` (see find_dictionary), or None
+    if ``resolve_dictionary`` is false. For other files it is None and
+    blocks follow. ``prefix`` holds header bytes already read from ``f``.
+    """
+    preamble = prefix + _read_exact(f, len(MAGIC) + 1 - len(prefix))
+    if preamble[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a Huffman compressed file")
+    version = preamble[len(MAGIC)]
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported format version: {version}")
+    mode, flags = _HEADER.unpack(_read_exact(f, _HEADER.size))
+    if mode not in MODES.values():
+        raise ValueError(f"Unknown alphabet mode: {mode}")
+    if flags & ~_KNOWN_FLAGS:
+        raise ValueError(f"Corrupt compressed file: bad header flags {flags:#04x}")
+
+    if not flags & FLAG_DICTIONARY:
+        return mode, flags, None
+    if mode != MODE_BYTES:
+        raise ValueError("Corrupt compressed file: dictionaries code bytes mode only")
+    dictionary_id = _DICTIONARY_ID.unpack(_read_exact(f, _DICTIONARY_ID.size))[0]
+    symbol_count = _read_varints(f, 1)[0][0]
+    checksum = _CHECKSUM.unpack(_read_exact(f, _CHECKSUM.size))[0]
+    if not resolve_dictionary:
+        return mode, flags, (symbol_count, None, checksum)
+    return mode, flags, (symbol_count, find_dictionary(dictionary_id, dictionary).lengths, checksum)
+
+
+def _read_blocks(f, mode, stream=None, lengths=None, verify=False):
+    """Yield (symbol_count, lengths, payload_size, checksum) for each block in f.
+
+    The caller must consume the payload before asking for the next block. A
+    payload_size of None means the payload runs to the end of the file.
+    Blocks that repeat the previous table yield the same lengths object and
+    stored blocks yield None; ``lengths`` is the table in force when reading
+    starts mid-file. With ``verify``, ``checksum`` holds the record read so
+    far and the caller must add the payload to it; the CRC that ends the
+    record is then checked when the next block is asked for. Otherwise it
+    is None and the CRC is skipped.
+    """
+    if stream is not None:
+        yield stream[0], stream[1], None, None
+        return
+
+    number = 0
+    while True:
+        header, block_type, symbol_count, alphabet_size, symbols_size, payload_size = _read_block_header(f)
+        if block_type == BLOCK_END:
+            return
+        checksum = _Checksum(header) if verify else None
+        if block_type == BLOCK_HUFFMAN:
+            lengths = _read_table(f, mode, alphabet_size, symbols_size, checksum)
+        elif block_type == BLOCK_REPEAT and lengths is None:
+            raise ValueError("Corrupt compressed file: block refers to a missing code table")
+        yield symbol_count, None if block_type == BLOCK_STORED else lengths, payload_size, checksum
+
+        number += 1
+        expected = _CHECKSUM.unpack(_read_exact(f, _CHECKSUM.size))[0]
+        if checksum is not None and checksum.value != expected:
+            raise ValueError(f"Corrupt compressed file: checksum mismatch in block {number}")
+
+
+def _read_block_header(f):
+    """Read a block header.
+
+    Returns (its bytes, type, symbol count, alphabet size, encoded alphabet
+    size, payload size), with zero sizes for fields the record leaves out.
+    """
+    header = _read_exact(f, 1)
+    block_type = header[0]
+    if block_type == BLOCK_END:
+        return header, block_type, 0, 0, 0, 0
+    if block_type == BLOCK_HUFFMAN:
+        fields, raw = _read_varints(f, 4)
+        return (header + raw, block_type) + tuple(fields)
+    if block_type not in (BLOCK_REPEAT, BLOCK_STORED):
+        raise ValueError(f"Unknown block type: {block_type}")
+    (symbol_count, payload_size), raw = _read_varints(f, 2)
+    return header + raw, block_type, symbol_count, 0, 0, payload_size
+
+
+def _is_path(target):
+    return isinstance(target, (str, os.PathLike))
+
+
+def _is_regular(path):
+    """Whether ``path`` is a regular file or missing, not a device or pipe"""
+    try:
+        return stat.S_ISREG(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return True
+
+
+@contextlib.contextmanager
+def _open_stream(target, mode):
+    """Open a path, or adapt an already open file object, for reading or writing.
+
+    ``mode`` is one of 'r', 'w' (UTF-8 text, line endings kept as they are)
+    or 'rb', 'wb'. File objects are never closed; a binary object asked for
+    in text mode is wrapped and then detached again so the caller keeps
+    ownership. Regular files are written through atomic_write.open_output.
+    """
+    text = 'b' not in mode
+    if _is_path(target) and 'w' in mode and _is_regular(target):
+        with open_output(target, mode, encoding='utf-8' if text else None, newline='' if text else None) as f:
+            yield f
+        return
+    if _is_path(target):
+        with open(target, mode, encoding='utf-8' if text else None, newline='' if text else None) as f:
+            yield f
+        return
+
+    is_text = isinstance(target, io.TextIOBase)
+    if text == is_text:
+        yield target
+    elif not text:
+        # Text streams such as sys.stdin expose their binary buffer
+        yield target.buffer
+    else:
+        wrapper = io.TextIOWrapper(target, encoding='utf-8', newline='')
+        try:
+            yield wrapper
+        finally:
+            wrapper.flush()
+            wrapper.detach()
+
+
+@contextlib.contextmanager
+def _open_input(target, mode, progress=None, passes=1):
+    """_open_stream for reading, reporting the bytes read to ``progress``.
+
+    ``progress(done, total)`` is called after every read with the bytes read
+    so far and ``passes`` times the size of the input, or None for total if
+    the size is not known. Text file objects are not reported.
+    """
+    if progress is None or (not _is_path(target) and isinstance(target, io.TextIOBase)):
+        with _open_stream(target, mode) as f:
+            yield f
+        return
+
+    with _open_stream(target, 'rb') as raw:
+        total = None
+        if raw.seekable():
+            start = raw.tell()
+            total = (raw.seek(0, os.SEEK_END) - start) * passes
+            raw.seek(start)
+        with _open_stream(_ProgressStream(raw, progress, total), mode) as f:
+            yield f
+
+
+def _decode_table(mode, lengths, symbol_count):
+    """Rebuild the canonical codes and lookup table from the code lengths.
+
+    Small blocks get a smaller table so building it does not cost more than
+    the decoding it saves. Tables are cached, so files sharing a dictionary
+    build theirs once.
+    """
+    bits = min(DECODE_TABLE_BITS, symbol_count.bit_length())
+    return _cached_decode_table(mode, frozenset(lengths.items()), max(bits, 1))
+
+
+@functools.lru_cache(maxsize=TABLE_CACHE_SIZE)
+def _cached_decode_table(mode, lengths, bits):
+    join = bytes if mode == MODE_BYTES else "".join
+    return DecodeTable(canonical_codes(dict(lengths)), bits=bits, join=join)
+
+
+def _split(data, size):
+    return (data[start:start + size] for start in range(0, len(data), size))
+
+
+def _block_index(offset, symbol_offset, symbol_count, checkpoints):
+    """Index entries for a block: its start plus the checkpoints inside it."""
+    entries = [(offset, 0, symbol_offset)]
+    for bit_offset, symbols_done in checkpoints:
+        if symbols_done < symbol_count:
+            entries.append((offset, bit_offset, symbol_offset + symbols_done))
+    return entries
+
+
+def _encode_block(mode, data, max_code_length=MAX_CODE_LENGTH):
+    """Compress one block in memory, returning (record, symbol_count, checkpoints)."""
+    # Counter counts the bytes or characters of the buffer in C
+    frequency = Counter(data)
+    raw = data if mode == MODE_BYTES else data.encode('utf-8')
+    if not _worth_coding(frequency, len(raw)):
+        return _seal(_pack_stored(len(data), len(raw)) + raw), len(data), []
+    lengths = build_code_lengths(frequency, max_code_length)
+    checkpoints = []
+    chunks = _split(data, CHECKPOINT_INTERVAL)
+    payload = b"".join(encode_chunks(chunks, canonical_codes(lengths), checkpoints=checkpoints))
+    return _seal(_pack_block(mode, len(data), lengths, len(payload)) + payload), len(data), checkpoints
+
+
+def _encode_adaptive(src, checksum, max_code_length=MAX_CODE_LENGTH):
+    """Single pass encoder for bytes, yielding (record, symbol_count, has_table).
+
+    Every read from ``src`` becomes a block as soon as it returns, so output
+    keeps pace with a live input. The first block carries a table built from
+    its own bytes; after that a table built from the input since the last
+    decision is considered every ADAPTIVE_INTERVAL bytes and written only if
+    it would have saved more than its own size on that input. Blocks in
+    between reuse the previous table. Every byte value gets a code, so a
+    table can code whatever arrives next. Reads the table would not shrink
+    by STORE_THRESHOLD are stored raw, and a new table waits for the next
+    block that is coded. The input is added to ``checksum`` as it is read.
+    """
+    read = getattr(src, 'read1', src.read)
+    lengths = None
+    table_pending = False
+    seen = Counter()
+    seen_count = 0
+    while True:
+        data = read(IO_CHUNK_SIZE)
+        if not data:
+            return
+        checksum.update(data)
+        counts = Counter(data)
+        seen.update(counts)
+        seen_count += len(data)
+
+        if lengths is None or seen_count >= ADAPTIVE_INTERVAL:
+            # One extra count per byte value keeps unseen bytes codable
+            smoothed = Counter(range(256))
+            smoothed.update(seen)
+            candidate = build_code_lengths(smoothed, max_code_length)
+            if lengths is not None:
+                saved = sum(count * (lengths[byte] - candidate[byte]) for byte, count in seen.items())
+                table_size = len(_pack_block(MODE_BYTES, len(data), candidate, len(data)))
+            if lengths is None or saved > table_size * 8:
+                lengths = candidate
+                encoder = _symbol_encoder(canonical_codes(lengths), text=False)
+                table_pending = True
+            seen = Counter()
+            seen_count = 0
+
+        # The payload size is known from the table, before coding anything
+        coded_bits = sum(lengths[byte] * count for byte, count in counts.items())
+        if len(data) - (coded_bits + 7) // 8 < len(data) * STORE_THRESHOLD:
+            yield _seal(_pack_stored(len(data), len(data)) + data), len(data), False
+            continue
+
+        payload = b"".join(encode_chunks([data], None, encoder=encoder))
+        has_table, table_pending = table_pending, False
+        if has_table:
+            record = _pack_block(MODE_BYTES, len(data), lengths, len(payload))
+        else:
+            record = _pack_record(BLOCK_REPEAT, len(data), len(payload))
+        yield _seal(record + payload), len(data), has_table
+
+
+def _decode_block(mode, lengths, payload, symbol_count):
+    if lengths is None:
+        return payload if mode == MODE_BYTES else payload.decode('utf-8')
+    table = _decode_table(mode, lengths, symbol_count)
+    return table.empty.join(decode_chunks([payload], table, symbol_count=symbol_count))
+
+
+@contextlib.contextmanager
+def _worker_pool(workers):
+    """Yield a process pool for workers > 1, or None to run in-process."""
+    if workers <= 1:
+        yield None
+        return
+    # Imported here so the command line starts without loading multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield pool
+
+
+def _map_ordered(function, tasks, workers):
+    """Yield function(*task) for each task in order, on up to ``workers`` processes.
+
+    At most two tasks per worker are in flight, so memory use stays bounded
+    however many tasks there are.
+    """
+    with _worker_pool(workers) as pool:
+        if pool is None:
+            for task in tasks:
+                yield function(*task)
+            return
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.submit(function, *task))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _resolve_workers(workers):
+    if workers is None:
+        return os.cpu_count() or 1
+    return max(workers, 1)
+
+
+def _block_workers(workers, blocks):
+    """Processes worth starting for ``blocks`` blocks (None if not known), at most ``workers``.
+
+    Processes beyond the CPU count only add overhead, and so does a pool
+    for fewer than MIN_PARALLEL_BLOCKS blocks.
+    """
+    if blocks is not None and blocks < MIN_PARALLEL_BLOCKS:
+        return 1
+    return min(workers, os.cpu_count() or 1)
+
+
+def _frequency_pass(src, mode, checksum):
+    """First pass: count symbols in IO_CHUNK_SIZE pieces, adding them to ``checksum``.
+
+    Returns (frequency, symbol_count, replay) where ``replay(size)`` reads
+    the input again in pieces of ``size`` for the encoding pass. Streams that cannot seek are
+    spooled to a temporary file while they are counted.
+    """
+    import tempfile
+
+    spool = None
+    if src.seekable():
+        start = src.tell()
+    elif mode == MODE_BYTES:
+        spool = tempfile.TemporaryFile('w+b')
+    else:
+        spool = tempfile.TemporaryFile('w+', encoding='utf-8', newline='')
+
+    frequency = Counter()
+    symbol_count = 0
+    for data in _read_chunks(src):
+        # Counter counts the bytes or characters of the buffer in C
+        frequency.update(data)
+        symbol_count += len(data)
+        checksum.update(data)
+        if spool is not None:
+            spool.write(data)
+
+    def replay(size=IO_CHUNK_SIZE):
+        stream = src if spool is None else spool
+        stream.seek(start if spool is None else 0)
+        try:
+            yield from _read_chunks(stream, size)
+        finally:
+            if spool is not None:
+                spool.close()
+
+    return frequency, symbol_count, replay
+
+
+class HuffmanDictionary:
+    """A byte code table trained on sample data and shared by many files.
 
-def decompress_file(file_path, decompressed_file):
-    compressed_file = file_path
-    codes_file = file_path + ".codes"
+    Files compressed with it store its ``dictionary_id`` instead of a table,
+    which makes small files nearly free of overhead. Every byte value has a
+    code, so any input can be compressed with it. The ID is the CRC-32 of
+    the table. The encoder lookup table is built on first use and kept.
+    """
 
-    # Load Huffman codes from the file
+    def __init__(self, lengths):
+        self.lengths = lengths
+        self.alphabet_size, self.symbols_size, self.table = _pack_table(MODE_BYTES, lengths)
+        self.dictionary_id = zlib.crc32(self.table)
+        self._encoder = None
+
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            self._encoder = _symbol_encoder(canonical_codes(self.lengths), text=False)
+        return self._encoder
+
+
+def train_dictionary(samples, max_code_length=MAX_CODE_LENGTH):
+    """Build a HuffmanDictionary from sample files (paths or binary file objects).
+
+    Byte values missing from the samples get one extra count so they can
+    still be coded.
+    """
+    frequency = Counter(range(256))
+    for sample in samples:
+        with _open_stream(sample, 'rb') as f:
+            for data in _read_chunks(f):
+                frequency.update(data)
+    return HuffmanDictionary(build_code_lengths(frequency, max_code_length))
+
+
+def save_dictionary(dictionary, path):
+    """Write a dictionary file. A directory gets <id>.hufdict inside it.
+
+    Returns the path written.
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, f"{dictionary.dictionary_id:08x}{DICTIONARY_SUFFIX}")
+    with open(path, 'wb') as f:
+        f.write(DICTIONARY_MAGIC)
+        f.write(_DICTIONARY.pack(DICTIONARY_VERSION, MODE_BYTES, dictionary.dictionary_id,
+                                 dictionary.alphabet_size, dictionary.symbols_size))
+        f.write(dictionary.table)
+    return path
+
+
+def load_dictionary(path):
+    """Read a dictionary file, reusing the cached copy while the file is unchanged."""
+    status = os.stat(path)
+    return _load_dictionary(os.path.realpath(path), status.st_mtime_ns, status.st_size)
+
+
+@functools.lru_cache(maxsize=TABLE_CACHE_SIZE)
+def _load_dictionary(path, mtime_ns, size):
+    with open(path, 'rb') as f:
+        if f.read(len(DICTIONARY_MAGIC)) != DICTIONARY_MAGIC:
+            raise ValueError(f"{path} is not a Huffman dictionary")
+        version, mode, dictionary_id, alphabet_size, symbols_size = \
+            _DICTIONARY.unpack(_read_exact(f, _DICTIONARY.size))
+        if version != DICTIONARY_VERSION or mode != MODE_BYTES:
+            raise ValueError(f"Unsupported dictionary version or mode in {path}")
+        dictionary = HuffmanDictionary(_read_table(f, mode, alphabet_size, symbols_size))
+    if dictionary.dictionary_id != dictionary_id:
+        raise ValueError(f"Dictionary {path} is corrupt: its table does not match its ID")
+    return dictionary
+
+
+def find_dictionary(dictionary_id, dictionary=None):
+    """Return the HuffmanDictionary with the given ID.
+
+    ``dictionary`` may be a HuffmanDictionary, a dictionary file or a
+    directory of <id>.hufdict files. If it is None, the directories in the
+    HUFFMAN_DICTIONARY_PATH environment variable are searched.
+    """
+    if isinstance(dictionary, HuffmanDictionary):
+        found = dictionary
+    elif dictionary is not None and not os.path.isdir(dictionary):
+        found = load_dictionary(dictionary)
+    else:
+        if dictionary is not None:
+            directories = [dictionary]
+        else:
+            directories = [d for d in os.environ.get("HUFFMAN_DICTIONARY_PATH", "").split(os.pathsep) if d]
+        name = f"{dictionary_id:08x}{DICTIONARY_SUFFIX}"
+        for directory in directories:
+            if os.path.exists(os.path.join(directory, name)):
+                return load_dictionary(os.path.join(directory, name))
+        raise ValueError(f"Dictionary {dictionary_id:08x} not found")
+    if found.dictionary_id != dictionary_id:
+        raise ValueError(f"File needs dictionary {dictionary_id:08x}, not {found.dictionary_id:08x}")
+    return found
+
+
+def compress_file(file_path, compressed_file, mode="bytes", block_size=None, workers=1, verbose=True,
+                  max_code_length=MAX_CODE_LENGTH, adaptive=False, dictionary=None, progress=None):
+    """Compress a file into a .huf container.
+
+    In "bytes" mode the alphabet is the 256 byte values and any file type
+    round-trips exactly. "text" mode reads UTF-8 and codes characters. Both
+    arguments may be paths or open file objects, including pipes.
+
+    By default the whole input is coded with one table: it is read in two
+    passes of IO_CHUNK_SIZE pieces, one to count symbols and one to encode
+    them, so memory use does not grow with the size of the input. With a
+    ``block_size`` (or ``workers`` > 1, which implies BLOCK_SIZE) the input
+    is instead split into independent blocks of that many symbols, each with
+    its own table, and the blocks are coded in a single pass on ``workers``
+    processes. ``workers=None`` uses every CPU; inputs of fewer than
+    MIN_PARALLEL_BLOCKS blocks are coded in-process. The output does not
+    depend on the number of workers. ``verbose=False`` suppresses the
+    success message.
+
+    Codes are limited to ``max_code_length`` bits (None for no limit), which
+    bounds the decoder's tables; see length_limit_cost for what it costs.
+
+    ``adaptive=True`` compresses bytes in a single pass for live streams such
+    as sockets or growing logs: each read is coded and flushed at once with
+    a table predicted from the input before it, so output starts with the
+    first read. It costs a block header per read and a little ratio.
+
+    ``dictionary`` (a HuffmanDictionary or dictionary file, bytes mode only)
+    codes the input with a trained table that is referenced by its ID
+    rather than stored, for large numbers of small files. Input the
+    dictionary would not shrink is written as if no dictionary was given,
+    which stores it raw unless a table of its own pays.
+
+    Every block record ends with a CRC-32 of itself and the container holds
+    a CRC-32 of the input; decompress_file and verify_file check them.
+
+    ``progress(done, total)``, if given, is called after every read of the
+    input with the bytes read so far and the bytes to read in all (twice the
+    file size when it is read in two passes, None for pipes). An exception
+    raised from it stops the compression and propagates; an output path is
+    then left as it was.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode {mode!r}, expected one of {', '.join(MODES)}")
+    mode = MODES[mode]
+    workers = _resolve_workers(workers)
+    if adaptive and (mode != MODE_BYTES or block_size is not None or workers > 1):
+        raise ValueError("Adaptive compression works in bytes mode, without blocks or workers")
+    if dictionary is not None:
+        if mode != MODE_BYTES or adaptive or block_size is not None or workers > 1:
+            raise ValueError("Dictionary compression works in bytes mode, without blocks or workers")
+        if not isinstance(dictionary, HuffmanDictionary):
+            dictionary = load_dictionary(dictionary)
+    if block_size is None and workers > 1:
+        block_size = BLOCK_SIZE
+    if workers > 1:
+        blocks = None
+        if _is_path(file_path) and os.path.isfile(file_path):
+            # A UTF-8 file has at most as many characters as bytes
+            blocks = -(-os.path.getsize(file_path) // block_size)
+        workers = _block_workers(workers, blocks)
+
+    read_mode = 'rb' if mode == MODE_BYTES else 'r'
+    passes = 2 if block_size is None and not adaptive else 1
+    with _open_input(file_path, read_mode, progress, passes) as src, _open_stream(compressed_file, 'wb') as dst:
+        # CRC-32 of the original data
+        checksum = _Checksum()
+        if passes == 2:
+            frequency, symbol_count, replay = _frequency_pass(src, mode, checksum)
+        if dictionary is not None:
+            coded_bits = sum(dictionary.lengths[byte] * count for byte, count in frequency.items())
+            coded_size = _DICTIONARY_ID.size + len(_pack_varints(symbol_count)) + _CHECKSUM.size + (coded_bits + 7) // 8
+            if coded_size > _stored_size(symbol_count):
+                # Nothing gained: code the input as if there were no dictionary
+                dictionary = None
+
+        flags = (FLAG_ADAPTIVE if adaptive else 0) | (FLAG_DICTIONARY if dictionary is not None else 0)
+        header = _pack_header(mode, flags)
+        dst.write(header)
+        offset = len(header)
+        index = []
+        symbol_offset = 0
+
+        if dictionary is not None:
+            dst.write(_DICTIONARY_ID.pack(dictionary.dictionary_id) + _pack_varints(symbol_count)
+                      + _CHECKSUM.pack(checksum.value))
+            for chunk in encode_chunks(replay(IO_CHUNK_SIZE), None, encoder=dictionary.encoder):
+                dst.write(chunk)
+        elif adaptive:
+            dst.flush()
+            for record, symbol_count, has_table in _encode_adaptive(src, checksum, max_code_length):
+                dst.write(record)
+                dst.flush()
+                # Later blocks are reached by walking from one with a table
+                if has_table or not index:
+                    index += _block_index(offset, symbol_offset, symbol_count, [])
+                offset += len(record)
+                symbol_offset += symbol_count
+        elif block_size is None:
+            raw_size = _raw_size(mode, frequency)
+            if symbol_count and not _worth_coding(frequency, raw_size):
+                # Already compressed or random input is copied as it is
+                block = _pack_stored(symbol_count, raw_size)
+                dst.write(block)
+                record_checksum = _Checksum(block)
+                for data in record_checksum.feed(replay()):
+                    dst.write(data if mode == MODE_BYTES else data.encode('utf-8'))
+                dst.write(_CHECKSUM.pack(record_checksum.value))
+                index += _block_index(offset, 0, symbol_count, [])
+                offset += len(block) + raw_size + _CHECKSUM.size
+                symbol_offset = symbol_count
+            elif symbol_count:
+                # Canonical codes come from the code lengths of the tree
+                lengths = build_code_lengths(frequency, max_code_length)
+                huffman_codes = canonical_codes(lengths)
+
+                # The payload size is known up front from the code lengths
+                total_bits = sum(lengths[char] * count for char, count in frequency.items())
+                block = _pack_block(mode, symbol_count, lengths, (total_bits + 7) // 8)
+                dst.write(block)
+                record_checksum = _Checksum(block)
+                checkpoints = []
+                chunks = encode_chunks(replay(CHECKPOINT_INTERVAL), huffman_codes, checkpoints=checkpoints)
+                for chunk in record_checksum.feed(chunks):
+                    dst.write(chunk)
+                dst.write(_CHECKSUM.pack(record_checksum.value))
+                index += _block_index(offset, 0, symbol_count, checkpoints)
+                offset += len(block) + (total_bits + 7) // 8 + _CHECKSUM.size
+                symbol_offset = symbol_count
+        else:
+            blocks = checksum.feed(_read_chunks(src, block_size))
+            tasks = ((mode, data, max_code_length) for data in blocks)
+            for record, symbol_count, checkpoints in _map_ordered(_encode_block, tasks, workers):
+                dst.write(record)
+                index += _block_index(offset, symbol_offset, symbol_count, checkpoints)
+                offset += len(record)
+                symbol_offset += symbol_count
+
+        if not flags & FLAG_DICTIONARY:
+            dst.write(_pack_index(index, offset, symbol_offset, checksum.value))
+
+    if verbose and _is_path(compressed_file):
+        print(f"File compressed successfully: {compressed_file}")
+
+
+class DecodeTable:
+    """Prefix lookup table for decoding a Huffman bit stream.
+
+    ``entries`` is indexed by the next ``bits`` bits of the stream. Each entry
+    holds every symbol that fits completely inside those bits (joined into one
+    chunk) and the number of bits they use, so a single lookup usually emits
+    several symbols. ``first`` holds only the first symbol of each entry and is
+    used near the end of the stream where the padding must not be decoded.
+    Codes longer than ``bits`` get a zero-length entry and are resolved through
+    a second level: ``long_entries``, indexed by the next ``max_length`` bits,
+    when codes are at most MAX_CODE_LENGTH bits long, and the ``long_codes``
+    map otherwise. Symbols are stored as one-symbol output
+    chunks made by ``join``: ``"".join`` for text and ``bytes`` for byte
+    values, and ``empty`` joins chunks back together.
+    """
+
+    def __init__(self, huffman_codes, bits=DECODE_TABLE_BITS, join="".join):
+        self.bits = bits
+        self.empty = join([])
+        self.long_codes = {}
+        self.max_length = 0
+
+        size = 1 << bits
+        first = [(None, 0)] * size
+        for char, code in huffman_codes.items():
+            length = len(code)
+            if length == 0:
+                raise ValueError("Huffman codes must be at least one bit long")
+            value = int(code, 2)
+            char = join([char])
+            self.max_length = max(self.max_length, length)
+            if length > bits:
+                self.long_codes[(length, value)] = char
+                continue
+            start = value << (bits - length)
+            first[start:start + (1 << (bits - length))] = [(char, length)] * (1 << (bits - length))
+        self.first = first
+
+        self.long_entries = None
+        if self.long_codes and self.max_length <= MAX_CODE_LENGTH:
+            self.long_entries = [None] * (1 << self.max_length)
+            for (length, value), char in self.long_codes.items():
+                start = value << (self.max_length - length)
+                self.long_entries[start:start + (1 << (self.max_length - length))] = \
+                    [(char, length)] * (1 << (self.max_length - length))
+
+        # Greedily pack as many whole symbols as fit into each entry
+        mask = size - 1
+        entries = []
+        for index in range(size):
+            symbols = []
+            used = 0
+            while True:
+                char, length = first[(index << used) & mask]
+                if not length or length > bits - used:
+                    break
+                symbols.append(char)
+                used += length
+            entries.append((self.empty.join(symbols), used))
+        self.entries = entries
+
+    def decode_long(self, acc, nbits):
+        """Resolve a code longer than the primary table from the top of acc."""
+        if self.long_entries is not None:
+            length = self.max_length
+            if length > nbits:
+                value = (acc << (length - nbits)) & ((1 << length) - 1)
+            else:
+                value = (acc >> (nbits - length)) & ((1 << length) - 1)
+            entry = self.long_entries[value]
+            if entry is not None:
+                return entry
+            raise ValueError("Corrupt Huffman stream: no code matches the input bits")
+        for length in range(self.bits + 1, self.max_length + 1):
+            if length > nbits:
+                value = (acc << (length - nbits)) & ((1 << length) - 1)
+            else:
+                value = (acc >> (nbits - length)) & ((1 << length) - 1)
+            char = self.long_codes.get((length, value))
+            if char is not None:
+                return char, length
+        raise ValueError("Corrupt Huffman stream: no code matches the input bits")
+
+
+def decode_chunks(chunks, table, symbol_count=None, padding_bits=0, skip_bits=0):
+    """Decode an iterable of byte chunks, yielding decoded output chunks.
+
+    The stream is consumed 64 bits at a time through the lookup table. The
+    output of each input chunk is collected in a bytearray for bytes (joining
+    a list of short bytes objects takes 80 bytes of scratch space per item)
+    or joined from a list for text, and yielded. Decoding stops after
+    ``symbol_count`` symbols, or when only ``padding_bits`` bits are left if
+    the count is not known. The first ``skip_bits`` (< 8) bits are ignored,
+    so decoding can start at any bit offset.
+    """
+    bits = table.bits
+    bits_mask = (1 << bits) - 1
+    entries = table.entries
+    max_length = max(table.max_length, bits)
+    masks = [(1 << n) - 1 for n in range(64 + max_length + 1)]
+    join = table.empty.join
+    binary = isinstance(table.empty, bytes)
+
+    acc = 0
+    nbits = 0
+    produced = 0
+    carry = b""
+    if skip_bits:
+        chunks = iter(chunks)
+        data = next(chunks, b"")
+        if data:
+            acc = data[0] & masks[8 - skip_bits]
+            nbits = 8 - skip_bits
+            chunks = itertools.chain([data[1:]], chunks)
+    for data in chunks:
+        buf = carry + data
+        # Hold back the last word: the tail may contain padding
+        usable = (len(buf) - 8) // 8 * 8
+        if usable <= 0:
+            carry = buf
+            continue
+        carry = buf[usable:]
+        words = struct.unpack_from(f">{usable // 8}Q", buf)
+
+        out = bytearray() if binary else []
+        append = out.extend if binary else out.append
+        wi = 0
+        nwords = len(words)
+        while True:
+            if nbits < max_length:
+                if wi == nwords:
+                    break
+                acc = ((acc & masks[nbits]) << 64) | words[wi]
+                wi += 1
+                nbits += 64
+            chunk, used = entries[(acc >> (nbits - bits)) & bits_mask]
+            if not used:
+                chunk, used = table.decode_long(acc, nbits)
+            append(chunk)
+            nbits -= used
+        # Bits left over in acc (less than one code) roll into the next chunk
+        decoded = out if binary else join(out)
+        produced += len(decoded)
+        if symbol_count is not None and produced >= symbol_count:
+            # Only happens when decoding part of a payload
+            yield decoded[:len(decoded) - (produced - symbol_count)]
+            return
+        if decoded:
+            yield decoded
+
+    # Tail: decode one symbol at a time so the padding is never emitted
+    acc = ((acc & masks[nbits]) << (len(carry) * 8)) | int.from_bytes(carry, "big")
+    nbits += len(carry) * 8
+    first = table.first
+    out = []
+    while True:
+        if symbol_count is not None:
+            if produced >= symbol_count:
+                break
+        elif nbits <= padding_bits:
+            break
+        if nbits >= bits:
+            index = (acc >> (nbits - bits)) & bits_mask
+        else:
+            index = (acc << (bits - nbits)) & bits_mask
+        char, used = first[index]
+        if not used:
+            char, used = table.decode_long(acc, nbits)
+        if used > nbits:
+            raise ValueError("Corrupt Huffman stream: unexpected end of data")
+        out.append(char)
+        produced += 1
+        nbits -= used
+    if out:
+        yield join(out)
+
+
+def _load_codes(codes_file):
+    """Read a .codes file into a {char: code} mapping."""
     huffman_codes = {}
     with open(codes_file, 'r', encoding='utf-8') as f:
         for line in f:
             char_hex, code = line.strip().split("\t", 1)
             char = bytes.fromhex(char_hex).decode('utf-8')  # Decode from hex
-            huffman_codes[code] = char
+            huffman_codes[char] = code
+    return huffman_codes
+
+
+def _read_chunks(f, size=IO_CHUNK_SIZE, limit=None):
+    """Yield reads of up to size from f, stopping after limit if one is given."""
+    while limit is None or limit > 0:
+        data = f.read(size if limit is None else min(size, limit))
+        if not data:
+            if limit is not None:
+                raise ValueError("Compressed file is truncated")
+            break
+        if limit is not None:
+            limit -= len(data)
+        yield data
 
-    with open(compressed_file, 'rb') as f:
-        byte_array = f.read()
 
+def _decode_bits_reference(byte_array, huffman_codes, symbol_count=None):
+    """Decode bit by bit through a {code: symbol} dict, returning the symbols."""
     # Convert bytes back to binary string
     bit_string = "".join(f"{byte:08b}" for byte in byte_array)
 
-    # Extract padding info
-    extra_padding = int(bit_string[:8], 2)
-    encoded_data = bit_string[8:-extra_padding]
+    if symbol_count is None:
+        # Extract padding info
+        extra_padding = int(bit_string[:8], 2)
+        encoded_data = bit_string[8:-extra_padding]
+    else:
+        encoded_data = bit_string
 
     # Decode the data using Huffman codes
-    with open(decompressed_file, 'w', encoding='utf-8') as f:
-        current_code = ""
-        for bit in encoded_data:
-            current_code += bit
-            if current_code in huffman_codes:
-                f.write(huffman_codes[current_code])
-                current_code = ""
+    decoded = []
+    current_code = ""
+    for bit in encoded_data:
+        if len(decoded) == symbol_count:
+            break
+        current_code += bit
+        if current_code in huffman_codes:
+            decoded.append(huffman_codes[current_code])
+            current_code = ""
+    return decoded
+
+
+def decompress_file_reference(file_path, decompressed_file):
+    """Bit-by-bit decoder kept as a reference for decompress_file."""
+    decoded = []
+    with open(file_path, 'rb') as f:
+        if f.read(len(MAGIC)) == MAGIC:
+            f.seek(0)
+            mode, _, stream = _read_header(f)
+            for symbol_count, lengths, payload_size, _ in _read_blocks(f, mode, stream):
+                byte_array = f.read() if payload_size is None else _read_exact(f, payload_size)
+                if lengths is None:
+                    decoded += byte_array if mode == MODE_BYTES else byte_array.decode('utf-8')
+                    continue
+                huffman_codes = {code: char for char, code in canonical_codes(lengths).items()}
+                decoded += _decode_bits_reference(byte_array, huffman_codes, symbol_count)
+        else:
+            # Load Huffman codes from the .codes file
+            f.seek(0)
+            mode = MODE_TEXT
+            huffman_codes = {code: char for char, code in _load_codes(file_path + ".codes").items()}
+            decoded = _decode_bits_reference(f.read(), huffman_codes)
+
+    if mode == MODE_BYTES:
+        with open(decompressed_file, 'wb') as f:
+            f.write(bytes(decoded))
+    else:
+        with open(decompressed_file, 'w', encoding='utf-8', newline='') as f:
+            f.write("".join(decoded))
 
     print(f"File decompressed successfully: {decompressed_file}")
 
-def benchmark_file(file_path):
+
+def _decompress_legacy(chunks, codes_file, dst):
+    """Decode the old two-file format: a padding byte plus a .codes sidecar."""
+    table = DecodeTable(_load_codes(codes_file))
+
+    # The first byte holds the number of padding bits at the end
+    chunks = iter(chunks)
+    header = next(chunks, b"")
+    if not header:
+        raise ValueError("Compressed file is empty")
+    extra_padding = header[0]
+    chunks = itertools.chain([header[1:]], chunks)
+
+    for chunk in decode_chunks(chunks, table, padding_bits=extra_padding):
+        dst.write(chunk)
+
+
+def _decode_blocks(src, dst, mode, flags, stream, workers):
+    """Decode every block of src into dst, in order.
+
+    With workers > 1 blocks are decoded on a process pool, keeping at most
+    two per worker in flight. Blocks too large to hand to a worker, and
+    single stream payloads, are decoded here as a stream, and stored blocks
+    are copied through. Adaptive files are decoded here block by block,
+    flushing each so output keeps pace with a live input, and reuse the
+    decode table for as long as the code table. Every block record is
+    checked as it is read, and the output is checked against the symbol
+    count and CRC-32 of the original at the end.
+    """
+    adaptive = flags & FLAG_ADAPTIVE
+    if adaptive:
+        workers = 1
+    table_lengths = None
+    checksum = _Checksum()
+    produced = 0
+
+    def write(data):
+        checksum.update(data)
+        dst.write(data)
+
+    with _worker_pool(workers) as pool:
+        pending = deque()
+        for symbol_count, lengths, payload_size, record in _read_blocks(src, mode, stream, verify=True):
+            produced += symbol_count
+            if (pool is not None and lengths is not None and payload_size is not None
+                    and payload_size <= MAX_WORKER_PAYLOAD):
+                payload = _read_exact(src, payload_size)
+                if record is not None:
+                    record.update(payload)
+                pending.append(pool.submit(_decode_block, mode, lengths, payload, symbol_count))
+                if len(pending) >= workers * 2:
+                    write(pending.popleft().result())
+                continue
+
+            while pending:
+                write(pending.popleft().result())
+            chunks = _read_chunks(src, limit=payload_size)
+            if record is not None:
+                chunks = record.feed(chunks)
+            # Stored text goes straight to the underlying binary file when
+            # there is one, skipping a UTF-8 decode and encode
+            raw = dst if mode == MODE_BYTES else getattr(dst, 'buffer', None)
+            if lengths is None and raw is not None:
+                dst.flush()
+                for chunk in chunks:
+                    checksum.update(chunk)
+                    raw.write(chunk)
+            elif lengths is None:
+                for chunk in codecs.iterdecode(chunks, 'utf-8'):
+                    write(chunk)
+            else:
+                if lengths is not table_lengths:
+                    table = _decode_table(mode, lengths, ADAPTIVE_INTERVAL if adaptive else symbol_count)
+                    table_lengths = lengths
+                for chunk in decode_chunks(chunks, table, symbol_count=symbol_count):
+                    write(chunk)
+            if adaptive:
+                dst.flush()
+        while pending:
+            write(pending.popleft().result())
+
+    if stream is not None:
+        symbol_count, expected = stream[0], stream[2]
+    else:
+        # The index and trailer follow the end marker
+        rest = b"".join(_read_chunks(src))
+        symbol_count, expected = _unpack_trailer(rest)[1:4:2]
+        _check_index(rest)
+    if produced != symbol_count or checksum.value != expected:
+        raise ValueError("Corrupt compressed file: decoded data does not match its checksum")
+
+
+def _trailer_counts(src, stream, base):
+    """(symbol count, block count) recorded in the container starting at ``base``, or Nones if they cannot be read.
+
+    Damaged trailers also give Nones; decoding reports them.
+    """
+    if stream is not None:
+        return stream[0], 1
+    if not src.seekable():
+        return None, None
+    # Read beneath any progress reporting, which counts the pass over the blocks only
+    f = src.raw if isinstance(src, _ProgressStream) else src
+    position = f.tell()
+    try:
+        return _read_trailer(f, base)[1:3]
+    except ValueError:
+        return None, None
+    finally:
+        f.seek(position)
+
+
+def _preallocate(f, size):
+    """Reserve ``size`` bytes for the output file f where the platform can.
+
+    The file gets its final size in one allocation instead of growing with
+    every write, and a full disk fails before decoding starts. Streams and
+    file systems without support are left alone. Returns whether space was
+    reserved, in which case the caller truncates f once it is written.
+    """
+    if not size or not hasattr(os, 'posix_fallocate'):
+        return False
+    try:
+        fileno = f.fileno()
+        if not stat.S_ISREG(os.fstat(fileno).st_mode):
+            return False
+        os.posix_fallocate(fileno, f.tell(), size)
+    except io.UnsupportedOperation:
+        return False
+    except OSError as error:
+        if error.errno == errno.ENOSPC:
+            raise
+        return False
+    return True
+
+
+def decompress_file(file_path, decompressed_file, workers=1, verbose=True, dictionary=None, progress=None):
+    """Decompress a .huf container.
+
+    The output is written as bytes or UTF-8 text according to the mode
+    recorded in the header. Both arguments may be paths or open file objects,
+    including pipes. Payloads are decoded one IO_CHUNK_SIZE piece at a time
+    and written out as they go; files written in block mode can be decoded
+    on ``workers`` processes (None uses every CPU), if they have at least
+    MIN_PARALLEL_BLOCKS blocks. Bytes output files are preallocated to the
+    original size. ``verbose=False`` suppresses the success message. Files
+    compressed with a dictionary find it through ``dictionary`` as described
+    in find_dictionary. Checksums are verified as the file is decoded and a
+    mismatch raises ValueError; an output path is then left as it was.
+    ``progress`` is called with the compressed bytes read, as in
+    compress_file.
+    """
+    workers = _resolve_workers(workers)
+    with _open_input(file_path, 'rb', progress) as src:
+        base = src.tell() if src.seekable() else 0
+        prefix = src.read(len(MAGIC))
+
+        # Files without the magic number come from the old .codes format
+        codes_file = os.fspath(file_path) + ".codes" if _is_path(file_path) else None
+        if prefix != MAGIC and codes_file and os.path.exists(codes_file):
+            with _open_stream(decompressed_file, 'w') as dst:
+                _decompress_legacy(itertools.chain([prefix], _read_chunks(src)), codes_file, dst)
+        else:
+            mode, flags, stream = _read_header(src, prefix, dictionary)
+            write_mode = 'wb' if mode == MODE_BYTES else 'w'
+            with _open_stream(decompressed_file, write_mode) as dst:
+                symbol_count, block_count = _trailer_counts(src, stream, base)
+                reserved = mode == MODE_BYTES and _preallocate(dst, symbol_count)
+                _decode_blocks(src, dst, mode, flags, stream, _block_workers(workers, block_count))
+                if reserved:
+                    dst.truncate()
+
+    if verbose and _is_path(decompressed_file):
+        print(f"File decompressed successfully: {decompressed_file}")
+
+
+def _unpack_trailer(data):
+    """Parse the trailer that ends ``data``.
+
+    Returns (index offset, symbol count, block count, checksum, trailer
+    size).
+    """
+    if len(data) < _TRAILER.size:
+        raise ValueError("Compressed file is truncated")
+    checksum, fields_size, _, tag = _TRAILER.unpack(data[-_TRAILER.size:])
+    if tag != INDEX_MAGIC:
+        raise ValueError("Compressed file has no block index")
+    size = _TRAILER.size + fields_size
+    if len(data) < size:
+        raise ValueError("Compressed file is truncated")
+    fields = _unpack_varints(data[-size:-_TRAILER.size])
+    if len(fields) != 3:
+        raise ValueError("Corrupt compressed file: bad trailer")
+    return fields[0], fields[1], fields[2], checksum, size
+
+
+def _check_index(data):
+    """Check the CRC-32 of the index and trailer; ``data`` runs from the index to the end of the file."""
+    covered = len(data) - _CHECKSUM.size - len(INDEX_MAGIC)
+    expected = _CHECKSUM.unpack(data[covered:covered + _CHECKSUM.size])[0]
+    if zlib.crc32(data[:covered]) != expected:
+        raise ValueError("Corrupt compressed file: checksum mismatch in the block index")
+
+
+def _read_trailer(f, base=0):
+    """Read the trailer from the end of a seekable container.
+
+    Returns (index offset, symbol count, block count, checksum, trailer
+    offset) as _unpack_trailer does, after checking the CRC of the index
+    and trailer.
+    """
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    f.seek(max(base, end - _TRAILER_MAX_SIZE))
+    index_offset, symbol_count, block_count, checksum, size = _unpack_trailer(f.read())
+    if base + index_offset > end - size:
+        raise ValueError("Corrupt compressed file: index offset is past the trailer")
+    f.seek(base + index_offset)
+    _check_index(f.read())
+    return index_offset, symbol_count, block_count, checksum, end - size
+
+
+def _read_index(f, base=0):
+    """Read the block index from the end of a seekable container.
+
+    Returns (entries, symbol_count) with entries as (block offset, bit
+    offset, symbol offset) tuples sorted by symbol offset.
+    """
+    index_offset, symbol_count, _, _, trailer_offset = _read_trailer(f, base)
+    f.seek(base + index_offset)
+    values = _unpack_varints(_read_exact(f, trailer_offset - base - index_offset))
+    if len(values) % 3:
+        raise ValueError("Corrupt compressed file: bad block index")
+    return list(zip(values[::3], values[1::3], values[2::3])), symbol_count
+
+
+def read_range(file_path, start, length, dictionary=None):
+    """Decode ``length`` symbols starting at symbol ``start`` of a .huf file.
+
+    Symbols are bytes in bytes mode and characters in text mode; the result
+    is bytes or str accordingly, shorter if the range runs past the end. The
+    block index is used to seek to the last checkpoint at or before
+    ``start``, so only the blocks covering the range are read and decoded.
+    ``file_path`` may be a path or a seekable binary file object.
+    ``dictionary`` is used as in decompress_file.
+    """
+    with _open_stream(file_path, 'rb') as f:
+        base = f.tell()
+        mode, _, stream = _read_header(f, dictionary=dictionary)
+        empty = b"" if mode == MODE_BYTES else ""
+        if stream is not None:
+            # Dictionary files have no index: decode from the beginning
+            symbol_count, lengths, _ = stream
+            table = _decode_table(mode, lengths, symbol_count)
+            decoded = empty.join(decode_chunks(_read_chunks(f), table, symbol_count=min(symbol_count, start + length)))
+            return decoded[start:]
+
+        entries, symbol_count = _read_index(f, base)
+        end = min(start + length, symbol_count)
+        if start >= end:
+            return empty
+
+        position = bisect.bisect_right([entry[2] for entry in entries], start) - 1
+        block_offset, bit_offset, symbol_offset = entries[position]
+        # The first symbol of the block is at its bit 0 entry
+        block_start = position
+        while entries[block_start][1]:
+            block_start -= 1
+        block_symbol = entries[block_start][2]
+
+        out = []
+        lengths = table_lengths = None
+        while symbol_offset < end:
+            f.seek(base + block_offset)
+            block_count, block_lengths, payload_size, _ = next(_read_blocks(f, mode, lengths=lengths))
+            payload_offset = f.tell() - base
+            if block_symbol + block_count <= start:
+                # Blocks that reuse a table are not indexed: walk past them
+                symbol_offset = block_symbol = block_symbol + block_count
+                # Each block record ends with its CRC-32, which is not checked here
+                block_offset = payload_offset + payload_size + _CHECKSUM.size
+                lengths = block_lengths or lengths
+                continue
+
+            wanted = min(end, block_symbol + block_count) - symbol_offset
+            if block_lengths is None and mode == MODE_BYTES:
+                # Stored bytes are read directly at the start of the range
+                skip = max(start - symbol_offset, 0)
+                f.seek(base + payload_offset + skip)
+                out.append(_read_exact(f, wanted - skip))
+            elif block_lengths is None:
+                decoded = _read_exact(f, payload_size).decode('utf-8')
+                out.append(decoded[max(start - symbol_offset, 0):wanted])
+            else:
+                lengths = block_lengths
+                if lengths is not table_lengths:
+                    table = _decode_table(mode, lengths, block_count)
+                    table_lengths = lengths
+                f.seek(base + payload_offset + bit_offset // 8)
+                chunks = _read_chunks(f, 1 << 16, payload_size - bit_offset // 8)
+                decoded = empty.join(decode_chunks(chunks, table, symbol_count=wanted, skip_bits=bit_offset % 8))
+                out.append(decoded[max(start - symbol_offset, 0):])
+
+            # Continue with the next block from its first bit
+            symbol_offset = block_symbol = block_symbol + block_count
+            block_offset = payload_offset + payload_size + _CHECKSUM.size
+            bit_offset = 0
+        return empty.join(out)
+
+
+class _Discard(io.RawIOBase):
+    """Writable binary stream that drops everything written to it."""
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return len(data)
+
+
+def verify_file(file_path, full=False, dictionary=None, workers=1):
+    """Check a .huf container without writing any output.
+
+    The block records, code tables, end marker, index and trailer are
+    checked against each other, and every block's CRC-32 is checked while
+    the payloads are read but not decoded, so this runs at read speed.
+    With ``full``, and for dictionary files, whose data can only be checked
+    by decoding it, the payloads are decoded too, on ``workers`` processes,
+    and the output is checked against the CRC-32 of the original. Raises
+    ValueError for the first problem found, otherwise returns a dict with
+    the block and symbol counts and whether the data was decoded.
+    """
+    with _open_stream(file_path, 'rb') as f:
+        base = f.tell()
+        mode, _, stream = _read_header(f, dictionary=dictionary)
+        blocks, symbol_count = 1, None
+        if stream is None:
+            blocks, symbol_count = _verify_blocks(f, mode, base)
+        decoded = full or stream is not None
+        if decoded:
+            f.seek(base)
+            decompress_file(f, _Discard(), workers=workers, verbose=False, dictionary=dictionary)
+            if symbol_count is None:
+                symbol_count = stream[0]
+    return {"blocks": blocks, "symbols": symbol_count, "decoded": decoded}
+
+
+def _verify_blocks(f, mode, base):
+    """Walk the blocks of f checking their CRCs and the index; returns (blocks, symbols)."""
+    payload_start = f.tell()
+    index_offset, symbol_count, indexed, _, _ = _read_trailer(f, base)
+    entries, _ = _read_index(f, base)
+    f.seek(payload_start)
+
+    # Block offset -> (first symbol, symbol count, payload size)
+    blocks = {}
+    offset = payload_start - base
+    symbols = 0
+    for count, lengths, payload_size, record in _read_blocks(f, mode, verify=True):
+        blocks[offset] = (symbols, count, payload_size)
+        for chunk in _read_chunks(f, limit=payload_size):
+            record.update(chunk)
+        offset = f.tell() - base + _CHECKSUM.size
+        symbols += count
+
+    if f.tell() - base != index_offset:
+        raise ValueError("Corrupt compressed file: index is not after the last block")
+    if symbols != symbol_count:
+        raise ValueError(f"Corrupt compressed file: blocks hold {symbols} symbols, trailer says {symbol_count}")
+    if sum(1 for entry in entries if not entry[1]) != indexed:
+        raise ValueError("Corrupt compressed file: index and trailer disagree on the block count")
+    previous = 0
+    for block_offset, bit_offset, symbol_offset in entries:
+        first, count, payload_size = blocks.get(block_offset, (None, 0, 0))
+        if (first is None or symbol_offset < previous
+                or not first <= symbol_offset <= first + count
+                or (bit_offset == 0) != (symbol_offset == first)
+                or bit_offset > payload_size * 8):
+            raise ValueError(f"Corrupt compressed file: bad index entry for block at {block_offset}")
+        previous = symbol_offset
+    return len(blocks), symbols
+
+
+class _CountingStream(io.BufferedIOBase):
+    """Binary stream wrapper that counts the bytes read or written.
+
+    Used for stdin and stdout, whose sizes cannot be looked up afterwards.
+    It does not seek, so piped input is spooled for the second pass.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.count = 0
+
+    def readable(self):
+        return self.raw.readable()
+
+    def writable(self):
+        return self.raw.writable()
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.count += len(data)
+        return data
+
+    def read1(self, size=-1):
+        # Returns what is available without waiting for a full buffer
+        data = self.raw.read1(size)
+        self.count += len(data)
+        return data
+
+    def write(self, data):
+        self.raw.write(data)
+        self.count += len(data)
+        return len(data)
+
+    def flush(self):
+        self.raw.flush()
+
+
+class _ProgressStream(_CountingStream):
+    """Seekable binary reader that calls ``progress(count, total)`` after every read.
+
+    Reads go on counting after a seek, so a second pass over the input
+    counts again.
+    """
+
+    def __init__(self, raw, progress, total):
+        super().__init__(raw)
+        self.progress = progress
+        self.total = total
+
+    def seekable(self):
+        return self.raw.seekable()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.raw.seek(offset, whence)
+
+    def tell(self):
+        return self.raw.tell()
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.progress(self.count, self.total)
+        return data
+
+    def read1(self, size=-1):
+        data = super().read1(size)
+        self.progress(self.count, self.total)
+        return data
+
+
+def _expand_inputs(patterns, recursive, compressed):
+    """Expand command line arguments into input paths.
+
+    Globs are expanded here as well, for shells that leave them alone. With
+    ``recursive`` directories are walked, taking only .huf files when
+    ``compressed`` is set and skipping them otherwise.
+    """
+    import glob
+
+    for pattern in patterns:
+        if pattern == "-":
+            yield pattern
+            continue
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            if not (recursive and os.path.isdir(path)):
+                yield path
+                continue
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(".huf") == compressed:
+                        yield os.path.join(root, name)
+
+
+def _output_path(action, source):
+    if source == "-":
+        return "-"
+    if action == "compress":
+        return source + ".huf"
+    if source.endswith(".huf"):
+        return source[:-len(".huf")]
+    return source + ".out"
+
+
+def _cache_params(options):
+    """What a compressed file depends on besides its input, for compression_cache"""
+    dictionary = options.get("dictionary")
+    if dictionary is not None and not isinstance(dictionary, HuffmanDictionary):
+        dictionary = load_dictionary(dictionary)
+    block_size = options.get("block_size")
+    if block_size is None and _resolve_workers(options.get("workers", 1)) > 1:
+        block_size = BLOCK_SIZE
+    return {"format": FORMAT_VERSION, "mode": options.get("mode", "bytes"), "block_size": block_size,
+            "max_code_length": options.get("max_code_length", MAX_CODE_LENGTH),
+            "adaptive": options.get("adaptive", False),
+            "dictionary": dictionary.dictionary_id if dictionary is not None else None}
+
+
+def _run_file(action, source, target, force, options, cache=None):
+    """Compress or decompress one file for the command line.
+
+    ``options`` are keyword arguments for compress_file or decompress_file.
+    ``cache``, (directory, max bytes, link) for compression_cache.open_cache,
+    serves compressed files from earlier runs for inputs whose content and
+    options are unchanged; pipes bypass it. Returns (input size, output
+    size, seconds, error message). Errors are returned rather than raised so
+    one bad file does not stop a batch; the output file is then left as it
+    was.
+    """
     import time
 
-    start_time = time.time()
-    compressed_file = file_path + ".huf"
-    compress_file(file_path, compressed_file)
-    end_time = time.time()
-    print(f"Compression benchmark: {end_time - start_time:.2f} seconds")
+    if source != "-" and os.path.isdir(source):
+        return 0, 0, 0.0, f"{source} is a directory, use --recursive"
+    if target != "-" and not force and os.path.exists(target):
+        return 0, 0, 0.0, f"{target} already exists, use --force to overwrite"
 
+    src = _CountingStream(sys.stdin.buffer) if source == "-" else source
+    dst = _CountingStream(sys.stdout.buffer) if target == "-" else target
+    start_time = time.perf_counter()
+    try:
+        if action == "compress" and cache is not None and "-" not in (source, target):
+            import compression_cache
+
+            compression_cache.open_cache(*cache).run(
+                source, target, _cache_params(options), lambda: compress_file(src, dst, verbose=False, **options))
+        elif action == "compress":
+            compress_file(src, dst, verbose=False, **options)
+        else:
+            decompress_file(src, dst, verbose=False, **options)
+    except (OSError, ValueError) as error:
+        return 0, 0, 0.0, str(error)
+    elapsed = time.perf_counter() - start_time
+
+    input_size = src.count if source == "-" else os.path.getsize(source)
+    output_size = dst.count if target == "-" else os.path.getsize(target)
+    return input_size, output_size, elapsed, None
 
-def main():
-    while True:
-        print("\nChoose an option:")
-        print("1. Compress a file")
-        print("2. Decompress a file")
-        print("3. Benchmark compression")
-        print("4. Exit")
-        choice = input("Enter your choice (1/2/3/4): ")
-
-        if choice == "4":
-            print("Exiting...")
-            break
 
-        file_path = input("Enter the file path: ")
+def _verify_one(file_path, full, dictionary):
+    """verify_file for the command line, returning (result, error message)."""
+    try:
+        return verify_file(file_path, full, dictionary), None
+    except (OSError, ValueError) as error:
+        return None, str(error)
 
-        if choice == "1":
-            compressed_file = input("Enter the name for the compressed file (including extension): ")
-            compress_file(file_path, compressed_file)
-        elif choice == "2":
-            decompressed_file = input("Enter the name for the decompressed file (including extension): ")
-            decompress_file(file_path, decompressed_file)
-        elif choice == "3":
-            benchmark_file(file_path)
+
+def file_info(file_path):
+    """Describe a .huf container without decoding its payload.
+
+    Returns a dict with the format version, alphabet mode, whether it was
+    written by the adaptive encoder, block, code table, stored block and
+    symbol counts, compressed size, total size of the coded payloads
+    (everything else is header, tables, checksums and index), number of
+    index entries (None for dictionary files, which have no index) and the
+    ID of the dictionary the file needs, if any.
+    """
+    with _open_stream(file_path, 'rb') as f:
+        base = f.tell()
+        preamble = _read_exact(f, len(MAGIC) + 1)
+        mode, flags, stream = _read_header(f, preamble, resolve_dictionary=False)
+        payload_start = f.tell()
+        f.seek(0, os.SEEK_END)
+        size = f.tell() - base
+
+        dictionary_id = None
+        if flags & FLAG_DICTIONARY:
+            f.seek(base + len(preamble) + _HEADER.size)
+            dictionary_id = _DICTIONARY_ID.unpack(_read_exact(f, _DICTIONARY_ID.size))[0]
+        if stream is not None:
+            blocks, symbol_count, index_entries, stored = 1, stream[0], None, 0
+            tables = 0 if dictionary_id is not None else 1
+            payload_size = size - (payload_start - base)
         else:
-            print("Invalid choice. Please try again.")
+            entries, symbol_count = _read_index(f, base)
+            index_entries = len(entries)
+            blocks = tables = stored = payload_size = 0
+            previous = None
+            f.seek(payload_start)
+            # Walk the block headers, seeking past each payload
+            for block_count, lengths, block_payload_size, _ in _read_blocks(f, mode):
+                blocks += 1
+                if lengths is None:
+                    stored += 1
+                elif lengths is not previous:
+                    tables += 1
+                    previous = lengths
+                payload_size += block_payload_size
+                f.seek(block_payload_size, os.SEEK_CUR)
+
+    mode_name = next(name for name, value in MODES.items() if value == mode)
+    return {"version": preamble[len(MAGIC)], "mode": mode_name, "flags": flags,
+            "adaptive": bool(flags & FLAG_ADAPTIVE), "blocks": blocks, "tables": tables,
+            "stored": stored, "symbols": symbol_count, "size": size, "payload_size": payload_size,
+            "index_entries": index_entries, "dictionary": dictionary_id}
+
+
+def _print_info(file_path):
+    info = file_info(file_path)
+    line = f"{file_path}: version {info['version']}, {info['mode']} mode"
+    if info["adaptive"]:
+        line += " (adaptive)"
+    if info["dictionary"] is not None:
+        line += f" (dictionary {info['dictionary']:08x})"
+    line += f", {info['blocks']} block(s)"
+    if info["tables"] != info["blocks"]:
+        line += f" with {info['tables']} table(s)"
+    if info["stored"]:
+        line += f" and {info['stored']} stored"
+    line += (f", {info['symbols']:,} symbols, {info['size']:,} bytes "
+             f"({info['size'] - info['payload_size']:,} bytes of header, tables and index)")
+    if info["mode"] == "bytes" and info["symbols"]:
+        line += f", {100 * info['size'] / info['symbols']:.1f}% of original"
+    if info["index_entries"] is None:
+        line += ", no index"
+    else:
+        line += f", {info['index_entries']} index entries"
+    print(line)
+
+
+def main(argv=None):
+    """Command line entry point; returns the exit status.
+
+    Every file is handled independently: failures are reported on stderr and
+    make the exit status 1, but do not stop the rest of the batch. Only
+    standard library modules are imported, so startup stays fast.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="huffman", description="Huffman file compression")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    for action in ("compress", "decompress"):
+        command = commands.add_parser(action, help=f"{action} files, globs or directory trees")
+        command.add_argument("files", nargs="+", help="input files, globs or directories; '-' reads stdin")
+        command.add_argument("-o", "--output",
+                             help="output file for a single input, '-' for stdout (default: "
+                                  + ("FILE.huf" if action == "compress" else "FILE without .huf") + ")")
+        command.add_argument("-r", "--recursive", action="store_true", help="walk directories")
+        command.add_argument("-f", "--force", action="store_true", help="overwrite existing output files")
+        command.add_argument("-j", "--jobs", type=int, default=None,
+                             help="files processed in parallel, 0 for one per CPU "
+                                  "(default: one per CPU for several files unless --workers is set)")
+        command.add_argument("-q", "--quiet", action="store_true", help="do not print a summary per file")
+        command.add_argument("--workers", type=int, default=1,
+                             help="worker processes per file for block mode, 0 for one per CPU (default: 1)")
+        command.add_argument("-D", "--dictionary",
+                             help="trained dictionary file" + (" to code with" if action == "compress" else
+                                                               " or directory of them (default: search "
+                                                               "HUFFMAN_DICTIONARY_PATH)"))
+        if action == "compress":
+            command.add_argument("--mode", choices=list(MODES), default="bytes",
+                                 help="alphabet: bytes for any file, text for UTF-8 characters (default: bytes)")
+            command.add_argument("--block-size", type=int, default=None,
+                                 help="symbols per independent block (default: one block, or "
+                                      f"{BLOCK_SIZE} with several workers)")
+            command.add_argument("--max-code-length", type=int, default=MAX_CODE_LENGTH,
+                                 help=f"longest code in bits, 0 for no limit (default: {MAX_CODE_LENGTH})")
+            command.add_argument("--adaptive", action="store_true",
+                                 help="single pass for live streams: code and flush each read as it arrives")
+            command.add_argument("--cache", nargs="?", const="", metavar="DIR",
+                                 help="copy the output of an identical input compressed before with the same "
+                                      "options instead of compressing it again (default DIR: "
+                                      "~/.cache/file-compression/outputs)")
+            command.add_argument("--cache-size", default="1G",
+                                 help="evict the least recently used cached outputs beyond this size (default: 1G)")
+            command.add_argument("--cache-link", action="store_true",
+                                 help="hard link cached outputs instead of copying them; they must then not be "
+                                      "modified in place")
+
+    train = commands.add_parser("train", help="train a shared dictionary for many small files")
+    train.add_argument("files", nargs="+", help="sample files, globs or directories")
+    train.add_argument("-o", "--output", default=".",
+                       help=f"dictionary file, or directory for <id>{DICTIONARY_SUFFIX} (default: .)")
+    train.add_argument("-r", "--recursive", action="store_true", help="walk directories")
+    train.add_argument("--max-code-length", type=int, default=MAX_CODE_LENGTH,
+                       help=f"longest code in bits (default: {MAX_CODE_LENGTH})")
+
+    # The benchmark suite parses its own options, see huffman_benchmark.py
+    commands.add_parser("bench", add_help=False, help="run the benchmark suite (bench --help for options)")
+    # So do archives, see huffman_archive.py
+    commands.add_parser("archive", add_help=False,
+                        help="create, list and extract multi-file archives (archive --help for options)")
+
+    info = commands.add_parser("info", help="describe .huf files without decompressing them")
+    info.add_argument("files", nargs="+", help=".huf files or globs")
+
+    verify = commands.add_parser("verify", help="check .huf files for corruption without writing output")
+    verify.add_argument("files", nargs="+", help=".huf files, globs or directories")
+    verify.add_argument("-r", "--recursive", action="store_true", help="walk directories")
+    verify.add_argument("--full", action="store_true",
+                        help="also decode the data and check it against the checksum of the original")
+    verify.add_argument("-D", "--dictionary",
+                        help="dictionary file or directory for dictionary files (default: search "
+                             "HUFFMAN_DICTIONARY_PATH)")
+    verify.add_argument("-j", "--jobs", type=int, default=1, help="files checked in parallel, 0 for one per CPU")
+    verify.add_argument("-q", "--quiet", action="store_true", help="only report failures")
+
+    args, extra = parser.parse_known_args(argv)
+    if args.command == "bench":
+        import huffman_benchmark
+
+        return huffman_benchmark.main(extra)
+    if args.command == "archive":
+        import huffman_archive
+
+        return huffman_archive.main(extra)
+    if extra:
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    failed = False
+
+    if args.command == "info":
+        for file_path in _expand_inputs(args.files, False, True):
+            try:
+                _print_info(file_path)
+            except (OSError, ValueError) as error:
+                print(f"huffman: {file_path}: {error}", file=sys.stderr)
+                failed = True
+        return 1 if failed else 0
+
+    if args.command == "verify":
+        paths = [path for path in _expand_inputs(args.files, args.recursive, True) if path != "-"]
+        tasks = [(path, args.full, args.dictionary) for path in paths]
+        jobs = min(_resolve_workers(args.jobs or None), max(len(tasks), 1))
+        for path, (result, error) in zip(paths, _map_ordered(_verify_one, tasks, jobs)):
+            if error is not None:
+                print(f"huffman: {path}: {error}", file=sys.stderr)
+                failed = True
+            elif not args.quiet:
+                checked = "checksums verified"
+                if result["decoded"]:
+                    checked += ", data decoded"
+                print(f"{path}: OK, {result['blocks']} block(s), {result['symbols']:,} symbols, {checked}")
+        return 1 if failed else 0
+
+    if args.command == "train":
+        samples = [path for path in _expand_inputs(args.files, args.recursive, False) if path != "-"]
+        try:
+            dictionary = train_dictionary(samples, args.max_code_length)
+            path = save_dictionary(dictionary, args.output)
+        except (OSError, ValueError) as error:
+            print(f"huffman: {error}", file=sys.stderr)
+            return 1
+        size = sum(os.path.getsize(sample) for sample in samples)
+        print(f"Dictionary {dictionary.dictionary_id:08x} trained on {len(samples)} file(s), "
+              f"{size:,} bytes: {path}")
+        return 0
+
+    sources = list(_expand_inputs(args.files, args.recursive, args.command == "decompress"))
+    if "-" in sources and len(sources) > 1:
+        parser.error("'-' (stdin) cannot be combined with other inputs")
+    if args.output is not None and len(sources) > 1:
+        parser.error("--output needs exactly one input file")
+
+    workers = args.workers or None
+    jobs = args.jobs
+    if jobs is None:
+        jobs = os.cpu_count() if len(sources) > 1 and args.workers == 1 else 1
+    jobs = min(_resolve_workers(jobs or None), len(sources))
+    if jobs > 1:
+        # Files are spread over the pool, so each one is coded in-process
+        workers = 1
+
+    options = {"workers": workers, "dictionary": args.dictionary}
+    cache = None
+    if args.command == "compress":
+        options.update(mode=args.mode, block_size=args.block_size, max_code_length=args.max_code_length or None,
+                       adaptive=args.adaptive)
+        if args.cache is not None:
+            import compression_cache
+
+            try:
+                cache = (args.cache or None, compression_cache.parse_size(args.cache_size), args.cache_link)
+            except ValueError:
+                parser.error(f"invalid --cache-size: {args.cache_size}")
+            before = compression_cache.open_cache(*cache).stats()
+    tasks = []
+    for source in sources:
+        target = args.output or _output_path(args.command, source)
+        tasks.append((args.command, source, target, args.force, options, cache))
+
+    # Keep stdout clean when the data itself goes there
+    report = sys.stderr if any(task[2] == "-" for task in tasks) else sys.stdout
+    results = _map_ordered(_run_file, tasks, jobs)
+    for (_, source, target, *_), (input_size, output_size, elapsed, error) in zip(tasks, results):
+        source = "<stdin>" if source == "-" else source
+        target = "<stdout>" if target == "-" else target
+        if error is not None:
+            print(f"huffman: {source}: {error}", file=sys.stderr)
+            failed = True
+        elif not args.quiet:
+            original_size, compressed_size = input_size, output_size
+            if args.command == "decompress":
+                original_size, compressed_size = output_size, input_size
+            # Compressed size as a share of the original, whichever way the file went
+            ratio = 100 * compressed_size / original_size if original_size else 100.0
+            speed = original_size / (1024 * 1024) / elapsed if elapsed else 0.0
+            print(f"{source} -> {target}: {input_size:,} -> {output_size:,} bytes ({ratio:.1f}%), "
+                  f"{speed:.2f} MB/s", file=report)
+    if cache is not None and not args.quiet:
+        after = compression_cache.open_cache(*cache).stats()
+        print(f"Cache: {after['hits'] - before['hits']} hit(s), {after['misses'] - before['misses']} miss(es), "
+              f"{after['evictions'] - before['evictions']} eviction(s); "
+              f"{after['entries']:,} outputs, {after['bytes']:,} bytes", file=report)
+    return 1 if failed else 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -1,6 +1,11 @@
 from huffman import *
+from huffman import _output_path, _run_file
+from batch_queue import BatchQueue, expand_paths, split_drop
 
 import os
+import queue
+import threading
+import time
 import tkinter as tk
 from tkinter import filedialog, messagebox, simpledialog
 from functools import partial
@@ -8,7 +13,9 @@ from tkinterdnd2 import DND_FILES, TkinterDnD
 import customtkinter
 
 def calculate_compression_ratio(original_size, compressed_size):
-    """Calculate the compression percentage"""
+    """Calculate the compression percentage, negative when the file grew"""
+    if original_size == 0:
+        return 0.0
     ratio = ((original_size - compressed_size) / original_size) * 100
     return ratio
 
@@ -110,41 +117,169 @@ def get_output_filename(parent):
     dialog.wait_window()
     return dialog.result
 
-def compress_file_GUI(input_path, output_path):
-    """Compress a file with GUI feedback."""
-    try:
-        if os.path.exists(output_path):
-            if not messagebox.askyesno("File Exists", "Output file already exists. Overwrite?"):
-                return
-        
-        original_size = os.path.getsize(input_path)
-        print(f"Compressing: {input_path} -> {output_path}")
-        compress_file(input_path, output_path)
-        compressed_size = os.path.getsize(output_path)
-        
-        compression_ratio = calculate_compression_ratio(original_size, compressed_size)
-        update_text_area(
-            f"File compressed successfully!\n"
-            f"Original size: {original_size:,} bytes\n"
-            f"Compressed size: {compressed_size:,} bytes\n"
-            f"Compression ratio: {compression_ratio:.2f}%\n"
-            f"Saved to: {output_path}"
-        )
-    except Exception as e:
-        update_text_area(f"Compression failed: {str(e)}")
+# The job currently running in the background, if any
+current_job = None
+# Multi-file drops, created with the GUI
+batch = None
 
-def decompress_file_GUI(input_path, output_path):
-    """Decompress a file with GUI feedback."""
-    try:
-        if os.path.exists(output_path):
-            if not messagebox.askyesno("File Exists", "Output file already exists. Overwrite?"):
-                return
-        
-        print(f"Decompressing: {input_path} -> {output_path}")
-        decompress_file(input_path, output_path)
-        update_text_area(f"File decompressed successfully!\nSaved to: {output_path}")
-    except Exception as e:
-        update_text_area(f"Decompression failed: {str(e)}")
+class JobCancelled(Exception):
+    """Raised from the progress callback to stop a running job."""
+
+
+class CompressionJob:
+    """Runs compress_file or decompress_file on a background thread.
+
+    Tk widgets may only be touched from the main thread, so the job puts
+    progress and its outcome on a queue that poll_job drains with root.after.
+    Cancelling is cooperative: the next progress report raises JobCancelled
+    inside the compressor, which leaves the output file as it was.
+    """
+
+    def __init__(self, action, input_path, output_path):
+        self.action = action
+        self.input_path = input_path
+        self.output_path = output_path
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.start_time = None
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        self.thread.start()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def _progress(self, done, total):
+        if self.cancel_event.is_set():
+            raise JobCancelled
+        self.events.put(("progress", done, total))
+
+    def _run(self):
+        function = compress_file if self.action == "compress" else decompress_file
+        try:
+            function(self.input_path, self.output_path, verbose=False, progress=self._progress)
+        except JobCancelled:
+            self.events.put(("cancelled",))
+        except Exception as e:
+            self.events.put(("error", str(e)))
+        else:
+            self.events.put(("done",))
+
+
+def format_progress(done, total, elapsed):
+    """Describe progress as bytes processed, throughput and time left"""
+    speed = done / elapsed if elapsed > 0 else 0
+    text = f"{done / 1e6:.1f}"
+    if total:
+        text += f" / {total / 1e6:.1f}"
+    text += f" MB  {speed / 1e6:.1f} MB/s"
+    if total and speed:
+        text += f"  ETA {max(total - done, 0) / speed:.0f}s"
+    return text
+
+
+def start_job(root, action, input_path, output_path):
+    """Start a compression job in the background and watch it from the Tk loop."""
+    global current_job
+    current_job = CompressionJob(action, input_path, output_path)
+    compress_btn.configure(state="disabled")
+    decompress_btn.configure(state="disabled")
+    cancel_btn.configure(state="normal")
+    progress_bar.set(0)
+    progress_label.configure(text="Starting...")
+    current_job.start()
+    root.after(100, poll_job, root, current_job)
+
+
+def poll_job(root, job):
+    """Apply the job's queued events to the widgets, then check again later"""
+    latest = None
+    outcome = None
+    while True:
+        try:
+            event = job.events.get_nowait()
+        except queue.Empty:
+            break
+        if event[0] == "progress":
+            latest = event
+        else:
+            outcome = event
+
+    if latest is not None:
+        _, done, total = latest
+        if total:
+            progress_bar.set(min(done / total, 1.0))
+        progress_label.configure(text=format_progress(done, total, time.perf_counter() - job.start_time))
+    if outcome is None:
+        root.after(100, poll_job, root, job)
+        return
+
+    global current_job
+    current_job = None
+    compress_btn.configure(state="normal")
+    decompress_btn.configure(state="normal")
+    cancel_btn.configure(state="disabled")
+    elapsed = time.perf_counter() - job.start_time
+    if outcome[0] == "done":
+        progress_bar.set(1)
+        progress_label.configure(text=f"Finished in {elapsed:.1f}s")
+        if job.action == "compress":
+            report_compression(job.input_path, job.output_path)
+        else:
+            update_text_area(f"File decompressed successfully!\nSaved to: {job.output_path}")
+    elif outcome[0] == "cancelled":
+        progress_bar.set(0)
+        progress_label.configure(text="Cancelled")
+        update_text_area(f"{job.action.capitalize()}ion cancelled")
+    else:
+        progress_bar.set(0)
+        progress_label.configure(text="Failed")
+        update_text_area(f"{job.action.capitalize()}ion failed: {outcome[1]}")
+
+
+def cancel_job():
+    if current_job is not None:
+        progress_label.configure(text="Cancelling...")
+        current_job.cancel()
+    elif batch.running:
+        batch.cancel()
+
+
+def report_compression(input_path, output_path):
+    """Show the sizes and ratio of a finished compression."""
+    original_size = os.path.getsize(input_path)
+    compressed_size = os.path.getsize(output_path)
+    compression_ratio = calculate_compression_ratio(original_size, compressed_size)
+    if compression_ratio >= 0:
+        ratio_line = f"Compression ratio: {compression_ratio:.2f}%"
+    else:
+        # Tiny files can grow: the header and code table outweigh the savings
+        ratio_line = f"File grew by {-compression_ratio:.2f}% (too small to benefit, try a dictionary)"
+    update_text_area(
+        f"File compressed successfully!\n"
+        f"Original size: {original_size:,} bytes\n"
+        f"Compressed size: {compressed_size:,} bytes\n"
+        f"{ratio_line}\n"
+        f"Saved to: {output_path}"
+    )
+
+def compress_file_GUI(root, input_path, output_path):
+    """Compress a file in the background with GUI feedback."""
+    if os.path.exists(output_path):
+        if not messagebox.askyesno("File Exists", "Output file already exists. Overwrite?"):
+            return
+    print(f"Compressing: {input_path} -> {output_path}")
+    start_job(root, "compress", input_path, output_path)
+
+def decompress_file_GUI(root, input_path, output_path):
+    """Decompress a file in the background with GUI feedback."""
+    if os.path.exists(output_path):
+        if not messagebox.askyesno("File Exists", "Output file already exists. Overwrite?"):
+            return
+    print(f"Decompressing: {input_path} -> {output_path}")
+    start_job(root, "decompress", input_path, output_path)
 
 def browse_file(entry):
     file_path = filedialog.askopenfilename(
@@ -171,28 +306,80 @@ def run_action(action, input_entry, output_entry, parent):
     if not input_path or not output_path:
         messagebox.showerror("Error", "Please specify both input and output paths")
         return
+    if current_job is not None or batch.running:
+        return
         
     if action == "compress":
-        compress_file_GUI(input_path, output_path)
+        compress_file_GUI(parent, input_path, output_path)
     else:
-        decompress_file_GUI(input_path, output_path)
+        decompress_file_GUI(parent, input_path, output_path)
 
 def handle_drop(event, input_entry):
     """Handle drag and drop file events"""
     try:
-        # Strip curly braces and quotes that Windows adds
-        file_path = event.data.strip("{}")
-        if file_path.startswith('"') and file_path.endswith('"'):
-            file_path = file_path[1:-1]
-        input_entry.delete(0, tk.END)
-        input_entry.insert(0, file_path)
+        paths = split_drop(input_entry, event.data)
+        if len(paths) == 1 and not os.path.isdir(paths[0]):
+            input_entry.delete(0, tk.END)
+            input_entry.insert(0, paths[0])
+        elif paths:
+            start_batch(paths)
     except Exception as e:
         print(f"Error handling drop: {e}")
 
-def update_text_area(message):
+def batch_file(source, target):
+    """Compress a file, or decompress it if it is a .huf, for the batch queue"""
+    action = "decompress" if source.endswith(".huf") else "compress"
+    return _run_file(action, source, target, True, {})
+
+def start_batch(paths):
+    """Queue dropped files and folders, .huf files are decompressed and the rest compressed."""
+    if current_job is not None:
+        messagebox.showerror("Busy", "Wait for the current file to finish before dropping more")
+        return
+    # Dictionaries are only useful next to the files they were trained on
+    sources = list(expand_paths(paths, lambda path: not path.endswith(DICTIONARY_SUFFIX)))
+    jobs = [(source, _output_path("decompress" if source.endswith(".huf") else "compress", source))
+            for source in sources]
+    existing = sum(os.path.exists(target) for _, target in jobs)
+    if existing and not messagebox.askyesno(
+            "Files Exist", f"{existing} output file(s) already exist. Overwrite them?\nNo skips those files."):
+        jobs = [(source, target) for source, target in jobs if not os.path.exists(target)]
+    if not jobs:
+        return
+    update_text_area(f"Queued {len(jobs)} file(s) on {batch.workers} worker(s)")
+    for source, target in jobs:
+        batch.submit(source, target)
+    compress_btn.configure(state="disabled")
+    decompress_btn.configure(state="disabled")
+    cancel_btn.configure(state="normal")
+
+def report_batch_job(job):
+    if job.status == "done":
+        line = f"done      {os.path.basename(job.source)}  {job.input_size:,} -> {job.output_size:,} bytes"
+    elif job.status == "failed":
+        line = f"failed    {os.path.basename(job.source)}: {job.error}"
+    else:
+        line = f"cancelled {os.path.basename(job.source)}"
+    update_text_area(line, separator=False)
+
+def update_batch_progress(queue):
+    counts = queue.counts()
+    if queue.jobs:
+        progress_bar.set((len(queue.jobs) - counts["queued"] - counts["running"]) / len(queue.jobs))
+    progress_label.configure(text=queue.summary())
+    if not queue.running:
+        update_text_area(f"Batch finished: {queue.summary()}")
+        compress_btn.configure(state="normal")
+        decompress_btn.configure(state="normal")
+        cancel_btn.configure(state="disabled")
+
+def set_batch_workers(value):
+    batch.workers = int(value)
+
+def update_text_area(message, separator=True):
     """Update the text area with a message"""
     text_area.configure(state='normal')
-    text_area.insert('end', message + '\n' + "-"*50 + '\n')
+    text_area.insert('end', message + '\n' + ("-"*50 + '\n' if separator else ''))
     text_area.see('end')  # Scroll to the bottom
     text_area.configure(state='disabled')
 
@@ -219,7 +406,7 @@ def create_gui(parent=None):
     main_frame.grid_columnconfigure(0, weight=1)
     main_frame.grid_columnconfigure(1, weight=3)
     main_frame.grid_columnconfigure(2, weight=1)
-    for i in range(7):
+    for i in range(8):
         main_frame.grid_rowconfigure(i, weight=1)
     
     # Title and description
@@ -232,7 +419,8 @@ def create_gui(parent=None):
     
     desc_label = customtkinter.CTkLabel(
         main_frame,
-        text="Compress and decompress files using Huffman coding\nDrag and drop files here",
+        text="Compress and decompress files using Huffman coding\n"
+             "Drag and drop a file here, or several files or folders to queue them",
         font=customtkinter.CTkFont(size=14)
     )
     desc_label.grid(row=1, column=0, columnspan=3, pady=(0, 20), sticky="ew")
@@ -270,6 +458,7 @@ def create_gui(parent=None):
     browse_output_btn.grid(row=0, column=2, padx=10, pady=5)
 
     # Action Buttons
+    global compress_btn, decompress_btn, cancel_btn, progress_bar, progress_label
     button_frame = customtkinter.CTkFrame(main_frame)
     button_frame.grid(row=4, column=0, columnspan=3, pady=(0, 20), sticky="ew")
     button_frame.grid_columnconfigure((0, 1), weight=1)  # Equal width for buttons
@@ -290,10 +479,44 @@ def create_gui(parent=None):
     )
     decompress_btn.grid(row=0, column=1, padx=10, sticky="ew")
 
+    # Dropping several files or a folder queues them on a pool of processes
+    global batch
+    batch = BatchQueue(root, batch_file, on_job=report_batch_job, on_update=update_batch_progress)
+    workers_frame = customtkinter.CTkFrame(button_frame, fg_color="transparent")
+    workers_frame.grid(row=1, column=0, columnspan=2, pady=(10, 0))
+    customtkinter.CTkLabel(workers_frame, text="Batch workers:").grid(row=0, column=0, padx=10)
+    workers_menu = customtkinter.CTkOptionMenu(
+        workers_frame,
+        values=[str(n) for n in range(1, (os.cpu_count() or 1) + 1)],
+        command=set_batch_workers,
+        width=80
+    )
+    workers_menu.set(str(batch.workers))
+    workers_menu.grid(row=0, column=1, padx=10)
+
+    # Progress of the running job
+    progress_frame = customtkinter.CTkFrame(main_frame)
+    progress_frame.grid(row=5, column=0, columnspan=3, sticky="ew", padx=10, pady=(0, 10))
+    progress_frame.grid_columnconfigure(0, weight=1)
+
+    progress_bar = customtkinter.CTkProgressBar(progress_frame)
+    progress_bar.grid(row=0, column=0, padx=10, pady=(10, 5), sticky="ew")
+    progress_bar.set(0)
+    cancel_btn = customtkinter.CTkButton(
+        progress_frame,
+        text="Cancel",
+        command=cancel_job,
+        width=100,
+        state="disabled"
+    )
+    cancel_btn.grid(row=0, column=1, rowspan=2, padx=10, pady=5)
+    progress_label = customtkinter.CTkLabel(progress_frame, text="Idle")
+    progress_label.grid(row=1, column=0, padx=10, pady=(0, 5), sticky="w")
+
     # Text Area for logging
     global text_area
     text_area = customtkinter.CTkTextbox(main_frame)
-    text_area.grid(row=5, column=0, columnspan=3, padx=10, pady=(0, 10), sticky="nsew")
+    text_area.grid(row=6, column=0, columnspan=3, padx=10, pady=(0, 10), sticky="nsew")
     text_area.configure(state='disabled')
 
     # Enable drag and drop
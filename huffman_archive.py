@@ -0,0 +1,449 @@
+"""Multi-file archives for huffman.py.
+
+Compressing a tree file by file leaves one .huf per input, each with its
+own code table. An archive packs many files into one container instead:
+
+    python huffman.py archive create logs.hufa logs/
+    python huffman.py archive list logs.hufa
+    python huffman.py archive extract logs.hufa -o restored/ -j 4
+    python huffman.py archive extract logs.hufa logs/2024/app.log -o -
+
+Members are sorted by extension so similar files sit together, and packed
+into groups of up to GROUP_SIZE input bytes that share one code table.
+Each member's payload starts on a byte boundary, so any member can be
+decoded on its own with its group's table. A central directory at the end
+records every member's name, group, offset, sizes, CRC-32, mtime and
+permissions, and a fixed size trailer points to it, so listing and single
+member extraction read only the directory and what they need. Groups are
+coded, and extracted, in parallel.
+
+Layout: header (magic, version), then per group its code table and its
+members' payloads, then the directory and the trailer. Multi-byte fields
+are big-endian.
+"""
+
+import contextlib
+import os
+import shutil
+import stat
+import struct
+import sys
+import tempfile
+import zlib
+from collections import Counter
+
+import huffman
+
+ARCHIVE_MAGIC = b"HUFA"
+ARCHIVE_VERSION = 1
+ARCHIVE_SUFFIX = ".hufa"
+_ARCHIVE_HEADER = struct.Struct(">4sB")
+
+# Input bytes per group; a larger file makes a group of its own
+GROUP_SIZE = 4 << 20
+
+# Member payloads: coded with the group table, or copied when that would not shrink them
+METHOD_STORED = 0
+METHOD_HUFFMAN = 1
+
+# Directory: group and member counts, then per group the offset and alphabet size of its
+# table (0 when every member is stored), then per member its group, offset, payload size,
+# original size, method, CRC-32, mtime in nanoseconds, permission bits and name length,
+# followed by the UTF-8 name. The directory is stored deflated: with many small members
+# it would otherwise outweigh their payloads.
+_DIRECTORY = struct.Struct(">II")
+_GROUP = struct.Struct(">QH")
+_MEMBER = struct.Struct(">IQQQBIqIH")
+
+# Trailer: offset and stored size of the directory, CRC-32 of the directory before it was
+# deflated, then the magic again
+_ARCHIVE_TRAILER = struct.Struct(">QQI4s")
+
+
+def _archive_inputs(paths):
+    """Yield (member name, path) for the files under ``paths``.
+
+    Names are relative to the parent of each argument, with / separators,
+    so archiving logs/ stores logs/app.log.
+    """
+    for path in paths:
+        base = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(path):
+            yield os.path.relpath(os.path.abspath(path), base).replace(os.sep, "/"), path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                yield os.path.relpath(os.path.abspath(file_path), base).replace(os.sep, "/"), file_path
+
+
+def _group_inputs(inputs, group_size):
+    """Split (name, path) pairs into groups of about ``group_size`` input bytes.
+
+    Files are ordered by extension first, so a group's table fits files of
+    one kind.
+    """
+    inputs = sorted(inputs, key=lambda item: (os.path.splitext(item[0])[1], item[0]))
+    group = []
+    total = 0
+    for name, path in inputs:
+        size = os.path.getsize(path)
+        if group and total + size > group_size:
+            yield group
+            group = []
+            total = 0
+        group.append((name, path))
+        total += size
+    if group:
+        yield group
+
+
+def _read_chunks(f, state, alphabet=None):
+    """Yield the rest of ``f`` IO_CHUNK_SIZE bytes at a time, keeping [size, CRC-32] of them in ``state``.
+
+    A chunk with bytes outside ``alphabet`` means the file changed since
+    it was counted, and is a ValueError.
+    """
+    for chunk in iter(lambda: f.read(huffman.IO_CHUNK_SIZE), b""):
+        if alphabet is not None and chunk.translate(None, alphabet):
+            raise ValueError(f"{f.name} changed while it was being archived")
+        state[0] += len(chunk)
+        state[1] = zlib.crc32(chunk, state[1])
+        yield chunk
+
+
+def _encode_group(paths, out, max_code_length=huffman.MAX_CODE_LENGTH):
+    """Code the files of one group with a shared table, writing the table and then the payloads to ``out``.
+
+    Files are read a chunk at a time, once to count their bytes and once
+    to code them, so memory does not grow with their size. Returns
+    (alphabet size, table size, members) where members holds (method,
+    payload size, original size, CRC-32, mtime_ns, mode) per file, in order.
+    """
+    counts = []
+    frequency = Counter()
+    for path in paths:
+        counted, state = Counter(), [0, 0]
+        with open(path, 'rb') as f:
+            for chunk in _read_chunks(f, state):
+                counted.update(chunk)
+        counts.append((counted, state))
+        frequency.update(counted)
+    total = sum(frequency.values())
+
+    alphabet_size, table = 0, b""
+    lengths = encoder = None
+    if total and huffman._worth_coding(frequency, total):
+        lengths = huffman.build_code_lengths(frequency, max_code_length)
+        alphabet_size, _, table = huffman._pack_table(huffman.MODE_BYTES, lengths)
+        encoder = huffman._symbol_encoder(huffman.canonical_codes(lengths), text=False)
+    out.write(table)
+
+    members = []
+    for path, (counted, expected) in zip(paths, counts):
+        method = METHOD_STORED
+        # The group's table may suit this file worse than storing it
+        if encoder is not None and expected[0] and \
+                -(-sum(count * lengths[byte] for byte, count in counted.items()) // 8) < expected[0]:
+            method = METHOD_HUFFMAN
+        state = [0, 0]
+        payload_size = 0
+        with open(path, 'rb') as f:
+            status = os.fstat(f.fileno())
+            if method == METHOD_HUFFMAN:
+                pieces = huffman.encode_chunks(_read_chunks(f, state, bytes(sorted(counted))), None, encoder=encoder)
+            else:
+                pieces = _read_chunks(f, state)
+            for piece in pieces:
+                out.write(piece)
+                payload_size += len(piece)
+        if state != expected:
+            raise ValueError(f"{path} changed while it was being archived")
+        members.append((method, payload_size, state[0], state[1], status.st_mtime_ns, stat.S_IMODE(status.st_mode)))
+    return alphabet_size, len(table), members
+
+
+def _spool_group(paths, directory, max_code_length):
+    """_encode_group into a new file in ``directory``; returns its path and the result"""
+    handle, spool = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(handle, 'wb') as out:
+            return spool, _encode_group(paths, out, max_code_length)
+    except BaseException:
+        os.remove(spool)
+        raise
+
+
+def create_archive(archive_path, paths, workers=1, max_code_length=huffman.MAX_CODE_LENGTH,
+                   group_size=GROUP_SIZE):
+    """Pack the files under ``paths`` into one archive; returns a summary dict.
+
+    Files are coded a chunk at a time, so memory does not depend on their
+    size. Groups are coded on ``workers`` processes (None uses every CPU),
+    each into a temporary file next to the archive that is then copied in,
+    in order; with one worker they are coded straight into the archive.
+    The summary has the member, group, input and archive byte counts. A
+    partly written archive is removed on error.
+    """
+    # The archive itself may sit in a directory being packed
+    inputs = [(name, path) for name, path in _archive_inputs(paths)
+              if os.path.abspath(path) != os.path.abspath(archive_path)]
+    names = Counter(name for name, _ in inputs)
+    duplicates = [name for name, count in names.items() if count > 1]
+    if duplicates:
+        raise ValueError(f"{duplicates[0]} would be stored twice")
+    groups = list(_group_inputs(inputs, group_size))
+    workers = min(huffman._resolve_workers(workers), max(len(groups), 1))
+
+    group_entries = []
+    member_entries = []
+    input_size = 0
+    try:
+        with open(archive_path, 'wb') as f, \
+                tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(archive_path))) as spools:
+            f.write(_ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION))
+            if workers == 1:
+                results = ((None, _encode_group([path for _, path in group], f, max_code_length)) for group in groups)
+            else:
+                tasks = (([path for _, path in group], spools, max_code_length) for group in groups)
+                results = huffman._map_ordered(_spool_group, tasks, workers)
+            position = f.tell()
+            with contextlib.closing(results):
+                for index, (group, (spool, (alphabet_size, table_size, members))) in enumerate(zip(groups, results)):
+                    if spool is not None:
+                        with open(spool, 'rb') as coded:
+                            shutil.copyfileobj(coded, f, huffman.IO_CHUNK_SIZE)
+                        os.remove(spool)
+                    group_entries.append(_GROUP.pack(position, alphabet_size))
+                    offset = position + table_size
+                    for (name, _), (method, payload_size, original_size, crc, mtime_ns, mode) in zip(group, members):
+                        encoded_name = name.encode('utf-8')
+                        member_entries.append(_MEMBER.pack(index, offset, payload_size, original_size, method, crc,
+                                                           mtime_ns, mode, len(encoded_name)) + encoded_name)
+                        offset += payload_size
+                        input_size += original_size
+                    position = f.tell()
+            directory_offset = position
+            directory = b"".join([_DIRECTORY.pack(len(group_entries), len(member_entries))]
+                                 + group_entries + member_entries)
+            stored = zlib.compress(directory, 9)
+            f.write(stored)
+            f.write(_ARCHIVE_TRAILER.pack(directory_offset, len(stored), zlib.crc32(directory), ARCHIVE_MAGIC))
+            archive_size = f.tell()
+    except BaseException:
+        if os.path.exists(archive_path):
+            os.remove(archive_path)
+        raise
+    return {"members": len(member_entries), "groups": len(group_entries), "input_size": input_size,
+            "archive_size": archive_size}
+
+
+def read_directory(archive_path):
+    """Read an archive's central directory without touching the payloads.
+
+    Returns (groups, members): groups is a list of (table offset, alphabet
+    size) and members a list of dicts with the name, group, offset, size,
+    original_size, method, crc, mtime_ns and mode of each member, in archive
+    order.
+    """
+    with open(archive_path, 'rb') as f:
+        if f.read(_ARCHIVE_HEADER.size) != _ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION):
+            raise ValueError(f"{archive_path} is not a version {ARCHIVE_VERSION} Huffman archive")
+        trailer_offset = f.seek(0, os.SEEK_END) - _ARCHIVE_TRAILER.size
+        if trailer_offset < _ARCHIVE_HEADER.size:
+            raise ValueError("Archive is truncated: no trailer")
+        f.seek(trailer_offset)
+        directory_offset, directory_size, checksum, magic = _ARCHIVE_TRAILER.unpack(
+            huffman._read_exact(f, _ARCHIVE_TRAILER.size))
+        if magic != ARCHIVE_MAGIC:
+            raise ValueError("Archive is truncated: no trailer")
+        if not _ARCHIVE_HEADER.size <= directory_offset <= trailer_offset - directory_size:
+            raise ValueError("Archive trailer is corrupt: directory out of range")
+        f.seek(directory_offset)
+        stored = huffman._read_exact(f, directory_size)
+    try:
+        directory = zlib.decompress(stored)
+    except zlib.error:
+        directory = b""
+    if zlib.crc32(directory) != checksum:
+        raise ValueError("Archive directory is corrupt: checksum mismatch")
+
+    # The checksum only shows the directory is as written; its fields are still checked
+    # against its size, so a crafted one is a ValueError too
+    if len(directory) < _DIRECTORY.size:
+        raise ValueError("Archive directory is corrupt: too short")
+    group_count, member_count = _DIRECTORY.unpack_from(directory)
+    if _DIRECTORY.size + group_count * _GROUP.size + member_count * _MEMBER.size > len(directory):
+        raise ValueError("Archive directory is corrupt: counts out of range")
+    position = _DIRECTORY.size
+    groups = []
+    for _ in range(group_count):
+        groups.append(_GROUP.unpack_from(directory, position))
+        position += _GROUP.size
+    members = []
+    for _ in range(member_count):
+        if position + _MEMBER.size > len(directory):
+            raise ValueError("Archive directory is corrupt: member out of range")
+        group, offset, size, original_size, method, crc, mtime_ns, mode, name_length = \
+            _MEMBER.unpack_from(directory, position)
+        position += _MEMBER.size
+        if group >= group_count or position + name_length > len(directory):
+            raise ValueError("Archive directory is corrupt: member out of range")
+        # UnicodeDecodeError is a ValueError
+        name = directory[position:position + name_length].decode('utf-8')
+        position += name_length
+        members.append({"name": name, "group": group, "offset": offset, "size": size,
+                        "original_size": original_size, "method": method, "crc": crc, "mtime_ns": mtime_ns,
+                        "mode": mode})
+    if position != len(directory):
+        raise ValueError("Archive directory is corrupt: trailing data")
+    return groups, members
+
+
+def _read_lengths(f, group):
+    offset, alphabet_size = group
+    if not alphabet_size:
+        return None
+    f.seek(offset)
+    return huffman._read_table(f, huffman.MODE_BYTES, alphabet_size, alphabet_size)
+
+
+def _decode_member(f, member, lengths):
+    f.seek(member["offset"])
+    payload = huffman._read_exact(f, member["size"])
+    if member["method"] == METHOD_HUFFMAN:
+        if lengths is None:
+            raise ValueError(f"Archive member {member['name']} is corrupt: its group has no table")
+        data = huffman._decode_block(huffman.MODE_BYTES, lengths, payload, member["original_size"])
+    else:
+        data = payload
+    if len(data) != member["original_size"] or zlib.crc32(data) != member["crc"]:
+        raise ValueError(f"Archive member {member['name']} is corrupt: checksum mismatch")
+    return data
+
+
+def read_member(archive_path, name):
+    """Return the contents of one member, reading only its group table and payload"""
+    groups, members = read_directory(archive_path)
+    member = next((member for member in members if member["name"] == name), None)
+    if member is None:
+        raise KeyError(f"{name} is not in {archive_path}")
+    with open(archive_path, 'rb') as f:
+        return _decode_member(f, member, _read_lengths(f, groups[member["group"]]))
+
+
+def _member_path(output_dir, name):
+    """Where a member is extracted, refusing names that would escape ``output_dir``"""
+    parts = name.split("/")
+    if name.startswith("/") or ".." in parts or any(os.sep in part or ":" in part for part in parts):
+        raise ValueError(f"Unsafe member name in archive: {name}")
+    return os.path.join(output_dir, *parts)
+
+
+def _extract_group(archive_path, group, members, output_dir):
+    """Extract members of one group; returns the bytes written"""
+    written = 0
+    with open(archive_path, 'rb') as f:
+        lengths = _read_lengths(f, group)
+        for member in members:
+            data = _decode_member(f, member, lengths)
+            path = _member_path(output_dir, member["name"])
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path, 'wb') as out:
+                out.write(data)
+            os.chmod(path, member["mode"])
+            os.utime(path, ns=(member["mtime_ns"], member["mtime_ns"]))
+            written += len(data)
+    return written
+
+
+def extract_archive(archive_path, output_dir=".", names=None, workers=1):
+    """Extract all members, or those in ``names``, under ``output_dir``.
+
+    Groups are extracted on ``workers`` processes (None uses every CPU),
+    each reading its table once. Returns (members extracted, bytes
+    written). Raises KeyError for names not in the archive and ValueError
+    for corrupt members or names that would escape ``output_dir``.
+    """
+    groups, members = read_directory(archive_path)
+    if names is not None:
+        wanted = set(names)
+        members = [member for member in members if member["name"] in wanted]
+        missing = wanted - {member["name"] for member in members}
+        if missing:
+            raise KeyError(f"{sorted(missing)[0]} is not in {archive_path}")
+    for member in members:
+        _member_path(output_dir, member["name"])
+    by_group = {}
+    for member in members:
+        by_group.setdefault(member["group"], []).append(member)
+    tasks = [(archive_path, groups[index], group_members, output_dir) for index, group_members in by_group.items()]
+    workers = min(huffman._resolve_workers(workers), max(len(tasks), 1))
+    return len(members), sum(huffman._map_ordered(_extract_group, tasks, workers))
+
+
+def main(argv=None):
+    """Command line for archives, also reached as ``huffman.py archive``; returns the exit status."""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="huffman archive", description="Multi-file Huffman archives")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    create = commands.add_parser("create", help="pack files and directories into an archive")
+    create.add_argument("archive", help=f"archive to write, usually NAME{ARCHIVE_SUFFIX}")
+    create.add_argument("files", nargs="+", help="files and directories to pack")
+    create.add_argument("-f", "--force", action="store_true", help="overwrite an existing archive")
+    create.add_argument("-j", "--jobs", type=int, default=1, help="groups coded in parallel, 0 for one per CPU")
+    create.add_argument("--group-size", type=int, default=GROUP_SIZE,
+                        help=f"input bytes sharing one code table (default: {GROUP_SIZE})")
+    create.add_argument("--max-code-length", type=int, default=huffman.MAX_CODE_LENGTH,
+                        help=f"longest code in bits (default: {huffman.MAX_CODE_LENGTH})")
+
+    listing = commands.add_parser("list", help="list the members of an archive from its directory")
+    listing.add_argument("archive")
+
+    extract = commands.add_parser("extract", help="extract all or some members")
+    extract.add_argument("archive")
+    extract.add_argument("members", nargs="*", help="member names to extract (default: all)")
+    extract.add_argument("-o", "--output", default=".",
+                         help="directory to extract into, or '-' to write a single member to stdout (default: .)")
+    extract.add_argument("-j", "--jobs", type=int, default=1, help="groups extracted in parallel, 0 for one per CPU")
+
+    args = parser.parse_args(argv)
+    try:
+        if args.command == "create":
+            if os.path.exists(args.archive) and not args.force:
+                print(f"huffman: {args.archive} already exists, use --force to overwrite", file=sys.stderr)
+                return 1
+            summary = create_archive(args.archive, args.files, args.jobs or None, args.max_code_length,
+                                     args.group_size)
+            ratio = 100 * summary["archive_size"] / summary["input_size"] if summary["input_size"] else 100.0
+            print(f"{args.archive}: {summary['members']} file(s) in {summary['groups']} group(s), "
+                  f"{summary['input_size']:,} -> {summary['archive_size']:,} bytes ({ratio:.1f}%)")
+        elif args.command == "list":
+            groups, members = read_directory(args.archive)
+            for member in members:
+                print(f"{member['original_size']:>12,} {member['size']:>12,}  {member['name']}")
+            print(f"{len(members)} file(s) in {len(groups)} group(s), "
+                  f"{sum(member['original_size'] for member in members):,} bytes")
+        elif args.output == "-":
+            if len(args.members) != 1:
+                parser.error("'-o -' needs exactly one member name")
+            sys.stdout.buffer.write(read_member(args.archive, args.members[0]))
+        else:
+            count, size = extract_archive(args.archive, args.output, args.members or None, args.jobs or None)
+            print(f"Extracted {count} file(s), {size:,} bytes, to {args.output}")
+    except KeyError as error:
+        print(f"huffman: {error.args[0]}", file=sys.stderr)
+        return 1
+    except (OSError, ValueError) as error:
+        print(f"huffman: {error}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
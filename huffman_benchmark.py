@@ -0,0 +1,405 @@
+"""Benchmark suite for huffman.py.
+
+Generates a reproducible corpus, times compression and decompression with
+warmup and repeated runs, and records throughput, memory, ratio and
+container overhead as JSON so results can be compared across commits:
+
+    python huffman_benchmark.py --json before.json
+    (change huffman.py)
+    python huffman_benchmark.py --json after.json --compare before.json
+"""
+
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+import huffman
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+CORPUS_SIZE = 1 << 20
+CORPUS_SEED = 1234
+REPEAT = 5
+WARMUP = 1
+
+_WORDS = ("the of and to in is was that for it with as his on be at by had are but from not have this "
+          "which were all she they one you an there been their her would we more if no when will so who "
+          "time people water history language system number between through compression entropy "
+          "naïve café résumé coöperate façade").split()
+
+_CODE_LINES = (
+    "def {name}(self, {arg}):",
+    "    \"\"\"Return the {name} of {arg}.\"\"\"",
+    "    if {arg} is None:",
+    "        raise ValueError(\"{arg} must be set\")",
+    "    for index, item in enumerate(self.{arg}s):",
+    "        total += item.{name} * {number}",
+    "    return {{\"{name}\": {arg}, \"count\": {number}}}",
+    "    {arg} = self._{name}.get({number}, [])",
+    "class {Name}({Name}Base):",
+    "",
+    "# {name} the {arg} before writing",
+    "import {name}",
+)
+
+_LOG_LEVELS = ("INFO", "INFO", "INFO", "INFO", "DEBUG", "DEBUG", "WARNING", "ERROR")
+_LOG_PATHS = ("/api/v1/users", "/api/v1/orders", "/static/app.js", "/health", "/login", "/api/v1/search")
+
+
+def _english(rng, size):
+    weights = [1 / rank for rank in range(1, len(_WORDS) + 1)]
+    out = []
+    length = 0
+    while length < size:
+        words = rng.choices(_WORDS, weights, k=rng.randint(5, 20))
+        sentence = " ".join(words).capitalize() + rng.choice(".....?!") + rng.choice("   \n")
+        out.append(sentence)
+        length += len(sentence.encode('utf-8'))
+    # Cut at a character boundary so the file stays valid UTF-8
+    return "".join(out).encode('utf-8')[:size].decode('utf-8', 'ignore').encode('utf-8')
+
+
+def _source(rng, size):
+    names = ("parse", "encode", "decode", "table", "block", "count", "offset", "stream", "buffer")
+    out = []
+    length = 0
+    while length < size:
+        name = rng.choice(names)
+        line = rng.choice(_CODE_LINES).format(name=name, Name=name.capitalize(), arg=rng.choice(names),
+                                              number=rng.randint(0, 4096)) + "\n"
+        out.append(line)
+        length += len(line)
+    return "".join(out).encode('ascii')[:size]
+
+
+def _logs(rng, size):
+    out = []
+    length = 0
+    timestamp = 1_700_000_000
+    while length < size:
+        timestamp += rng.randint(0, 3)
+        line = (f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(timestamp))}Z "
+                f"{rng.choice(_LOG_LEVELS):<7} 10.0.{rng.randint(0, 3)}.{rng.randint(1, 254)} "
+                f"GET {rng.choice(_LOG_PATHS)} {rng.choice((200, 200, 200, 304, 404, 500))} "
+                f"{rng.randint(80, 20000)}B {rng.random() * 200:.1f}ms\n")
+        out.append(line)
+        length += len(line)
+    return "".join(out).encode('ascii')[:size]
+
+
+def _random(rng, size):
+    return rng.randbytes(size)
+
+
+def _skewed(rng, size):
+    # Fibonacci frequencies give the deepest possible Huffman tree
+    symbols = []
+    a, b = 1, 1
+    for symbol in range(32):
+        symbols.append((symbol, a))
+        a, b = b, a + b
+    population, weights = zip(*symbols)
+    return bytes(rng.choices(population, weights, k=size))
+
+
+def _single(rng, size):
+    return b"a" * size
+
+
+CORPUS = {
+    "english": _english,
+    "source": _source,
+    "logs": _logs,
+    "random": _random,
+    "skewed": _skewed,
+    "single": _single,
+}
+
+
+def generate_corpus(directory, size=CORPUS_SIZE, seed=CORPUS_SEED):
+    """Write one file of about ``size`` bytes per corpus kind into ``directory``.
+
+    The same size and seed always give the same bytes. Returns the paths.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for name, generate in CORPUS.items():
+        path = os.path.join(directory, name + ".dat")
+        with open(path, 'wb') as f:
+            f.write(generate(random.Random(f"{seed}:{name}"), size))
+        paths.append(path)
+    return paths
+
+
+def _timings(function, repeat, warmup):
+    for _ in range(warmup):
+        function()
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start_time)
+    return times
+
+
+def _traced_peak(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _max_rss():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _speeds(size, times):
+    size_mb = size / (1024 * 1024)
+    return {"best": size_mb / min(times), "median": size_mb / statistics.median(times),
+            "seconds": times}
+
+
+def benchmark_case(file_path, mode="bytes", repeat=REPEAT, warmup=WARMUP, block_size=None, workers=1,
+                   reference=False):
+    """Benchmark one file in one mode and return the results as a dict.
+
+    Outputs go to a temporary directory. Timings are taken first, then one
+    more run of each direction under tracemalloc for the peak Python
+    allocation; tracing slows the code down, so it never overlaps the timed
+    runs. ``reference`` times the original string-based implementation
+    instead. Raises UnicodeDecodeError for text mode on non UTF-8 input.
+    """
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    frequency = Counter(data.decode('utf-8') if mode == "text" and not reference else data)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        compressed_file = os.path.join(tmp, "bench.huf")
+        decompressed_file = os.path.join(tmp, "bench.out")
+        if reference:
+            def compress():
+                huffman.compress_file_reference(file_path, compressed_file)
+
+            def decompress():
+                huffman.decompress_file_reference(compressed_file, decompressed_file)
+        else:
+            def compress():
+                huffman.compress_file(file_path, compressed_file, mode=mode, block_size=block_size,
+                                      workers=workers, verbose=False)
+
+            def decompress():
+                huffman.decompress_file(compressed_file, decompressed_file, workers=workers, verbose=False)
+
+        # The reference implementation reports each file it writes
+        with contextlib.redirect_stdout(io.StringIO()):
+            # Run once outside the timings so a round trip failure stops early
+            compress()
+            decompress()
+            with open(decompressed_file, 'rb') as restored:
+                if restored.read() != data:
+                    raise ValueError(f"{file_path} did not round-trip in {mode} mode")
+
+            compress_times = _timings(compress, repeat, warmup)
+            decompress_times = _timings(decompress, repeat, warmup)
+            compress_peak = _traced_peak(compress)
+            decompress_peak = _traced_peak(decompress)
+
+        compressed_size = os.path.getsize(compressed_file)
+        if reference:
+            compressed_size += os.path.getsize(compressed_file + ".codes")
+            overhead = os.path.getsize(compressed_file + ".codes")
+        else:
+            overhead = compressed_size - huffman.file_info(compressed_file)["payload_size"]
+
+    return {
+        "file": os.path.basename(file_path),
+        "mode": "reference" if reference else mode,
+        "block_size": block_size,
+        "workers": workers,
+        "size": size,
+        "compressed_size": compressed_size,
+        "ratio": compressed_size / size if size else 1.0,
+        "overhead": overhead,
+        # Size cost of limiting codes to MAX_CODE_LENGTH bits, as a fraction
+        "length_limit_cost": huffman.length_limit_cost(frequency),
+        "compress_mb_s": _speeds(size, compress_times),
+        "decompress_mb_s": _speeds(size, decompress_times),
+        "compress_peak_bytes": compress_peak,
+        "decompress_peak_bytes": decompress_peak,
+        "max_rss_bytes": _max_rss(),
+    }
+
+
+def _isolated_case(kwargs):
+    return benchmark_case(**kwargs)
+
+
+def run_suite(files, modes=("bytes", "text"), repeat=REPEAT, warmup=WARMUP, block_size=None,
+              workers=(1,), reference=False):
+    """Benchmark every file in every mode and worker count.
+
+    Each case runs in a fresh process so that its max RSS is its own. Text
+    mode is skipped for files that are not UTF-8. Returns (results,
+    failures): result dicts, and (file, mode, message) for cases that raised
+    or did not round-trip, which are reported on stderr as they happen.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    cases = []
+    for file_path in files:
+        for mode in modes:
+            for count in workers:
+                cases.append({"file_path": file_path, "mode": mode, "repeat": repeat, "warmup": warmup,
+                              "block_size": block_size if count == 1 else block_size or huffman.BLOCK_SIZE,
+                              "workers": count})
+        if reference:
+            cases.append({"file_path": file_path, "repeat": repeat, "warmup": warmup, "reference": True})
+
+    results = []
+    failures = []
+    for case in cases:
+        mode = "reference" if case.get("reference") else case["mode"]
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            try:
+                result = pool.submit(_isolated_case, case).result()
+            except UnicodeDecodeError:
+                continue
+            except Exception as error:
+                failures.append((os.path.basename(case["file_path"]), mode, str(error)))
+                print(f"{failures[-1][0]:<14} {mode:<12} failed: {error}", file=sys.stderr, flush=True)
+                continue
+        results.append(result)
+        print(format_result(result), flush=True)
+    return results, failures
+
+
+def format_result(result):
+    name = result["mode"] if result["workers"] == 1 else f"{result['mode']} x{result['workers']}"
+    return (f"{result['file']:<14} {name:<12} {100 * result['ratio']:6.1f}% "
+            f"({result['overhead']:,} B overhead)  "
+            f"compress {result['compress_mb_s']['best']:7.2f} MB/s  "
+            f"decompress {result['decompress_mb_s']['best']:7.2f} MB/s  "
+            f"peak {result['compress_peak_bytes'] / (1024 * 1024):.1f}/"
+            f"{result['decompress_peak_bytes'] / (1024 * 1024):.1f} MiB"
+            + (f"  length limit +{result['length_limit_cost']:.3%}" if result["length_limit_cost"] else ""))
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(huffman.__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _case_key(result):
+    return result["file"], result["mode"], result["workers"], result["block_size"]
+
+
+def compare(old, new, threshold=0.05):
+    """Print the change in throughput and ratio between two result sets.
+
+    Changes worse than ``threshold`` (a fraction) are marked as regressions.
+    Returns the number of regressions.
+    """
+    previous = {_case_key(result): result for result in old["results"]}
+    regressions = 0
+    for result in new["results"]:
+        before = previous.get(_case_key(result))
+        if before is None:
+            continue
+        changes = []
+        for label, key, higher_is_better in (("compress", "compress_mb_s", True),
+                                             ("decompress", "decompress_mb_s", True),
+                                             ("size", "compressed_size", False)):
+            old_value = before[key]["best"] if higher_is_better else before[key]
+            new_value = result[key]["best"] if higher_is_better else result[key]
+            change = new_value / old_value - 1 if old_value else 0.0
+            worse = -change if higher_is_better else change
+            marker = " REGRESSION" if worse > threshold else ""
+            regressions += bool(marker)
+            changes.append(f"{label} {change:+.1%}{marker}")
+        print(f"{result['file']:<14} {result['mode']:<10} x{result['workers']}  " + ", ".join(changes))
+    return regressions
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="huffman_benchmark", description="Benchmark suite for huffman.py")
+    parser.add_argument("files", nargs="*", help="files to benchmark (default: a generated corpus)")
+    parser.add_argument("--size", type=int, default=CORPUS_SIZE,
+                        help=f"bytes per generated corpus file (default: {CORPUS_SIZE})")
+    parser.add_argument("--seed", type=int, default=CORPUS_SEED, help="corpus seed")
+    parser.add_argument("--corpus-dir", help="keep the generated corpus in this directory")
+    parser.add_argument("--mode", choices=list(huffman.MODES), action="append",
+                        help="alphabet mode to benchmark, may be repeated (default: all)")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help=f"timed runs per case (default: {REPEAT})")
+    parser.add_argument("--warmup", type=int, default=WARMUP, help=f"untimed runs first (default: {WARMUP})")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="also benchmark block mode on 2..WORKERS processes, 0 for one per CPU")
+    parser.add_argument("--block-size", type=int, default=None, help="symbols per block")
+    parser.add_argument("--reference", action="store_true",
+                        help="also benchmark the original string-based implementation")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="compare against results saved with --json")
+    parser.add_argument("--threshold", type=float, default=0.05,
+                        help="slowdown counted as a regression by --compare (default: 0.05)")
+    args = parser.parse_args(argv)
+
+    workers = huffman._resolve_workers(args.workers or None)
+    with tempfile.TemporaryDirectory() as tmp:
+        files = args.files or generate_corpus(args.corpus_dir or tmp, args.size, args.seed)
+        results, failures = run_suite(files, modes=args.mode or list(huffman.MODES), repeat=args.repeat,
+                                      warmup=args.warmup, block_size=args.block_size,
+                                      workers=range(1, workers + 1), reference=args.reference)
+
+    report = {
+        "commit": _git_commit(),
+        "created": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "corpus": None if args.files else {"size": args.size, "seed": args.seed},
+        "repeat": args.repeat,
+        "warmup": args.warmup,
+        "results": results,
+        "failures": [{"file": file, "mode": mode, "error": error} for file, mode, error in failures],
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    status = 0
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(json.load(f), report, args.threshold):
+                status = 1
+    # The reference implementation cannot code one-symbol files; only
+    # failures of the current implementation count
+    if any(mode != "reference" for file, mode, error in failures):
+        status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,533 @@
+"""Batch image conversion for png_compressor_gui.py, without the GUI.
+
+Walks files and directories, converts PNG to JPEG ("compress") or JPEG to
+PNG ("decompress") on a pool of processes, and skips images whose output is
+already up to date:
+
+    python image_batch.py compress screenshots/ -o small/ --quality 80 -j 8
+    python image_batch.py compress screenshots/ --skip hash
+    python image_batch.py compress photos/ --target-size 200k
+    python image_batch.py optimize screenshots/ --effort max
+
+With --cache, outputs are also kept in a compression_cache keyed by
+content, so an image converted before with the same settings, at any
+path, is copied instead of converted again.
+
+Instead of a fixed JPEG quality, a goal can be given: a size budget, or a
+minimum SSIM or PSNR against the source. The quality is then found by a
+binary search over in-memory encodes, about log2(100) of them per image.
+"optimize" keeps PNGs as PNGs and makes them smaller without loss, see
+png_optimize.
+"""
+
+import io
+import json
+import os
+import sys
+import time
+
+from PIL import Image
+
+import compression_cache
+import png_optimize
+import png_strips
+from atomic_write import open_output
+from compression_cache import file_digest, parse_size
+
+# Inputs taken by each mode when walking directories
+IMAGE_SUFFIXES = {"compress": (".png",), "decompress": (".jpg", ".jpeg"), "optimize": (".png",)}
+
+# Name added to outputs written next to their input, and their extension
+OUTPUT_SUFFIXES = {"compress": ("_compressed", ".jpg"), "decompress": ("_decompressed", ".png"),
+                   "optimize": ("_optimized", ".png")}
+
+# Records the source hash and settings behind each output for --skip hash
+MANIFEST_NAME = ".image_batch.json"
+
+# Goals for the quality search: ("size", bytes), ("ssim", minimum) or ("psnr", minimum dB)
+GOALS = ("size", "ssim", "psnr")
+
+# Side of the square window SSIM compares local statistics over
+SSIM_WINDOW = 7
+
+# Transparent areas are composited over this colour, as JPEG has no alpha
+BACKGROUND = (255, 255, 255)
+
+
+def convert_image(input_path, output_path, mode, quality=85, goal=None, max_memory=None, effort="normal",
+                  threads=None):
+    """Save a PNG as JPEG ("compress"), a JPEG as PNG ("decompress") or a smaller PNG ("optimize").
+
+    With a ``goal`` the JPEG quality is searched for instead of taking
+    ``quality``. ``max_memory`` caps the bytes of pixels held while
+    compressing, see open_flat. ``effort`` and ``threads`` are passed to
+    png_optimize.optimize_png. Returns the JPEG quality used, or for
+    optimize the description of the winning candidate.
+    """
+    if mode == "optimize":
+        data, report = png_optimize.optimize_png(input_path, effort, threads)
+        with open_output(output_path) as f:
+            f.write(data)
+        return report["best"]
+    if mode != "compress":
+        with Image.open(input_path) as img, open_output(output_path) as f:
+            img.save(f, 'PNG')
+        return None
+    img = open_flat(input_path, max_memory)
+    if goal is None:
+        with open_output(output_path) as f:
+            img.save(f, 'JPEG', quality=quality)
+        return quality
+    quality, data = search_quality(img, goal)
+    # The search kept the chosen encode, so the file is written once
+    with open_output(output_path) as f:
+        f.write(data)
+    return quality
+
+
+def flatten(img, background=BACKGROUND):
+    """Return ``img`` in a mode JPEG can store, compositing transparency over ``background``"""
+    if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info:
+        if img.mode != "RGBA":
+            img = img.convert("RGBA")
+        flat = Image.new("RGB", img.size, background)
+        flat.paste(img, (0, 0), img)
+        return flat
+    if img.mode in ("RGB", "L"):
+        return img
+    return img.convert("RGB")
+
+
+def _pixel_bytes(img):
+    """Bytes per pixel of an image once decoded; Pillow pads RGB and LA pixels to four"""
+    return 1 if img.mode in ("1", "L", "P") else 4
+
+
+def open_flat(input_path, max_memory=None):
+    """Decode an image and flatten it for JPEG, holding at most ``max_memory`` bytes of pixels.
+
+    A full decode holds the decoded image and its flattened copy at once,
+    8 bytes a pixel for RGBA. PNGs that would need more than
+    ``max_memory`` that way are decoded a strip at a time instead, and only
+    the flattened result is held in full. Raises MemoryError when even that
+    does not fit.
+    """
+    img = Image.open(input_path)
+    width, height = img.size
+    flat_bytes = 1 if img.mode == "L" and "transparency" not in img.info else 4
+    if max_memory is None or width * height * (_pixel_bytes(img) + flat_bytes) <= max_memory:
+        img.load()
+        flat = flatten(img)
+        if flat is not img:
+            img.close()
+        return flat
+    img.close()
+    rows = (max_memory - width * height * flat_bytes) // (width * png_strips.STRIP_BYTES_PER_PIXEL)
+    if rows < 1:
+        needed = width * (height * flat_bytes + png_strips.STRIP_BYTES_PER_PIXEL)
+        raise MemoryError(f"{width}x{height} image needs at least {needed / 1e6:.1f} MB to convert")
+
+    flat = None
+    with open(input_path, "rb") as f:
+        if f.read(8) != png_strips.PNG_SIGNATURE:
+            raise MemoryError(f"{width}x{height} image is over the memory limit and only PNGs can be "
+                              f"decoded in strips")
+        f.seek(0)
+        for top, strip in png_strips.iter_strips(f, rows):
+            strip = flatten(strip)
+            if flat is None:
+                flat = Image.new(strip.mode, (width, height))
+            flat.paste(strip, (0, top))
+    return flat
+
+
+def encode_jpeg(img, quality):
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def _luma(pixels):
+    import numpy
+
+    pixels = numpy.asarray(pixels, dtype=numpy.float64)
+    if pixels.ndim == 2:
+        return pixels
+    return pixels[..., :3] @ numpy.array([0.299, 0.587, 0.114])
+
+
+def psnr(reference, candidate):
+    """Peak signal-to-noise ratio in dB between two images of the same size"""
+    import numpy
+
+    reference = numpy.asarray(reference, dtype=numpy.float64)
+    candidate = numpy.asarray(candidate, dtype=numpy.float64)
+    mse = numpy.mean((reference - candidate) ** 2)
+    if mse == 0:
+        return float("inf")
+    return float(10 * numpy.log10(255 ** 2 / mse))
+
+
+def _box_mean(values, size):
+    """Mean over every size x size window, from an integral image"""
+    import numpy
+
+    total = numpy.pad(values.cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+    return (total[size:, size:] - total[:-size, size:] - total[size:, :-size] + total[:-size, :-size]) / size ** 2
+
+
+def ssim(reference, candidate):
+    """Mean structural similarity of the luma of two images, 1.0 when identical.
+
+    Windows are uniform rather than Gaussian, which is cheaper and ranks
+    JPEG qualities the same way.
+    """
+    x = _luma(reference)
+    y = _luma(candidate)
+    size = min(SSIM_WINDOW, *x.shape)
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    mean_x = _box_mean(x, size)
+    mean_y = _box_mean(y, size)
+    var_x = _box_mean(x * x, size) - mean_x ** 2
+    var_y = _box_mean(y * y, size) - mean_y ** 2
+    covariance = _box_mean(x * y, size) - mean_x * mean_y
+    index = ((2 * mean_x * mean_y + c1) * (2 * covariance + c2)
+             / ((mean_x ** 2 + mean_y ** 2 + c1) * (var_x + var_y + c2)))
+    return float(index.mean())
+
+
+def search_quality(img, goal, lowest=1, highest=100):
+    """Binary search the JPEG quality for ``goal``; returns (quality, encoded bytes).
+
+    A size goal takes the highest quality that fits, a metric goal the
+    lowest quality that reaches it, assuming both grow with quality. The
+    source pixels are converted once and every encode stays in memory.
+    Raises ValueError when no quality meets the goal.
+    """
+    kind, value = goal
+    if kind not in GOALS:
+        raise ValueError(f"unknown goal {kind!r}, expected one of {', '.join(GOALS)}")
+    if kind != "size":
+        import numpy
+
+        reference = numpy.asarray(img)
+        metric = ssim if kind == "ssim" else psnr
+
+    best = None
+    while lowest <= highest:
+        quality = (lowest + highest) // 2
+        data = encode_jpeg(img, quality)
+        if kind == "size":
+            met = len(data) <= value
+        else:
+            with Image.open(io.BytesIO(data)) as decoded:
+                met = metric(reference, decoded) >= value
+        if met:
+            best = quality, data
+        # Look above a quality that fits the size, below one that reaches the metric
+        if met == (kind == "size"):
+            lowest = quality + 1
+        else:
+            highest = quality - 1
+    if best is None:
+        if kind == "size":
+            raise ValueError(f"cannot fit in {value:,} bytes, even at the lowest quality")
+        raise ValueError(f"cannot reach {kind.upper()} {value}, even at the highest quality")
+    return best
+
+
+def accepts(file_path, mode):
+    """Whether a file is an input for the mode: PNG to compress or optimize, JPEG to decompress"""
+    return file_path.lower().endswith(IMAGE_SUFFIXES[mode])
+
+
+def output_name(input_path, mode, root=None, output_dir=None):
+    """The output for an input, next to it or mirrored under ``output_dir``.
+
+    ``root`` is the directory the input was found in, so its subdirectories
+    are recreated under ``output_dir``.
+    """
+    suffix, extension = OUTPUT_SUFFIXES[mode]
+    if output_dir is None:
+        return os.path.splitext(input_path)[0] + suffix + extension
+    relative = os.path.relpath(input_path, root) if root else os.path.basename(input_path)
+    return os.path.join(output_dir, os.path.splitext(relative)[0] + extension)
+
+
+def find_images(paths, mode, recursive=True):
+    """Yield (image, root) for the inputs of ``mode`` among files and directories.
+
+    Files given directly are always taken, files inside directories only when
+    their extension matches the mode and they are not an earlier output of
+    any mode, such as NAME_optimized.png or NAME_decompressed.png.
+    """
+    outputs = tuple(suffix + extension for suffix, extension in OUTPUT_SUFFIXES.values())
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path, None
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            if not recursive:
+                dirs.clear()
+            for name in sorted(files):
+                if accepts(name, mode) and not name.lower().endswith(outputs):
+                    yield os.path.join(root, name), path
+
+
+def is_up_to_date(source, target):
+    """Whether ``target`` exists and is newer than ``source``"""
+    try:
+        return os.stat(target).st_mtime_ns >= os.stat(source).st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def load_manifest(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        # A damaged manifest only costs a full rebuild
+        return {}
+
+
+def save_manifest(path, manifest):
+    with open_output(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=0, sort_keys=True)
+
+
+def _result(source, target, status="converted"):
+    return {"source": source, "target": target, "status": status, "input_size": 0, "output_size": 0,
+            "seconds": 0.0, "detail": None, "digest": None, "cached": False, "error": None}
+
+
+def _settings(mode, options):
+    """The options an output of ``mode`` depends on, as JSON-serializable values"""
+    settings = {"mode": mode}
+    if mode == "compress":
+        settings["goal"] = list(options["goal"]) if options.get("goal") else None
+        settings["quality"] = None if settings["goal"] else options.get("quality", 85)
+    elif mode == "optimize":
+        settings["effort"] = options.get("effort", "normal")
+    return settings
+
+
+def _cache_params(mode, options):
+    """What an output depends on besides its input, for compression_cache"""
+    import PIL
+
+    return dict(_settings(mode, options), pillow=PIL.__version__)
+
+
+def convert_one(source, target, mode, options, known_digest=None, hashed=False, cache=None):
+    """Convert one image for the batch engine; errors are returned, not raised.
+
+    ``options`` are keyword arguments for convert_image. With ``hashed`` the
+    source is hashed first, and the conversion is skipped when the hash
+    equals ``known_digest``. ``cache`` is (directory, max bytes, link) for
+    compression_cache.open_cache, which supplies outputs converted before.
+    Returns a dict with the status ("converted", "skipped" or "failed"),
+    sizes, seconds, detail (what convert_image returned), digest, whether
+    the output came from the cache and error.
+    """
+    start_time = time.perf_counter()
+    result = _result(source, target)
+    try:
+        if hashed:
+            result["digest"] = file_digest(source)
+            if result["digest"] == known_digest and os.path.exists(target):
+                result["status"] = "skipped"
+                return result
+        directory = os.path.dirname(target)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if cache is None:
+            result["detail"] = convert_image(source, target, mode, **options)
+        else:
+            result["detail"], result["cached"] = compression_cache.open_cache(*cache).run(
+                source, target, _cache_params(mode, options), lambda: convert_image(source, target, mode, **options),
+                result["digest"])
+        result["input_size"] = os.path.getsize(source)
+        result["output_size"] = os.path.getsize(target)
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = str(e)
+    result["seconds"] = time.perf_counter() - start_time
+    return result
+
+
+def batch_convert(input_path, output_path, mode, options, cache=None):
+    """convert_one for batch_queue.BatchQueue: (input size, output size, seconds, error)"""
+    result = convert_one(input_path, output_path, mode, options, cache=cache)
+    return result["input_size"], result["output_size"], result["seconds"], result["error"]
+
+
+def _run_tasks(tasks, workers):
+    """Yield convert_one(*task) as tasks finish, on up to ``workers`` processes.
+
+    Submission is bounded so tens of thousands of tasks do not all sit in
+    the pool's queue at once.
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield convert_one(*task)
+        return
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for task in tasks:
+            pending.add(pool.submit(convert_one, *task))
+            if len(pending) >= workers * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in pending:
+            yield future.result()
+
+
+def convert_images(paths, mode="compress", quality=85, output_dir=None, recursive=True, skip="mtime",
+                   workers=None, manifest_path=None, on_result=None, goal=None, max_memory=None, effort="normal",
+                   cache=None):
+    """Convert every image under ``paths`` and return the batch totals.
+
+    ``skip`` decides which images are left alone: "mtime" skips an image when
+    its output is newer, "hash" when the source's SHA-256 and the settings
+    match those recorded in the manifest, and "none" converts everything.
+    mtime is cheap but does not notice a change of ``quality``; hash does,
+    at the cost of reading every source. The manifest defaults to
+    MANIFEST_NAME in ``output_dir`` or the current directory. ``goal``
+    replaces ``quality`` with a search, see search_quality. ``max_memory``
+    applies to each worker process, see open_flat. ``effort`` applies to
+    optimize, whose candidates are spread over threads only when the images
+    are not already spread over processes. ``cache`` is passed to
+    convert_one.
+
+    ``on_result(result)`` is called with each convert_one result, skipped
+    images included, in completion order.
+    """
+    workers = workers or os.cpu_count() or 1
+    if skip == "hash" and manifest_path is None:
+        manifest_path = os.path.join(output_dir or ".", MANIFEST_NAME)
+    manifest = load_manifest(manifest_path) if skip == "hash" else {}
+    totals = {"converted": 0, "skipped": 0, "failed": 0, "cached": 0, "input_bytes": 0, "output_bytes": 0}
+    options = {"quality": quality, "goal": goal, "max_memory": max_memory, "effort": effort,
+               "threads": 1 if workers > 1 else None}
+    # What an output depends on, as stored in the JSON manifest
+    settings = _settings(mode, options)
+
+    def tasks():
+        for source, root in find_images(paths, mode, recursive):
+            target = output_name(source, mode, root, output_dir)
+            if skip == "mtime" and is_up_to_date(source, target):
+                totals["skipped"] += 1
+                if on_result:
+                    on_result(_result(source, target, "skipped"))
+                continue
+            known_digest = None
+            if skip == "hash":
+                entry = manifest.get(os.path.abspath(target), {})
+                if all(entry.get(key) == value for key, value in settings.items()):
+                    known_digest = entry["sha256"]
+            yield source, target, mode, options, known_digest, skip == "hash", cache
+
+    start_time = time.perf_counter()
+    try:
+        for result in _run_tasks(tasks(), workers):
+            totals[result["status"]] += 1
+            totals["cached"] += result["cached"]
+            totals["input_bytes"] += result["input_size"]
+            totals["output_bytes"] += result["output_size"]
+            if result["status"] == "converted" and result["digest"]:
+                manifest[os.path.abspath(result["target"])] = dict(settings, sha256=result["digest"])
+            if on_result:
+                on_result(result)
+    finally:
+        # Saved even when interrupted, so the next run skips the finished images
+        if skip == "hash":
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+            save_manifest(manifest_path, manifest)
+    totals["seconds"] = time.perf_counter() - start_time
+    totals["images_per_second"] = totals["converted"] / totals["seconds"] if totals["seconds"] else 0.0
+    return totals
+
+
+def main(argv=None):
+    """Command line entry point; returns the exit status (1 if any image failed)."""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="image_batch", description="Batch PNG/JPEG conversion")
+    parser.add_argument("mode", choices=list(IMAGE_SUFFIXES),
+                        help="compress converts PNG to JPEG, decompress converts JPEG to PNG, optimize "
+                             "shrinks PNGs without loss")
+    parser.add_argument("paths", nargs="+", help="images or directories")
+    parser.add_argument("-o", "--output-dir",
+                        help="write outputs here, mirroring the input directories (default: next to each "
+                             "input, as NAME_compressed.jpg, NAME_decompressed.png or NAME_optimized.png)")
+    parser.add_argument("--quality", type=int, default=85, help="JPEG quality from 0 to 100 (default: 85)")
+    goals = parser.add_mutually_exclusive_group()
+    goals.add_argument("--target-size", type=parse_size,
+                       help="highest quality that fits in this size, such as 150000, 200k or 1.5M")
+    goals.add_argument("--min-ssim", type=float, help="lowest quality with at least this SSIM, such as 0.95")
+    goals.add_argument("--min-psnr", type=float, help="lowest quality with at least this PSNR in dB, such as 40")
+    parser.add_argument("--effort", choices=list(png_optimize.EFFORTS), default="normal",
+                        help="how many encodings optimize tries (default: normal)")
+    parser.add_argument("--no-recursive", dest="recursive", action="store_false",
+                        help="only take the top level of directories")
+    parser.add_argument("--skip", choices=("mtime", "hash", "none"), default="mtime",
+                        help="how up to date outputs are detected (default: mtime)")
+    parser.add_argument("--max-memory", type=parse_size,
+                        help="pixel memory per worker, such as 512M; larger PNGs are decoded in strips")
+    parser.add_argument("--manifest", help=f"manifest for --skip hash (default: OUTPUT_DIR/{MANIFEST_NAME})")
+    parser.add_argument("--cache", nargs="?", const="", metavar="DIR",
+                        help="copy the output of an identical image converted before with the same settings "
+                             "instead of converting it again (default DIR: ~/.cache/file-compression/outputs)")
+    parser.add_argument("--cache-size", type=parse_size, default=compression_cache.DEFAULT_MAX_BYTES,
+                        help="evict the least recently used cached outputs beyond this size (default: 1G)")
+    parser.add_argument("--cache-link", action="store_true",
+                        help="hard link cached outputs instead of copying them; they must then not be modified "
+                             "in place")
+    parser.add_argument("-j", "--jobs", type=int, default=0, help="worker processes, 0 for one per CPU")
+    parser.add_argument("-q", "--quiet", action="store_true", help="do not print a line per image")
+    args = parser.parse_args(argv)
+    goal = None
+    if args.target_size is not None:
+        goal = ("size", args.target_size)
+    elif args.min_ssim is not None:
+        goal = ("ssim", args.min_ssim)
+    elif args.min_psnr is not None:
+        goal = ("psnr", args.min_psnr)
+
+    def report(result):
+        if result["status"] == "failed":
+            print(f"image_batch: {result['source']}: {result['error']}", file=sys.stderr)
+        elif result["status"] == "converted" and not args.quiet:
+            saved = result["input_size"] - result["output_size"]
+            percent = 100 * saved / result["input_size"] if result["input_size"] else 0.0
+            print(f"{result['source']} -> {result['target']}: {result['input_size']:,} -> "
+                  f"{result['output_size']:,} bytes ({percent:.1f}% saved"
+                  + (f", quality {result['detail']}" if goal else "")
+                  + (f", {result['detail']}" if args.mode == "optimize" else "")
+                  + (", cached" if result["cached"] else "") + f"), {result['seconds']:.2f}s")
+
+    cache = (args.cache or None, args.cache_size, args.cache_link) if args.cache is not None else None
+    totals = convert_images(args.paths, args.mode, args.quality, args.output_dir, args.recursive, args.skip,
+                            args.jobs or None, args.manifest, report, goal, args.max_memory, args.effort, cache)
+    saved = totals["input_bytes"] - totals["output_bytes"]
+    percent = 100 * saved / totals["input_bytes"] if totals["input_bytes"] else 0.0
+    print(f"{totals['converted']} converted, {totals['skipped']} up to date, {totals['failed']} failed; "
+          f"{totals['input_bytes']:,} -> {totals['output_bytes']:,} bytes ({percent:.1f}% saved), "
+          f"{totals['seconds']:.1f}s, {totals['images_per_second']:.1f} images/s")
+    if cache is not None:
+        print(f"Cache: {totals['cached']} of {totals['converted']} converted image(s) copied from "
+              f"{compression_cache.open_cache(*cache).directory}")
+    return 1 if totals["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
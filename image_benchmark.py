@@ -0,0 +1,138 @@
+"""Memory benchmark for PNG to JPEG conversion in image_batch.py.
+
+Generates RGBA PNGs of increasing size and converts each one in a fresh
+process, with a full decode and with strips under a memory ceiling,
+recording peak RSS against megapixels:
+
+    python image_benchmark.py --megapixels 4 16 64 --json rss.json
+    python image_benchmark.py --max-memory 256M
+"""
+
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import image_batch
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MEGAPIXELS = (1, 4, 16, 36, 64)
+
+# Memory for strips on top of the flattened image, when no ceiling is given
+STRIP_HEADROOM = 32 * 2 ** 20
+
+
+def generate_image(path, megapixels):
+    """Write a 4:3 RGBA PNG with a soft alpha edge, so compositing is exercised"""
+    from PIL import Image, ImageDraw
+
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(megapixels * 1e6 / width)
+    # Drawn small and scaled up, which is fast and still gives the encoders some work
+    small = Image.new("RGBA", (max(width // 8, 1), max(height // 8, 1)), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(small)
+    for i in range(0, small.width, 7):
+        draw.line((i, 0, small.width - i, small.height), fill=(i % 256, 80, 200 - i % 200, 160 + i % 96))
+    small.resize((width, height), Image.Resampling.BILINEAR).save(path, compress_level=1)
+    return width, height
+
+
+def _max_rss():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def benchmark_case(file_path, max_memory=None):
+    """Convert one image and measure it; meant to run in a fresh process"""
+    baseline = _max_rss()
+    output_path = file_path + ".jpg"
+    start_time = time.perf_counter()
+    image_batch.convert_image(file_path, output_path, "compress", max_memory=max_memory)
+    seconds = time.perf_counter() - start_time
+    peak = _max_rss()
+    os.remove(output_path)
+    return {"seconds": seconds, "baseline_rss_bytes": baseline, "max_rss_bytes": peak}
+
+
+def run_suite(megapixels=MEGAPIXELS, max_memory=None, directory=None):
+    """Benchmark each size with a full decode and in strips.
+
+    The strips run under ``max_memory``, or by default under the size of
+    the flattened RGB image plus STRIP_HEADROOM. Each case runs in its own
+    process, so that its max RSS is its own.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in megapixels:
+            file_path = os.path.join(directory or tmp, f"{size:g}mp.png")
+            width, height = generate_image(file_path, size)
+            # Pillow holds RGB in four bytes a pixel
+            for limit in (None, max_memory or width * height * 4 + STRIP_HEADROOM):
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    try:
+                        result = pool.submit(benchmark_case, file_path, limit).result()
+                    except Exception as error:
+                        print(f"{size:>5} MP  {'strips' if limit else 'full':<7} failed: {error}",
+                              file=sys.stderr, flush=True)
+                        continue
+                result.update(megapixels=width * height / 1e6, width=width, height=height,
+                              path="strips" if limit else "full", max_memory=limit)
+                results.append(result)
+                print(format_result(result), flush=True)
+    return results
+
+
+def format_result(result):
+    text = f"{result['megapixels']:7.1f} MP  {result['path']:<7} {result['seconds']:6.2f}s"
+    if result["max_memory"]:
+        text += f"  limit {result['max_memory'] / 2 ** 20:6.0f} MiB"
+    else:
+        text += " " * 18
+    if result["max_rss_bytes"] is not None:
+        used = result["max_rss_bytes"] - result["baseline_rss_bytes"]
+        text += (f"  peak RSS {result['max_rss_bytes'] / 2 ** 20:7.1f} MiB"
+                 f"  (+{used / 2 ** 20:.1f} MiB, {used / (result['megapixels'] * 1e6):.2f} B/pixel)")
+    return text
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="image_benchmark", description="Memory benchmark for image_batch.py")
+    parser.add_argument("--megapixels", type=float, nargs="+", default=list(MEGAPIXELS),
+                        help=f"image sizes to generate (default: {' '.join(map(str, MEGAPIXELS))})")
+    parser.add_argument("--max-memory", type=image_batch.parse_size,
+                        help=f"ceiling for the strip runs, such as 256M (default: the flattened image plus "
+                             f"{STRIP_HEADROOM // 2 ** 20} MiB)")
+    parser.add_argument("--image-dir", help="keep the generated images in this directory")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    if args.image_dir:
+        os.makedirs(args.image_dir, exist_ok=True)
+    results = run_suite(args.megapixels, args.max_memory, args.image_dir)
+    if args.json:
+        report = {
+            "created": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": results,
+        }
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0 if results else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,45 @@
 import tkinter as tk
 import customtkinter
 from tkinter import filedialog, messagebox
-from PIL import Image, ImageTk
 import os
+from concurrent.futures import ThreadPoolExecutor
 from tkinterdnd2 import DND_FILES, TkinterDnD
+from batch_queue import BatchQueue, expand_paths, split_drop
+from preview_cache import PreviewCache
+from atomic_write import open_output
+from image_batch import accepts, batch_convert, convert_image, is_up_to_date, output_name
+from png_optimize import EFFORTS, optimize_png
+
+# Goal menu entries: the image_batch goal and the unit its value is entered in
+GOAL_CHOICES = {
+    "Use slider": None,
+    "Max size (KB)": ("size", 1024),
+    "Min SSIM": ("ssim", 1),
+    "Min PSNR (dB)": ("psnr", 1),
+}
+
+# How often the Tk loop checks on the image being converted, in milliseconds
+POLL_INTERVAL = 50
+
+
+def process_image(input_path, output_path, mode, quality, goal, effort):
+    """Convert one image off the Tk thread and return the status message to show"""
+    if mode == "compress":
+        quality = convert_image(input_path, output_path, "compress", quality, goal)
+        return (f"Image compressed successfully at quality {quality}!\n"
+                f"Size: {os.path.getsize(output_path):,} bytes\nSaved to: {output_path}")
+    if mode == "optimize":
+        data, report = optimize_png(input_path, effort)
+        with open_output(output_path) as f:
+            f.write(data)
+        saved = report["input_size"] - report["output_size"]
+        return (f"PNG optimized losslessly in {report['seconds']:.2f}s!\n"
+                f"Size: {report['input_size']:,} -> {report['output_size']:,} bytes "
+                f"({saved / max(report['input_size'], 1):.1%} saved)\n"
+                f"Best of {report['candidates']}: {report['best']}\nSaved to: {output_path}")
+    convert_image(input_path, output_path, "decompress")
+    return f"Image decompressed successfully!\nSaved to: {output_path}"
+
 
 class ImageCompressorGUI:
     def __init__(self, root):
@@ -53,6 +89,9 @@ class ImageCompressorGUI:
             font=customtkinter.CTkFont(size=14)
         )
         self.preview_label.pack(expand=True)
+        self.previews = PreviewCache(root)
+        # Single images are converted here so the window keeps responding
+        self.worker = ThreadPoolExecutor(max_workers=1)
 
         # Mode selection
         self.mode_frame = customtkinter.CTkFrame(self.control_frame)
@@ -84,6 +123,15 @@ class ImageCompressorGUI:
         )
         self.decompress_radio.pack(side="left", padx=10)
 
+        self.optimize_radio = customtkinter.CTkRadioButton(
+            self.mode_frame,
+            text="Optimize",
+            variable=self.mode_var,
+            value="optimize",
+            command=self.update_mode
+        )
+        self.optimize_radio.pack(side="left", padx=10)
+
         # Input file
         self.input_frame = customtkinter.CTkFrame(self.control_frame)
         self.input_frame.pack(fill="x", padx=10, pady=10)
@@ -166,6 +214,37 @@ class ImageCompressorGUI:
         )
         self.quality_value_label.pack()
 
+        # Optional goal that replaces the slider with a search for the quality
+        self.goal_frame = customtkinter.CTkFrame(self.quality_frame, fg_color="transparent")
+        self.goal_frame.pack(fill="x", pady=(5, 0))
+        self.goal_menu = customtkinter.CTkOptionMenu(
+            self.goal_frame,
+            values=list(GOAL_CHOICES),
+            width=150
+        )
+        self.goal_menu.pack(side="left", padx=5)
+        self.goal_entry = customtkinter.CTkEntry(
+            self.goal_frame,
+            placeholder_text="e.g. 200, 0.95 or 40",
+            width=140
+        )
+        self.goal_entry.pack(side="left", padx=5)
+
+        # Optimizer effort, shown instead of the quality slider in optimize mode
+        self.effort_frame = customtkinter.CTkFrame(self.control_frame)
+        customtkinter.CTkLabel(
+            self.effort_frame,
+            text="Optimization Effort:",
+            font=customtkinter.CTkFont(size=14, weight="bold")
+        ).pack(pady=(0, 5))
+        self.effort_menu = customtkinter.CTkOptionMenu(
+            self.effort_frame,
+            values=list(EFFORTS),
+            width=120
+        )
+        self.effort_menu.set("normal")
+        self.effort_menu.pack(pady=(0, 5))
+
         # Compress button
         self.compress_btn = customtkinter.CTkButton(
             self.control_frame,
@@ -186,53 +265,98 @@ class ImageCompressorGUI:
         )
         self.status_label.pack(pady=10)
 
+        # Batch queue, filled by dropping several files or a folder
+        self.batch = BatchQueue(root, batch_convert, on_job=self.report_batch_job,
+                                on_update=self.update_batch_progress)
+        self.batch_frame = customtkinter.CTkFrame(self.control_frame)
+        self.batch_frame.pack(fill="both", expand=True, padx=10, pady=10)
+
+        self.batch_title = customtkinter.CTkLabel(
+            self.batch_frame,
+            text="Batch Queue:",
+            font=customtkinter.CTkFont(size=14, weight="bold")
+        )
+        self.batch_title.pack(pady=(0, 5))
+
+        self.batch_controls = customtkinter.CTkFrame(self.batch_frame, fg_color="transparent")
+        self.batch_controls.pack(fill="x")
+        customtkinter.CTkLabel(self.batch_controls, text="Workers:").pack(side="left", padx=5)
+        self.workers_menu = customtkinter.CTkOptionMenu(
+            self.batch_controls,
+            values=[str(n) for n in range(1, (os.cpu_count() or 1) + 1)],
+            command=self.set_batch_workers,
+            width=80
+        )
+        self.workers_menu.set(str(self.batch.workers))
+        self.workers_menu.pack(side="left", padx=5)
+        self.cancel_batch_btn = customtkinter.CTkButton(
+            self.batch_controls,
+            text="Cancel",
+            command=self.batch.cancel,
+            width=100,
+            state="disabled"
+        )
+        self.cancel_batch_btn.pack(side="right", padx=5)
+
+        self.batch_progress = customtkinter.CTkProgressBar(self.batch_frame)
+        self.batch_progress.pack(fill="x", padx=5, pady=(10, 0))
+        self.batch_progress.set(0)
+        self.batch_summary = customtkinter.CTkLabel(
+            self.batch_frame,
+            text="Drop several images or a folder to queue them",
+            font=customtkinter.CTkFont(size=12)
+        )
+        self.batch_summary.pack(pady=5)
+
+        self.batch_log = customtkinter.CTkTextbox(self.batch_frame, height=120)
+        self.batch_log.pack(fill="both", expand=True, padx=5, pady=(0, 5))
+        self.batch_log.configure(state='disabled')
+
+    def get_goal(self):
+        """The image_batch goal chosen in the goal menu, or None for the slider"""
+        choice = GOAL_CHOICES[self.goal_menu.get()]
+        if choice is None:
+            return None
+        kind, unit = choice
+        try:
+            value = float(self.goal_entry.get()) * unit
+        except ValueError:
+            raise ValueError(f"Enter a number for {self.goal_menu.get()}")
+        return (kind, int(value)) if kind == "size" else (kind, value)
+
     def update_quality_label(self, value):
         self.quality_value_label.configure(text=f"{int(float(value))}%")
 
     def browse_input(self):
-        if self.mode_var.get() == "compress":
-            filetypes = [("PNG files", "*.png"), ("All files", "*.*")]
-        else:
+        if self.mode_var.get() == "decompress":
             filetypes = [("JPEG files", "*.jpg;*.jpeg"), ("All files", "*.*")]
+        else:
+            filetypes = [("PNG files", "*.png"), ("All files", "*.*")]
             
         filename = filedialog.askopenfilename(filetypes=filetypes)
         if filename:
             self.input_path.set(filename)
             self.update_preview(filename)
             # Auto-set output filename
-            base_name = os.path.splitext(filename)[0]
-            if self.mode_var.get() == "compress":
-                output_name = base_name + "_compressed.jpg"
-            else:
-                output_name = base_name + "_decompressed.png"
-            self.output_path.set(output_name)
+            self.output_path.set(output_name(filename, self.mode_var.get()))
 
     def update_preview(self, image_path=None):
-        """Update the preview panel with the selected image"""
+        """Update the preview panel with the selected image, decoded in the background"""
         if image_path is None:
             image_path = self.input_path.get()
             
         if not image_path:
             self.preview_label.configure(image=None, text="No image selected")
             return
-            
-        try:
-            # Open and resize image for preview
-            image = Image.open(image_path)
-            # Calculate aspect ratio
-            aspect_ratio = image.width / image.height
-            preview_width = 300
-            preview_height = int(preview_width / aspect_ratio)
-            
-            # Resize image maintaining aspect ratio
-            image = image.resize((preview_width, preview_height), Image.Resampling.LANCZOS)
-            photo = ImageTk.PhotoImage(image)
-            
-            # Update preview label
-            self.preview_label.configure(image=photo, text="")
-            self.preview_label.image = photo  # Keep a reference
-        except Exception as e:
-            self.preview_label.configure(image=None, text=f"Error loading preview: {str(e)}")
+
+        self.previews.request(image_path, self.show_preview)
+
+    def show_preview(self, photo, error):
+        if error is not None:
+            self.preview_label.configure(image=None, text=f"Error loading preview: {error}")
+            return
+        self.preview_label.configure(image=photo, text="")
+        self.preview_label.image = photo  # Keep a reference
 
     def browse_output(self):
         if self.mode_var.get() == "compress":
@@ -252,10 +376,16 @@ class ImageCompressorGUI:
         mode = self.mode_var.get()
         if mode == "compress":
             self.compress_btn.configure(text="Compress Image")
-            self.quality_frame.pack(fill="x", padx=10, pady=10)
+            self.quality_frame.pack(fill="x", padx=10, pady=10, before=self.compress_btn)
+            self.effort_frame.pack_forget()
+        elif mode == "optimize":
+            self.compress_btn.configure(text="Optimize PNG")
+            self.quality_frame.pack_forget()
+            self.effort_frame.pack(fill="x", padx=10, pady=10, before=self.compress_btn)
         else:
             self.compress_btn.configure(text="Decompress Image")
             self.quality_frame.pack_forget()
+            self.effort_frame.pack_forget()
         
         # Clear paths
         self.input_path.set("")
@@ -263,24 +393,80 @@ class ImageCompressorGUI:
         self.preview_label.configure(image=None, text="No image selected")
 
     def handle_drop(self, event):
-        file_path = event.data.strip("{}")
-        if file_path.startswith('"') and file_path.endswith('"'):
-            file_path = file_path[1:-1]
+        paths = split_drop(self.root, event.data)
+        mode = self.mode_var.get()
+        if len(paths) != 1 or os.path.isdir(paths[0]):
+            self.start_batch(paths)
+            return
+        file_path = paths[0]
         
         # Check if the dropped file matches the current mode
-        if self.mode_var.get() == "compress" and file_path.lower().endswith('.png'):
+        if accepts(file_path, mode):
             self.input_path.set(file_path)
             self.update_preview(file_path)
-            base_name = os.path.splitext(file_path)[0]
-            self.output_path.set(base_name + "_compressed.jpg")
-        elif self.mode_var.get() == "decompress" and file_path.lower().endswith(('.jpg', '.jpeg')):
-            self.input_path.set(file_path)
-            self.update_preview(file_path)
-            base_name = os.path.splitext(file_path)[0]
-            self.output_path.set(base_name + "_decompressed.png")
+            self.output_path.set(output_name(file_path, mode))
         else:
             messagebox.showerror("Invalid File", 
-                               "Please drop a PNG file for compression or a JPEG file for decompression")
+                               "Please drop a PNG file to compress or optimize, or a JPEG file to decompress")
+
+    def start_batch(self, paths):
+        """Queue the dropped images that match the current mode"""
+        mode = self.mode_var.get()
+        sources = [path for path in expand_paths(paths, lambda path: accepts(path, mode)) if accepts(path, mode)]
+        if not sources:
+            messagebox.showerror("Invalid Files", 
+                               "Please drop PNG files to compress or optimize, or JPEG files to decompress")
+            return
+        jobs = [(source, output_name(source, mode)) for source in sources]
+        up_to_date = sum(is_up_to_date(source, target) for source, target in jobs)
+        if up_to_date:
+            self.log_batch(f"Skipped {up_to_date} image(s) whose output is newer")
+            jobs = [(source, target) for source, target in jobs if not is_up_to_date(source, target)]
+        existing = sum(os.path.exists(target) for _, target in jobs)
+        if existing and not messagebox.askyesno(
+                "Files Exist", f"{existing} output file(s) already exist. Overwrite them?\nNo skips those files."):
+            jobs = [(source, target) for source, target in jobs if not os.path.exists(target)]
+        if not jobs:
+            return
+        try:
+            goal = self.get_goal() if mode == "compress" else None
+        except ValueError as e:
+            messagebox.showerror("Invalid Goal", str(e))
+            return
+        # Each worker optimizes on one thread when there are several workers
+        options = {"quality": self.quality_var.get(), "goal": goal, "effort": self.effort_menu.get(),
+                   "threads": 1 if self.batch.workers > 1 else None}
+        self.log_batch(f"Queued {len(jobs)} image(s) on {self.batch.workers} worker(s)")
+        for source, target in jobs:
+            self.batch.submit(source, target, mode, options)
+        self.cancel_batch_btn.configure(state="normal")
+
+    def set_batch_workers(self, value):
+        self.batch.workers = int(value)
+
+    def log_batch(self, message):
+        self.batch_log.configure(state='normal')
+        self.batch_log.insert('end', message + '\n')
+        self.batch_log.see('end')
+        self.batch_log.configure(state='disabled')
+
+    def report_batch_job(self, job):
+        name = os.path.basename(job.source)
+        if job.status == "done":
+            self.log_batch(f"done      {name}  {job.input_size:,} -> {job.output_size:,} bytes")
+        elif job.status == "failed":
+            self.log_batch(f"failed    {name}: {job.error}")
+        else:
+            self.log_batch(f"cancelled {name}")
+
+    def update_batch_progress(self, queue):
+        counts = queue.counts()
+        if queue.jobs:
+            self.batch_progress.set((len(queue.jobs) - counts["queued"] - counts["running"]) / len(queue.jobs))
+        self.batch_summary.configure(text=queue.summary())
+        if not queue.running:
+            self.log_batch(f"Batch finished: {queue.summary()}")
+            self.cancel_batch_btn.configure(state="disabled")
 
     def compress_image(self):
         input_path = self.input_path.get()
@@ -290,30 +476,33 @@ class ImageCompressorGUI:
             messagebox.showerror("Error", "Please select input and output files")
             return
             
+        mode = self.mode_var.get()
+        try:
+            goal = self.get_goal() if mode == "compress" else None
+        except ValueError as e:
+            messagebox.showerror("Invalid Goal", str(e))
+            return
+
+        # Tk variables are read here; the worker only gets plain values
+        future = self.worker.submit(process_image, input_path, output_path, mode, self.quality_var.get(), goal,
+                                    self.effort_menu.get())
+        self.compress_btn.configure(state="disabled")
+        self.status_var.set(f"Working on {os.path.basename(input_path)}...")
+        self.root.after(POLL_INTERVAL, self.finish_image, future, output_path)
+
+    def finish_image(self, future, output_path):
+        if not future.done():
+            self.root.after(POLL_INTERVAL, self.finish_image, future, output_path)
+            return
+        self.compress_btn.configure(state="normal")
         try:
-            if self.mode_var.get() == "compress":
-                # Open the PNG image
-                with Image.open(input_path) as img:
-                    # Convert to RGB if necessary
-                    if img.mode in ('RGBA', 'P'):
-                        img = img.convert('RGB')
-                    # Save as JPEG with specified quality
-                    img.save(output_path, 'JPEG', quality=self.quality_var.get())
-                self.status_var.set(f"Image compressed successfully!\nSaved to: {output_path}")
-                # Update preview with compressed image
-                self.update_preview(output_path)
-            else:
-                # Open the JPEG image
-                with Image.open(input_path) as img:
-                    # Save as PNG
-                    img.save(output_path, 'PNG')
-                self.status_var.set(f"Image decompressed successfully!\nSaved to: {output_path}")
-                # Update preview with decompressed image
-                self.update_preview(output_path)
-                
+            self.status_var.set(future.result())
         except Exception as e:
             messagebox.showerror("Error", f"Error processing image: {str(e)}")
             self.status_var.set("Error processing image")
+            return
+        # Show the output in the preview
+        self.update_preview(output_path)
 
 if __name__ == "__main__":
     root = TkinterDnD.Tk()
@@ -0,0 +1,285 @@
+"""Lossless PNG optimization.
+
+The image is decoded once, reduced to the smallest exact representation
+(alpha dropped when opaque, greyscale when every pixel is grey, a palette
+of 1 to 8 bits when there are at most 256 colours), then filtered and
+deflated in several ways on a thread pool, all in memory. zlib releases
+the GIL, so the candidates really do run in parallel. The smallest PNG
+wins, and the original file is kept when nothing beats it.
+
+Only colour management chunks (sRGB, gAMA, cHRM, iCCP) are carried over;
+text, EXIF, time and other metadata are stripped.
+"""
+
+import io
+import os
+import struct
+import time
+import zlib
+
+from PIL import Image
+
+from png_strips import PNG_SIGNATURE, write_chunk
+
+# Filters tried for each representation, and zlib strategies for each filter
+EFFORTS = {
+    "fast": (("adaptive",), (zlib.Z_DEFAULT_STRATEGY,)),
+    "normal": (("none", "paeth", "adaptive"), (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED, zlib.Z_RLE)),
+    "max": (("none", "sub", "up", "average", "paeth", "adaptive"),
+            (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED, zlib.Z_RLE, zlib.Z_HUFFMAN_ONLY)),
+}
+
+FILTER_TYPES = {"none": 0, "sub": 1, "up": 2, "average": 3, "paeth": 4}
+
+STRATEGY_NAMES = {zlib.Z_DEFAULT_STRATEGY: "default", zlib.Z_FILTERED: "filtered", zlib.Z_RLE: "rle",
+                  zlib.Z_HUFFMAN_ONLY: "huffman"}
+
+# PNG colour type and bytes per pixel of 8-bit truecolour and greyscale images
+COLOR_TYPES = {"L": (0, 1), "RGB": (2, 3), "LA": (4, 2), "RGBA": (6, 4)}
+
+# Bytes of rows filtered at a time; every filter needs a few int16 copies of them
+FILTER_STRIP_BYTES = 1 << 18
+
+
+def _pixels(img):
+    """The image as a (height, width, bands) uint8 array in L, LA, RGB or RGBA"""
+    import numpy
+
+    if img.mode in ("I", "I;16", "I;16B", "F"):
+        raise ValueError("16-bit PNGs cannot be optimized without losing precision")
+    if img.mode == "P" or "transparency" in img.info:
+        img = img.convert("RGBA")
+    elif img.mode not in COLOR_TYPES:
+        img = img.convert("RGB" if img.mode in ("CMYK", "YCbCr") else "L")
+    pixels = numpy.asarray(img)
+    return pixels.reshape(pixels.shape[0], pixels.shape[1], -1)
+
+
+def _reduce(pixels, grey=True):
+    """Drop channels that carry no information: opaque alpha and, with ``grey``, equal RGB"""
+    if pixels.shape[2] in (2, 4) and (pixels[..., -1] == 255).all():
+        pixels = pixels[..., :-1]
+    if grey and pixels.shape[2] >= 3 and (pixels[..., 0] == pixels[..., 1]).all() and \
+            (pixels[..., 1] == pixels[..., 2]).all():
+        pixels = pixels[..., [0] + ([3] if pixels.shape[2] == 4 else [])]
+    return pixels
+
+
+def _palette(pixels):
+    """(indices, palette rows, bit depth) for at most 256 colours, or None"""
+    import numpy
+
+    height, width, bands = pixels.shape
+    if height * width == 0:
+        return None
+    flat = pixels.reshape(-1, bands)
+    # Pack each colour into one integer so numpy.unique works on a flat array
+    keys = numpy.zeros(len(flat), dtype=numpy.uint32)
+    for band in range(bands):
+        keys = (keys << 8) | flat[:, band]
+    colors, indices = numpy.unique(keys, return_inverse=True)
+    if len(colors) > 256:
+        return None
+    palette = numpy.stack([(colors >> (8 * (bands - 1 - band))) & 0xFF for band in range(bands)], axis=1)
+    if bands == 2 or bands == 4:
+        # Transparent colours first, so tRNS can stop at the last of them
+        order = numpy.argsort(palette[:, -1] == 255, kind="stable")
+        palette = palette[order]
+        indices = numpy.argsort(order)[indices]
+    depth = next(bits for bits in (1, 2, 4, 8) if len(colors) <= 1 << bits)
+    return indices.reshape(height, width).astype(numpy.uint8), palette.astype(numpy.uint8), depth
+
+
+def _pack(indices, depth):
+    """Pack palette indices into rows of ``depth`` bits per pixel"""
+    import numpy
+
+    if depth == 8:
+        return indices
+    per_byte = 8 // depth
+    height, width = indices.shape
+    padded = numpy.zeros((height, -(-width // per_byte) * per_byte), dtype=numpy.uint8)
+    padded[:, :width] = indices
+    groups = padded.reshape(height, -1, per_byte)
+    packed = numpy.zeros(groups.shape[:2], dtype=numpy.uint8)
+    for i in range(per_byte):
+        packed |= groups[:, :, i] << (8 - depth * (i + 1))
+    return packed
+
+
+def filter_rows(rows, bpp, kind):
+    """PNG-filter a (height, row bytes) uint8 array; returns the filtered data with type bytes.
+
+    "adaptive" picks a filter per row with the usual minimum sum of
+    absolute differences heuristic. Rows are filtered FILTER_STRIP_BYTES at
+    a time, so the working memory is that of a strip, not of the image.
+    """
+    height, row_size = rows.shape
+    out = bytearray(height * (row_size + 1))
+    step = max(FILTER_STRIP_BYTES // max(row_size, 1), 1)
+    for top in range(0, height, step):
+        strip = _filter_strip(rows[top:top + step], rows[top - 1] if top else None, bpp, kind)
+        out[top * (row_size + 1):(top + len(strip)) * (row_size + 1)] = strip.tobytes()
+    return out
+
+
+def _filter_strip(rows, previous, bpp, kind):
+    """filter_rows for a strip of rows below ``previous``, the row above it (None at the top)"""
+    import numpy
+
+    rows = rows.astype(numpy.int16)
+    left = numpy.zeros_like(rows)
+    left[:, bpp:] = rows[:, :-bpp]
+    up = numpy.zeros_like(rows)
+    up[1:] = rows[:-1]
+    if previous is not None:
+        up[0] = previous
+    up_left = numpy.zeros_like(rows)
+    up_left[:, bpp:] = up[:, :-bpp]
+
+    def paeth():
+        estimate = left + up - up_left
+        distance_left = numpy.abs(estimate - left)
+        distance_up = numpy.abs(estimate - up)
+        distance_up_left = numpy.abs(estimate - up_left)
+        return numpy.where((distance_left <= distance_up) & (distance_left <= distance_up_left), left,
+                           numpy.where(distance_up <= distance_up_left, up, up_left))
+
+    predictors = {"none": lambda: 0, "sub": lambda: left, "up": lambda: up,
+                  "average": lambda: (left + up) >> 1, "paeth": paeth}
+    kinds = list(FILTER_TYPES) if kind == "adaptive" else [kind]
+    filtered = numpy.stack([(rows - predictors[name]()) & 0xFF for name in kinds]).astype(numpy.uint8)
+    if kind == "adaptive":
+        # Bytes read as signed, so small negative differences count as small
+        cost = numpy.abs(filtered.view(numpy.int8).astype(numpy.int32)).sum(axis=2)
+        choice = cost.argmin(axis=0)
+        filtered = filtered[choice, numpy.arange(len(rows))]
+        types = numpy.array([FILTER_TYPES[name] for name in kinds], dtype=numpy.uint8)[choice]
+    else:
+        filtered = filtered[0]
+        types = numpy.full(len(rows), FILTER_TYPES[kind], dtype=numpy.uint8)
+    return numpy.concatenate([types[:, None], filtered], axis=1)
+
+
+def _representations(img):
+    """Yield (name, header chunks, rows, bytes per pixel) for each exact encoding of ``img``.
+
+    An ICC profile is for either greyscale or colour types, so with an RGB
+    profile grey images stay RGB, and with a grey one no palette is tried.
+    """
+    color_space = img.info["icc_profile"][16:20] if img.info.get("icc_profile") else None
+    pixels = _reduce(_pixels(img), grey=color_space != b"RGB ")
+    height, width, bands = pixels.shape
+    mode = {1: "L", 2: "LA", 3: "RGB", 4: "RGBA"}[bands]
+    color_type, bpp = COLOR_TYPES[mode]
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)
+    yield mode, [(b"IHDR", ihdr)], pixels.reshape(height, width * bands), bpp
+
+    palette = _palette(pixels) if color_space != b"GRAY" else None
+    if palette is None:
+        return
+    indices, colors, depth = palette
+    if colors.shape[1] <= 2:
+        # Greyscale palettes expand to RGB triples
+        colors = colors[:, [0, 0, 0] + ([1] if colors.shape[1] == 2 else [])]
+    chunks = [(b"IHDR", struct.pack(">IIBBBBB", width, height, depth, 3, 0, 0, 0)),
+              (b"PLTE", colors[:, :3].tobytes())]
+    if colors.shape[1] == 4:
+        transparent = int((colors[:, 3] != 255).sum())
+        if transparent:
+            chunks.append((b"tRNS", colors[:transparent, 3].tobytes()))
+    yield f"palette {depth}-bit", chunks, _pack(indices, depth), 1
+
+
+def _color_chunks(img):
+    """Colour management chunks rebuilt from what Pillow decoded"""
+    info = img.info
+    chunks = []
+    if info.get("icc_profile"):
+        chunks.append((b"iCCP", b"ICC Profile\0\0" + zlib.compress(info["icc_profile"])))
+    elif "srgb" in info:
+        chunks.append((b"sRGB", bytes([info["srgb"]])))
+    if "gamma" in info:
+        chunks.append((b"gAMA", struct.pack(">I", round(info["gamma"] * 100000))))
+    if "chromaticity" in info:
+        chunks.append((b"cHRM", struct.pack(">8I", *(round(value * 100000) for value in info["chromaticity"]))))
+    return chunks
+
+
+def _deflate(data, strategy):
+    deflate = zlib.compressobj(9, zlib.DEFLATED, 15, 9, strategy)
+    return deflate.compress(data) + deflate.flush()
+
+
+def _assemble(chunks, idat):
+    out = io.BytesIO()
+    out.write(PNG_SIGNATURE)
+    for chunk_type, data in chunks:
+        write_chunk(out, chunk_type, data)
+    write_chunk(out, b"IDAT", idat)
+    write_chunk(out, b"IEND")
+    return out.getvalue()
+
+
+def optimize_png(input_path, effort="normal", workers=None):
+    """Find the smallest lossless PNG for an image; returns (PNG bytes, report).
+
+    ``effort`` picks how many filters and zlib strategies are tried, see
+    EFFORTS. ``workers`` threads deflate the candidates, by default one per
+    CPU. Candidates are filtered as threads free up and only the smallest
+    PNG so far is kept, so memory does not grow with the effort. The report
+    has the input and output sizes, seconds, the number of candidates tried
+    and a description of the winner ("original" when the input could not be
+    beaten).
+    """
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+    filters, strategies = EFFORTS[effort]
+    start_time = time.perf_counter()
+    with open(input_path, "rb") as f:
+        original = f.read()
+    # Signature, then IHDR: length, type and 13 bytes of data
+    if original[:8] != PNG_SIGNATURE or original[12:16] != b"IHDR" or len(original) < 33:
+        raise ValueError("not a PNG file")
+    # Pillow decodes 16-bit colour to 8 bits, which would not be lossless
+    if original[24] == 16:
+        raise ValueError("16-bit PNGs cannot be optimized without losing precision")
+    with Image.open(io.BytesIO(original)) as img:
+        img.load()
+        color_chunks = _color_chunks(img)
+        representations = list(_representations(img))
+
+    def candidates():
+        for name, chunks, rows, bpp in representations:
+            chunks = chunks[:1] + color_chunks + chunks[1:]
+            # A palette's neighbouring indices are unrelated, so filters rarely help
+            for kind in (("none",) if name.startswith("palette") and effort != "max" else filters):
+                # Filtered once here and shared by the strategies deflating it in parallel
+                data = filter_rows(rows, bpp, kind)
+                for strategy in strategies:
+                    yield data, strategy, chunks, f"{name}, {kind} filter, {STRATEGY_NAMES[strategy]} deflate"
+
+    workers = workers or os.cpu_count() or 1
+    best, best_name = original, "original"
+    tried = 0
+    pending = deque()
+
+    def finish_oldest():
+        nonlocal best, best_name
+        future, chunks, description = pending.popleft()
+        data = _assemble(chunks, future.result())
+        if len(data) < len(best):
+            best, best_name = data, description
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for data, strategy, chunks, description in candidates():
+            # At most two candidates per thread are in flight
+            if len(pending) >= 2 * workers:
+                finish_oldest()
+            pending.append((pool.submit(_deflate, data, strategy), chunks, description))
+            tried += 1
+        while pending:
+            finish_oldest()
+    return best, {"input_size": len(original), "output_size": len(best), "candidates": tried,
+                  "best": best_name, "seconds": time.perf_counter() - start_time}
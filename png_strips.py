@@ -0,0 +1,223 @@
+"""Decode a PNG a strip of rows at a time, to convert huge images in bounded memory.
+
+Pillow only decodes a PNG as a whole. Here the IDAT stream is inflated
+incrementally, and each strip's filtered rows are wrapped in a small PNG of
+their own for Pillow to unfilter. The strip's first row may be filtered
+against the row above it, so the reconstructed last row of the previous
+strip is put in front, unfiltered, and cropped off again after decoding.
+
+Only 8-bit, non-interlaced PNGs, which covers scans and screenshots, can
+be split this way; anything else raises UnsupportedPNG.
+"""
+
+import struct
+import zlib
+
+from PIL import Image
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Bytes per pixel of 8-bit images by PNG colour type: grey, RGB, palette, grey+alpha, RGBA
+BYTES_PER_PIXEL = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+# Chunks copied into each strip, for palettes and transparency
+STRIP_CHUNKS = (b"PLTE", b"tRNS")
+
+# Compressed bytes read from the file at a time
+READ_SIZE = 1 << 16
+
+# Bytes of working memory per pixel of a strip, measured with image_benchmark.py: the
+# inflated rows, the strip PNG built from them, its decode, the flattened strip and
+# allocator slack
+STRIP_BYTES_PER_PIXEL = 40
+
+
+class UnsupportedPNG(ValueError):
+    """The PNG cannot be decoded in strips."""
+
+
+def _read_chunk_header(f):
+    header = f.read(8)
+    if len(header) < 8:
+        raise ValueError("truncated PNG: no IEND chunk")
+    return struct.unpack(">I4s", header)
+
+
+def _check_crc(f, chunk_type, checksum):
+    """Read a chunk's CRC and compare it with ``checksum``, the CRC of its type and data"""
+    stored = f.read(4)
+    if len(stored) < 4:
+        raise ValueError("truncated PNG: no IEND chunk")
+    if struct.unpack(">I", stored)[0] != checksum:
+        raise ValueError(f"corrupt PNG: {chunk_type.decode('latin-1')} chunk checksum mismatch")
+
+
+def _chunks(f):
+    """Yield (type, data) for the chunks of a PNG, after the signature, checking their CRCs"""
+    while True:
+        length, chunk_type = _read_chunk_header(f)
+        if chunk_type == b"IDAT":
+            # Left unread, so the image data can be streamed
+            yield chunk_type, length
+            f.seek(length + 4, 1)
+            continue
+        data = f.read(length)
+        if len(data) < length:
+            raise ValueError("truncated PNG: no IEND chunk")
+        _check_crc(f, chunk_type, zlib.crc32(data, zlib.crc32(chunk_type)))
+        yield chunk_type, data
+        if chunk_type == b"IEND":
+            return
+
+
+def read_header(f):
+    """Read a PNG up to its first IDAT chunk; returns the header as a dict.
+
+    The file is left at the start of the image data. Raises UnsupportedPNG
+    for interlaced or non 8-bit images.
+    """
+    if f.read(8) != PNG_SIGNATURE:
+        raise ValueError("not a PNG file")
+    header = {"chunks": {}}
+    chunks = _chunks(f)
+    chunk_type, data = next(chunks)
+    if chunk_type != b"IHDR" or len(data) != 13:
+        raise ValueError("corrupt PNG: no IHDR chunk")
+    (header["width"], header["height"], header["bit_depth"], header["color_type"], _, _,
+     header["interlace"]) = struct.unpack(">IIBBBBB", data)
+    header["ihdr"] = data
+    for chunk_type, data in chunks:
+        if chunk_type in STRIP_CHUNKS:
+            header["chunks"][chunk_type] = data
+        elif chunk_type == b"IDAT":
+            # Back to the chunk header, for _IdatReader
+            f.seek(-8, 1)
+            break
+    else:
+        raise ValueError("PNG has no image data")
+    if header["bit_depth"] != 8 or header["interlace"] or header["color_type"] not in BYTES_PER_PIXEL:
+        raise UnsupportedPNG("only 8-bit, non-interlaced PNGs can be decoded in strips")
+    header["row_size"] = 1 + header["width"] * BYTES_PER_PIXEL[header["color_type"]]
+    return header
+
+
+class _IdatReader:
+    """Inflate the concatenated IDAT chunks on demand, checking their CRCs"""
+
+    def __init__(self, f):
+        self.f = f
+        self.remaining = 0
+        self.checksum = 0
+        self.done = False
+        self.inflate = zlib.decompressobj()
+
+    def _compressed(self):
+        while self.remaining == 0:
+            length, chunk_type = _read_chunk_header(self.f)
+            if chunk_type != b"IDAT":
+                # Back to the chunk header, for finish()
+                self.f.seek(-8, 1)
+                self.done = True
+                return b""
+            self.remaining = length
+            self.checksum = zlib.crc32(chunk_type)
+            if not length:
+                _check_crc(self.f, chunk_type, self.checksum)
+        data = self.f.read(min(self.remaining, READ_SIZE))
+        if not data:
+            raise ValueError("truncated PNG image data")
+        self.remaining -= len(data)
+        self.checksum = zlib.crc32(data, self.checksum)
+        if self.remaining == 0:
+            _check_crc(self.f, b"IDAT", self.checksum)
+        return data
+
+    def _inflate(self, size):
+        data = self.inflate.unconsumed_tail or (b"" if self.done else self._compressed())
+        if not data:
+            raise ValueError("truncated PNG image data")
+        try:
+            return self.inflate.decompress(data, size)
+        except zlib.error as e:
+            raise ValueError(f"corrupt PNG image data: {e}") from None
+
+    def read(self, size):
+        parts = []
+        have = 0
+        while have < size:
+            if self.inflate.eof:
+                raise ValueError("corrupt PNG: too little image data")
+            part = self._inflate(size - have)
+            parts.append(part)
+            have += len(part)
+        return b"".join(parts)
+
+    def finish(self):
+        """Check the rest of the image data and the chunks after it, up to IEND"""
+        while not self.inflate.eof:
+            # Output past the last row is ignored, as Pillow does
+            self._inflate(READ_SIZE)
+        while not self.done:
+            self._compressed()
+        for _ in _chunks(self.f):
+            pass
+
+
+def write_chunk(out, chunk_type, *parts):
+    """Write a PNG chunk whose data is the concatenation of ``parts``"""
+    out.write(struct.pack(">I4s", sum(map(len, parts)), chunk_type))
+    checksum = zlib.crc32(chunk_type)
+    for part in parts:
+        out.write(part)
+        checksum = zlib.crc32(part, checksum)
+    out.write(struct.pack(">I", checksum))
+
+
+def _strip_png(header, rows, *data):
+    """A PNG file in memory holding ``rows`` rows of filtered image data"""
+    import io
+
+    out = io.BytesIO()
+    out.write(PNG_SIGNATURE)
+    write_chunk(out, b"IHDR", struct.pack(">II", header["width"], rows), header["ihdr"][8:])
+    for chunk_type in STRIP_CHUNKS:
+        if chunk_type in header["chunks"]:
+            write_chunk(out, chunk_type, header["chunks"][chunk_type])
+    # Stored rather than deflated: the strip is decoded straight away
+    deflate = zlib.compressobj(0)
+    write_chunk(out, b"IDAT", *[deflate.compress(part) for part in data], deflate.flush())
+    write_chunk(out, b"IEND")
+    out.seek(0)
+    return out
+
+
+def iter_strips(f, rows):
+    """Yield (top row, Image) for strips of up to ``rows`` new rows of the PNG in ``f``.
+
+    Every strip is an independent image in the mode Pillow would have
+    decoded the whole PNG to, with its palette and transparency. Strips
+    after the first start with the last row of the one before, which
+    saves cropping it off; its pixels are the same, so pasting the strips
+    in order overwrites that row with itself. Raises ValueError for a
+    truncated file or a chunk that fails its CRC, possibly after yielding
+    the strips before the damage.
+    """
+    header = read_header(f)
+    reader = _IdatReader(f)
+    width, height, row_size = header["width"], header["height"], header["row_size"]
+    previous = None
+    top = 0
+    while top < height:
+        count = min(rows, height - top)
+        if previous is None:
+            strip = Image.open(_strip_png(header, count, reader.read(count * row_size)))
+        else:
+            # Filter type 0 (None): the row is stored as is
+            strip = Image.open(_strip_png(header, count + 1, b"\0", previous, reader.read(count * row_size)))
+            top -= 1
+        strip.load()
+        # Raw bytes of the last row, which 8-bit images store exactly as Pillow does
+        previous = strip.crop((0, strip.height - 1, width, strip.height)).tobytes()
+        yield top, strip
+        top += strip.height
+    reader.finish()
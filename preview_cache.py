@@ -0,0 +1,149 @@
+"""Image previews for png_compressor_gui.py, decoded off the Tk thread.
+
+Thumbnails are decoded at reduced size where the format allows it, kept as
+PhotoImages in a small in-memory LRU, and saved to a disk cache so that
+revisiting an image, even in a later session, does not decode it again.
+Entries are keyed by (path, mtime, size, preview size), so a file that
+changes on disk gets a fresh thumbnail.
+"""
+
+import hashlib
+import os
+from collections import OrderedDict
+
+from PIL import Image
+
+from atomic_write import replacing
+
+# Bounding box of the previews shown by the GUI
+PREVIEW_SIZE = (300, 300)
+
+# PhotoImages kept in memory
+MEMORY_CAPACITY = 64
+
+# Thumbnails kept on disk; the least recently used are removed beyond this
+DISK_CAPACITY = 2000
+
+# How often a pending preview is checked for, in milliseconds
+POLL_INTERVAL = 30
+
+
+def cache_directory():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "file-compression", "thumbnails")
+
+
+def preview_key(path, size=PREVIEW_SIZE):
+    status = os.stat(path)
+    return os.path.abspath(path), status.st_mtime_ns, status.st_size, size[0], size[1]
+
+
+def load_thumbnail(path, size=PREVIEW_SIZE):
+    """Decode ``path`` scaled down to fit ``size``, without a full-size decode where possible.
+
+    JPEG is decoded straight at 1/2, 1/4 or 1/8 scale by draft(). Other
+    formats, PNG included, must be decoded in full, but reducing_gap lets
+    thumbnail() shrink them with a cheap reduce() before the final filter.
+    """
+    with Image.open(path) as img:
+        if img.format == "JPEG":
+            img.draft("RGB", size)
+        img.thumbnail(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info or img.mode in ("LA", "PA") else "RGB")
+        img.load()
+        return img
+
+
+def cached_thumbnail(path, key, size=PREVIEW_SIZE, directory=None):
+    """load_thumbnail through the disk cache; cache errors only cost a decode"""
+    directory = directory or cache_directory()
+    cache_path = os.path.join(directory, hashlib.sha1(repr(key).encode()).hexdigest() + ".png")
+    try:
+        with Image.open(cache_path) as img:
+            img.load()
+        # Touched so pruning keeps recently used thumbnails
+        os.utime(cache_path)
+        return img
+    except (OSError, ValueError):
+        pass
+    img = load_thumbnail(path, size)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with replacing(cache_path) as temporary:
+            img.save(temporary, "PNG")
+    except OSError:
+        pass
+    return img
+
+
+def prune_disk_cache(directory=None, capacity=DISK_CAPACITY):
+    """Remove the least recently used thumbnails beyond ``capacity``"""
+    directory = directory or cache_directory()
+    try:
+        entries = [entry for entry in os.scandir(directory) if entry.name.endswith(".png")]
+    except OSError:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries[capacity:]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+class PreviewCache:
+    """Deliver PhotoImage previews to the Tk thread without blocking it.
+
+    Thumbnails are decoded on a thread pool; PhotoImages are only created on
+    the Tk thread, which polls for finished decodes with root.after. When
+    several previews are requested in a row only the latest is delivered,
+    the others are still cached.
+    """
+
+    def __init__(self, root, size=PREVIEW_SIZE, capacity=MEMORY_CAPACITY, directory=None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.root = root
+        self.size = size
+        self.capacity = capacity
+        self.directory = directory or cache_directory()
+        self.memory = OrderedDict()
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.latest = 0
+        self.executor.submit(prune_disk_cache, self.directory)
+
+    def request(self, path, callback):
+        """Call ``callback(photo, error)`` on the Tk thread with the preview of ``path``"""
+        self.latest += 1
+        request_id = self.latest
+        try:
+            key = preview_key(path, self.size)
+        except OSError as e:
+            callback(None, str(e))
+            return
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            callback(self.memory[key], None)
+            return
+        future = self.executor.submit(cached_thumbnail, path, key, self.size, self.directory)
+        self.root.after(POLL_INTERVAL, self._poll, future, key, request_id, callback)
+
+    def _poll(self, future, key, request_id, callback):
+        if not future.done():
+            self.root.after(POLL_INTERVAL, self._poll, future, key, request_id, callback)
+            return
+        try:
+            img = future.result()
+        except Exception as e:
+            if request_id == self.latest:
+                callback(None, str(e))
+            return
+        from PIL import ImageTk
+
+        photo = ImageTk.PhotoImage(img)
+        self.memory[key] = photo
+        if len(self.memory) > self.capacity:
+            self.memory.popitem(last=False)
+        if request_id == self.latest:
+            callback(photo, None)
@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+from atomic_write import open_output
+
+
+def test_error_keeps_the_old_file(tmp_path):
+    path = tmp_path / "out.bin"
+    path.write_bytes(b"old")
+    with pytest.raises(RuntimeError):
+        with open_output(str(path)) as f:
+            f.write(b"new")
+            raise RuntimeError
+    assert path.read_bytes() == b"old"
+    assert os.listdir(tmp_path) == ["out.bin"]
+
+
+def test_hard_link_is_not_written_through(tmp_path):
+    path = tmp_path / "out.txt"
+    path.write_text("old")
+    os.link(path, tmp_path / "linked.txt")
+    with open_output(str(path), "w", encoding="utf-8") as f:
+        f.write("new")
+    assert path.read_text() == "new"
+    assert (tmp_path / "linked.txt").read_text() == "old"
+
+
+def test_symlink_target_is_replaced(tmp_path):
+    (tmp_path / "real.bin").write_bytes(b"old")
+    os.symlink("real.bin", tmp_path / "link.bin")
+    with open_output(str(tmp_path / "link.bin")) as f:
+        f.write(b"new")
+    assert os.path.islink(tmp_path / "link.bin")
+    assert (tmp_path / "real.bin").read_bytes() == b"new"
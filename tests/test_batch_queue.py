@@ -0,0 +1,37 @@
+import tkinter
+
+import pytest
+
+from batch_queue import expand_paths, split_drop
+
+
+class Widget:
+    # split_drop only needs the widget's Tcl interpreter, which works without a display
+    tk = tkinter.Tcl()
+
+
+@pytest.mark.parametrize("paths", [
+    ["/photos/a.png"],
+    ["/photos/a.png", "/photos/b.png"],
+    ["/my photos/a b.png", "/photos/c.png"],
+    ["/photos/{braced}.png", "/photos/open{.png", "/photos/close}.png", "/a b/{c d}.png"],
+    ["C:\\Users\\me\\My Pictures\\x.png"],
+])
+def test_split_drop(paths):
+    # Quoted by Tcl the way tkinterdnd2 hands drops over
+    assert split_drop(Widget(), Widget.tk.call("list", *paths)) == paths
+
+
+def test_split_drop_of_a_braced_payload():
+    assert split_drop(Widget(), "{/my photos/a.png} /photos/b.png") == ["/my photos/a.png", "/photos/b.png"]
+
+
+def test_expand_paths_walks_folders_in_order(tmp_path):
+    for name in ["b.png", "a.txt", "sub dir/c.png", "sub dir/deeper/{d}.png", "a/e.png"]:
+        path = tmp_path / "in" / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"")
+    single = tmp_path / "single.txt"
+    found = list(expand_paths([str(single), str(tmp_path / "in")], accept=lambda path: path.endswith(".png")))
+    assert [path[len(str(tmp_path)) + 1:] for path in found] == [
+        "single.txt", "in/b.png", "in/a/e.png", "in/sub dir/c.png", "in/sub dir/deeper/{d}.png"]
@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+import compression_cache
+import huffman
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "input.txt"
+    path.write_bytes(b"the same input, compressed again every night\n" * 200)
+    return str(path)
+
+
+def compress_through(cache, source, target, **options):
+    return cache.run(source, target, options, lambda: huffman.compress_file(source, target, verbose=False, **options))
+
+
+def test_hit_copies_the_stored_output(tmp_path, source):
+    cache = compression_cache.CompressionCache(str(tmp_path / "cache"))
+    first, second = str(tmp_path / "first.huf"), str(tmp_path / "second.huf")
+    assert compress_through(cache, source, first) == (None, False)
+    assert compress_through(cache, source, second) == (None, True)
+    assert open(first, "rb").read() == open(second, "rb").read()
+    stats = cache.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"]) == (1, 1, 1)
+
+
+def test_rewriting_a_linked_output_keeps_the_cache_intact(tmp_path, source):
+    cache = compression_cache.CompressionCache(str(tmp_path / "cache"), link=True)
+    first, linked = str(tmp_path / "first.huf"), str(tmp_path / "linked.huf")
+    compress_through(cache, source, first)
+    expected = open(first, "rb").read()
+    assert compress_through(cache, source, linked)[1]
+    assert os.stat(linked).st_nlink == 2
+
+    # Compressing something else over the linked output must not reach the cache object
+    other = tmp_path / "other.txt"
+    other.write_bytes(b"different content")
+    huffman.compress_file(str(other), linked, verbose=False)
+    third = str(tmp_path / "third.huf")
+    assert compress_through(cache, source, third)[1]
+    assert open(third, "rb").read() == expected
+
+
+def test_object_changed_in_place_is_a_miss(tmp_path, source):
+    cache = compression_cache.CompressionCache(str(tmp_path / "cache"), link=True)
+    compress_through(cache, source, str(tmp_path / "first.huf"))
+    linked = str(tmp_path / "linked.huf")
+    compress_through(cache, source, linked)
+    with open(linked, "r+b") as f:
+        f.seek(10)
+        f.write(b"\xff")
+    target = str(tmp_path / "again.huf")
+    assert compress_through(cache, source, target) == (None, False)
+    huffman.verify_file(target, full=True)
+
+
+def test_least_recently_used_outputs_are_evicted(tmp_path):
+    cache = compression_cache.CompressionCache(str(tmp_path / "cache"), max_bytes=2500)
+    for number in range(4):
+        path = tmp_path / f"input{number}"
+        path.write_bytes(os.urandom(1000))
+        compress_through(cache, str(path), str(path) + ".huf")
+    stats = cache.stats()
+    assert stats["bytes"] <= 2500 and stats["evictions"] == 2
+    assert sum(len(files) for _, _, files in os.walk(tmp_path / "cache" / "objects")) == 2
+
+
+@pytest.mark.parametrize("keep", [0, 50, 4096])
+def test_damaged_index_starts_afresh(tmp_path, source, keep):
+    directory = str(tmp_path / "cache")
+    cache = compression_cache.CompressionCache(directory)
+    compress_through(cache, source, str(tmp_path / "first.huf"))
+    cache.close()
+    index = os.path.join(directory, "index.sqlite3")
+    data = open(index, "rb").read()
+    with open(index, "wb") as f:
+        f.write(data[:keep] + b"\x00garbage" * 8)
+
+    cache = compression_cache.CompressionCache(directory)
+    target = str(tmp_path / "second.huf")
+    assert compress_through(cache, source, target) == (None, False)
+    assert compress_through(cache, source, str(tmp_path / "third.huf")) == (None, True)
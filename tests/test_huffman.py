@@ -0,0 +1,325 @@
+import collections
+import errno
+import io
+import os
+import random
+
+import pytest
+
+import huffman
+
+TEXT = "abracadabra, éé abracadabra! " * 200 + "漢字"
+DATA = bytes(random.Random(1).choices(b"aaaabbbcdefg\n", k=20000))
+
+
+def compress(data, **options):
+    out = io.BytesIO()
+    source = io.StringIO(data) if isinstance(data, str) else io.BytesIO(data)
+    huffman.compress_file(source, out, mode="text" if isinstance(data, str) else "bytes", verbose=False, **options)
+    return out.getvalue()
+
+
+def decompress(blob, text=False):
+    out = io.StringIO() if text else io.BytesIO()
+    huffman.decompress_file(io.BytesIO(blob), out, verbose=False)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize("data, options", [
+    (DATA, {}),
+    (DATA, {"block_size": 3000}),
+    (DATA, {"adaptive": True}),
+    (random.Random(2).randbytes(5000), {}),
+    (TEXT, {}),
+    (TEXT, {"block_size": 1000}),
+    (b"", {}),
+    (b"x", {}),
+    ("", {}),
+])
+def test_round_trip(data, options):
+    blob = compress(data, **options)
+    assert blob[len(huffman.MAGIC)] == huffman.FORMAT_VERSION
+    assert decompress(blob, isinstance(data, str)) == data
+    assert huffman.verify_file(io.BytesIO(blob))["symbols"] == len(data)
+    for start, length in [(0, 10), (2990, 20), (len(data) - 3, 10)]:
+        start = max(start, 0)
+        assert huffman.read_range(io.BytesIO(blob), start, length) == data[start:start + length]
+
+
+def test_fixed_overhead_is_small():
+    assert len(compress(b"")) <= 24
+    assert len(compress(b"x")) <= 40
+
+
+@pytest.mark.parametrize("options", [{}, {"block_size": 500}, {"adaptive": True}])
+def test_truncated_files_are_rejected(options):
+    blob = compress(DATA[:1500], **options)
+    for size in range(len(blob)):
+        with pytest.raises(ValueError):
+            decompress(blob[:size])
+
+
+@pytest.mark.parametrize("options", [{}, {"block_size": 500}, {"adaptive": True}])
+def test_flipped_bits_never_decode_to_wrong_data(options):
+    data = DATA[:1500]
+    blob = compress(data, **options)
+    for bit in range(len(blob) * 8):
+        damaged = bytearray(blob)
+        damaged[bit // 8] ^= 1 << bit % 8
+        try:
+            assert decompress(bytes(damaged)) == data
+        except ValueError:
+            pass
+
+
+def test_damaged_index_is_rejected():
+    # One block with a checkpoint inside it, so the last index entry is not
+    # at a block start
+    data = bytes(random.Random(3).choices(b"abcdefgh", k=huffman.CHECKPOINT_INTERVAL + 1000))
+    blob = compress(data)
+    trailer_offset = huffman._read_trailer(io.BytesIO(blob))[4]
+    symbol_offset = huffman._read_index(io.BytesIO(blob))[0][-1][2]
+    # Add one to the last entry's symbol offset, the last varint of the index
+    damaged = bytearray(blob)
+    damaged[trailer_offset - len(huffman._pack_varints(symbol_offset))] ^= 1
+    with pytest.raises(ValueError, match="block index"):
+        huffman.verify_file(io.BytesIO(bytes(damaged)))
+    with pytest.raises(ValueError, match="block index"):
+        huffman.read_range(io.BytesIO(bytes(damaged)), len(data) - 10, 10)
+    with pytest.raises(ValueError, match="block index"):
+        decompress(bytes(damaged))
+
+
+def test_flipped_bits_after_the_header_fail_verify():
+    blob = compress(DATA[:1500], block_size=500)
+    for bit in range(8 * (len(huffman.MAGIC) + 3), len(blob) * 8):
+        damaged = bytearray(blob)
+        damaged[bit // 8] ^= 1 << bit % 8
+        with pytest.raises(ValueError):
+            huffman.verify_file(io.BytesIO(bytes(damaged)))
+
+
+@pytest.mark.parametrize("options", [{}, {"block_size": 7000}])
+def test_read_range_starts_at_checkpoints(monkeypatch, options):
+    monkeypatch.setattr(huffman, "CHECKPOINT_INTERVAL", 1000)
+    blob = compress(DATA, **options)
+    entries, symbol_count = huffman._read_index(io.BytesIO(blob))
+    assert symbol_count == len(DATA)
+    assert [entry[2] for entry in entries] == list(range(0, len(DATA), 1000))
+    assert any(entry[1] % 8 for entry in entries)
+    for start in range(0, len(DATA), 997):
+        assert huffman.read_range(io.BytesIO(blob), start, 1500) == DATA[start:start + 1500]
+
+
+def test_workers_do_not_change_the_output(monkeypatch):
+    blob = compress(DATA, block_size=2000)
+    assert compress(DATA, block_size=2000, workers=2) == blob
+    # Pretend there are CPUs to spare so the blocks really go to a pool
+    monkeypatch.setattr(huffman.os, "cpu_count", lambda: 4)
+    assert huffman._block_workers(2, None) == 2
+    assert compress(DATA, block_size=2000, workers=2) == blob
+    out = io.BytesIO()
+    huffman.decompress_file(io.BytesIO(blob), out, workers=2)
+    assert out.getvalue() == DATA
+
+
+def test_block_workers(monkeypatch):
+    monkeypatch.setattr(huffman.os, "cpu_count", lambda: 2)
+    assert huffman._block_workers(8, None) == 2
+    assert huffman._block_workers(8, huffman.MIN_PARALLEL_BLOCKS - 1) == 1
+    assert huffman._block_workers(8, huffman.MIN_PARALLEL_BLOCKS) == 2
+
+
+def test_command_line_round_trip(tmp_path, capsys):
+    source = tmp_path / "in.bin"
+    source.write_bytes(DATA)
+    assert huffman.main(["compress", str(source)]) == 0
+    source.rename(tmp_path / "original.bin")
+    assert huffman.main(["decompress", str(tmp_path / "in.bin.huf")]) == 0
+    assert source.read_bytes() == DATA
+    # Both summaries give the compressed size as a share of the original
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 2
+    assert lines[0].split("(")[1].split(")")[0] == lines[1].split("(")[1].split(")")[0]
+    assert huffman.main(["compress", str(tmp_path / "missing")]) == 1
+
+
+class Pipe(io.BytesIO):
+    def seekable(self):
+        return False
+
+
+@pytest.mark.parametrize("source, mode", [
+    (io.StringIO(TEXT), "text"),
+    (io.BytesIO(TEXT.encode()), "text"),
+    (Pipe(TEXT.encode()), "text"),
+    (Pipe(TEXT.encode()), "bytes"),
+])
+def test_file_objects_round_trip(source, mode):
+    compressed = io.BytesIO()
+    huffman.compress_file(source, compressed, mode=mode)
+    out = io.BytesIO()
+    huffman.decompress_file(Pipe(compressed.getvalue()), out)
+    assert out.getvalue() == TEXT.encode()
+    # Caller-owned objects are left open
+    assert not source.closed and not compressed.closed and not out.closed
+
+
+def write_codes_file(path, text, codes):
+    # The .codes format: a padding count byte, the bits padded to whole bytes, and a sidecar of codes
+    bits = "".join(codes[char] for char in text)
+    padding = 8 - len(bits) % 8
+    bits = f"{padding:08b}" + bits + "0" * padding
+    path.write_bytes(bytes(int(bits[i:i + 8], 2) for i in range(0, len(bits), 8)))
+    with open(f"{path}.codes", "w", encoding="utf-8") as f:
+        for char, code in codes.items():
+            f.write(f"{char.encode('utf-8').hex()}\t{code}\n")
+
+
+def decode_both(path, tmp_path):
+    huffman.decompress_file(str(path), str(tmp_path / "fast"))
+    huffman.decompress_file_reference(str(path), str(tmp_path / "reference"))
+    return (tmp_path / "fast").read_bytes(), (tmp_path / "reference").read_bytes()
+
+
+@pytest.mark.parametrize("data, options", [
+    (random.Random(4).randbytes(3000), {}),
+    (DATA, {"block_size": 3000}),
+    (DATA, {"adaptive": True}),
+    (b"a" * 500, {}),
+    (b"", {}),
+    (TEXT, {}),
+    ("é" * 300, {}),
+    ("crlf\r\nand cr\r line ends\n" * 50, {}),
+    ("", {}),
+])
+def test_matches_the_reference_decoder(tmp_path, data, options):
+    text = isinstance(data, str)
+    source = tmp_path / "in"
+    source.write_bytes(data.encode() if text else data)
+    huffman.compress_file(str(source), str(tmp_path / "in.huf"), mode="text" if text else "bytes", **options)
+    assert decode_both(tmp_path / "in.huf", tmp_path) == (source.read_bytes(),) * 2
+
+
+def test_matches_the_reference_decoder_on_codes_files(tmp_path):
+    source = tmp_path / "in.txt"
+    source.write_bytes(TEXT.encode())
+    huffman.compress_file_reference(str(source), str(tmp_path / "old"))
+    assert decode_both(tmp_path / "old", tmp_path) == (source.read_bytes(),) * 2
+
+
+@pytest.mark.parametrize("text, codes", [
+    ("a" * 500, {"a": "0"}),
+    ("é" * 64, {"é": "1"}),
+    ("", {"a": "0", "b": "1"}),
+    ("abcd" * 300, {"a": "0", "b": "10", "c": "110", "d": "111"}),
+    # Codes longer than the lookup table
+    ("xy" * 40 + "z", {"x": "0", "y": "1" * 20 + "0", "z": "1" * 21}),
+])
+def test_matches_the_reference_decoder_on_edge_cases(tmp_path, text, codes):
+    write_codes_file(tmp_path / "in.huf", text, codes)
+    assert decode_both(tmp_path / "in.huf", tmp_path) == (text.encode(),) * 2
+
+
+def block_kinds(blob):
+    f = io.BytesIO(blob)
+    mode, _, stream = huffman._read_header(f)
+    kinds, previous = [], None
+    for _, lengths, payload_size, _ in huffman._read_blocks(f, mode, stream):
+        f.read(payload_size)
+        kinds.append("stored" if lengths is None else "repeat" if lengths is previous else "table")
+        previous = lengths or previous
+    return kinds
+
+
+@pytest.fixture
+def small_reads(monkeypatch):
+    # Every read of the adaptive encoder is a block, and a new table is considered every four of them
+    monkeypatch.setattr(huffman, "IO_CHUNK_SIZE", 1000)
+    monkeypatch.setattr(huffman, "ADAPTIVE_INTERVAL", 4000)
+
+
+def test_adaptive_steady_input_keeps_its_table(small_reads):
+    blob = compress(DATA, adaptive=True)
+    assert block_kinds(blob) == ["table"] + ["repeat"] * 19
+    assert decompress(blob) == DATA
+
+
+def test_adaptive_switches_tables_when_the_input_changes(small_reads):
+    data = DATA[:10000] + bytes(random.Random(7).choices(b"0123456789,;", k=10000))
+    blob = compress(data, adaptive=True)
+    kinds = block_kinds(blob)
+    assert kinds[0] == "table" and "table" in kinds[10:]
+    assert decompress(blob) == data
+    assert huffman.read_range(io.BytesIO(blob), 9990, 20) == data[9990:10010]
+
+
+def test_adaptive_stores_incompressible_reads_and_goes_on_with_its_table(small_reads):
+    data = DATA[:5000] + random.Random(8).randbytes(2000) + DATA[5000:10000]
+    blob = compress(data, adaptive=True)
+    assert block_kinds(blob) == ["table"] + ["repeat"] * 4 + ["stored"] * 2 + ["repeat"] * 5
+    assert decompress(blob) == data
+
+
+def test_worth_coding():
+    noise = random.Random(9).randbytes(4096)
+    assert not huffman._worth_coding(collections.Counter(noise), len(noise))
+    assert huffman._worth_coding(collections.Counter(DATA), len(DATA))
+
+
+def test_incompressible_blocks_are_stored():
+    noise = random.Random(10).randbytes(6000)
+    data = DATA[:3000] + noise + DATA[3000:6000]
+    blob = compress(data, block_size=3000)
+    assert block_kinds(blob) == ["table", "stored", "stored", "table"]
+    assert decompress(blob) == data
+    assert huffman.read_range(io.BytesIO(blob), 2990, 20) == data[2990:3010]
+    # A stored block costs a few bytes over its input
+    assert len(compress(noise)) <= len(noise) + 40
+
+
+def test_incompressible_text_is_stored():
+    text = "".join(chr(0x4e00 + number) for number in random.Random(11).sample(range(20000), 3000))
+    blob = compress(text)
+    assert block_kinds(blob) == ["stored"]
+    assert decompress(blob, text=True) == text
+
+
+def test_output_is_preallocated_and_trimmed(tmp_path, monkeypatch):
+    reserved = []
+
+    def fallocate(fileno, offset, size):
+        # Reserve more than asked, so the result shows the file is cut back to what was written
+        reserved.append(size)
+        real_fallocate(fileno, offset, size + 5000)
+
+    real_fallocate = os.posix_fallocate
+    monkeypatch.setattr(os, "posix_fallocate", fallocate)
+    (tmp_path / "in.huf").write_bytes(compress(DATA))
+    huffman.decompress_file(str(tmp_path / "in.huf"), str(tmp_path / "out"), verbose=False)
+    assert reserved == [len(DATA)]
+    assert (tmp_path / "out").read_bytes() == DATA
+
+
+def test_output_without_posix_fallocate(tmp_path, monkeypatch):
+    monkeypatch.delattr(os, "posix_fallocate", raising=False)
+    with open(tmp_path / "out", "wb") as f:
+        assert not huffman._preallocate(f, 100)
+    (tmp_path / "in.huf").write_bytes(compress(DATA))
+    huffman.decompress_file(str(tmp_path / "in.huf"), str(tmp_path / "out"), verbose=False)
+    assert (tmp_path / "out").read_bytes() == DATA
+
+
+@pytest.mark.parametrize("error, raised", [(errno.EOPNOTSUPP, False), (errno.EINVAL, False), (errno.ENOSPC, True)])
+def test_preallocate_errors(tmp_path, monkeypatch, error, raised):
+    def fallocate(fileno, offset, size):
+        raise OSError(error, os.strerror(error))
+
+    monkeypatch.setattr(os, "posix_fallocate", fallocate)
+    with open(tmp_path / "out", "wb") as f:
+        if raised:
+            with pytest.raises(OSError):
+                huffman._preallocate(f, 100)
+        else:
+            assert not huffman._preallocate(f, 100)
+    assert not huffman._preallocate(io.BytesIO(), 100)
@@ -0,0 +1,44 @@
+import os
+import random
+
+import huffman
+import huffman_GUI
+
+
+def run(job):
+    job.start()
+    job.thread.join()
+    events = []
+    while not job.events.empty():
+        events.append(job.events.get())
+    return events
+
+
+def test_cancelled_job_leaves_the_old_output(tmp_path):
+    source = tmp_path / "in.bin"
+    source.write_bytes(random.Random(1).randbytes(50000))
+    target = tmp_path / "in.bin.huf"
+    target.write_bytes(b"earlier output")
+    job = huffman_GUI.CompressionJob("compress", str(source), str(target))
+    job.cancel()
+    assert run(job) == [("cancelled",)]
+    assert target.read_bytes() == b"earlier output"
+    assert sorted(os.listdir(tmp_path)) == ["in.bin", "in.bin.huf"]
+
+
+def test_progress_is_monotonic(tmp_path, monkeypatch):
+    monkeypatch.setattr(huffman, "IO_CHUNK_SIZE", 4096)
+    source = tmp_path / "in.bin"
+    data = bytes(random.Random(2).choices(b"abcdefgh", k=100000))
+    source.write_bytes(data)
+    for action, input_path, output_path in [("compress", source, tmp_path / "in.huf"),
+                                            ("decompress", tmp_path / "in.huf", tmp_path / "out.bin")]:
+        events = run(huffman_GUI.CompressionJob(action, str(input_path), str(output_path)))
+        assert events[-1] == ("done",)
+        progress = [event[1:] for event in events[:-1]]
+        assert len(progress) > 2
+        done = [done for done, _ in progress]
+        assert done == sorted(done)
+        total = progress[0][1]
+        assert all(current_total == total for _, current_total in progress) and done[-1] <= total
+    assert (tmp_path / "out.bin").read_bytes() == data
@@ -0,0 +1,158 @@
+import os
+import random
+
+import pytest
+
+import huffman_archive
+
+FILES = {
+    "logs/app.log": b"GET /index.html 200\n" * 300,
+    "logs/old/app.log": b"POST /form 302\n" * 120,
+    "logs/notes.txt": "naïve café notes\n".encode() * 40,
+    "logs/blob.bin": random.Random(5).randbytes(3000),
+    "logs/empty.txt": b"",
+}
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for name, data in FILES.items():
+        path = tmp_path / "in" / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    os.chmod(tmp_path / "in" / "logs" / "app.log", 0o640)
+    os.utime(tmp_path / "in" / "logs" / "notes.txt", ns=(1_500_000_000_123_456_789,) * 2)
+    return tmp_path / "in" / "logs"
+
+
+def read_all(archive):
+    _, members = huffman_archive.read_directory(archive)
+    return {member["name"]: huffman_archive.read_member(archive, member["name"]) for member in members}
+
+
+@pytest.mark.parametrize("group_size, workers", [(huffman_archive.GROUP_SIZE, 1), (2000, 1), (2000, 3)])
+def test_round_trip(tree, tmp_path, group_size, workers):
+    archive = str(tmp_path / "logs.hufa")
+    report = huffman_archive.create_archive(archive, [str(tree)], workers=workers, group_size=group_size)
+    assert report["members"] == len(FILES)
+    assert report["archive_size"] == os.path.getsize(archive)
+    assert read_all(archive) == FILES
+
+    output = tmp_path / "out"
+    assert huffman_archive.extract_archive(archive, str(output), workers=workers) == (
+        len(FILES), sum(map(len, FILES.values())))
+    for name, data in FILES.items():
+        assert (output / name).read_bytes() == data
+    assert os.stat(output / "logs" / "app.log").st_mode & 0o777 == 0o640
+    assert os.stat(output / "logs" / "notes.txt").st_mtime_ns == 1_500_000_000_123_456_789
+
+
+def test_small_group_size_makes_several_groups(tree, tmp_path):
+    archive = str(tmp_path / "logs.hufa")
+    huffman_archive.create_archive(archive, [str(tree)], group_size=2000)
+    groups, members = huffman_archive.read_directory(archive)
+    assert len(groups) > 1
+    assert {member["group"] for member in members} == set(range(len(groups)))
+
+
+def test_missing_member(tree, tmp_path):
+    archive = str(tmp_path / "logs.hufa")
+    huffman_archive.create_archive(archive, [str(tree)])
+    with pytest.raises(KeyError):
+        huffman_archive.read_member(archive, "logs/missing.log")
+    with pytest.raises(KeyError):
+        huffman_archive.extract_archive(archive, str(tmp_path / "out"), names=["logs/missing.log"])
+    assert not (tmp_path / "out").exists()
+
+
+@pytest.mark.parametrize("name", ["/etc/passwd", "../outside", "logs/../../outside", "c:evil", "a/../b"])
+def test_unsafe_names_are_refused(tree, tmp_path, monkeypatch, name):
+    monkeypatch.setattr(huffman_archive, "_archive_inputs", lambda paths: [(name, str(tree / "app.log"))])
+    archive = str(tmp_path / "evil.hufa")
+    huffman_archive.create_archive(archive, ["unused"])
+    output = tmp_path / "deep" / "out"
+    with pytest.raises(ValueError, match="Unsafe"):
+        huffman_archive.extract_archive(archive, str(output))
+    assert not (tmp_path / "deep").exists() and not (tmp_path / "outside").exists()
+
+
+def test_truncated_archives_are_rejected(tree, tmp_path):
+    archive = str(tmp_path / "logs.hufa")
+    huffman_archive.create_archive(archive, [str(tree)], group_size=2000)
+    blob = open(archive, "rb").read()
+    damaged = tmp_path / "short.hufa"
+    for size in range(len(blob)):
+        damaged.write_bytes(blob[:size])
+        with pytest.raises(ValueError):
+            read_all(str(damaged))
+
+
+def test_flipped_bits_never_read_as_wrong_data(tree, tmp_path):
+    archive = str(tmp_path / "logs.hufa")
+    huffman_archive.create_archive(archive, [str(tree)], group_size=2000)
+    blob = open(archive, "rb").read()
+    path = tmp_path / "flipped.hufa"
+    for position in range(len(blob)):
+        damaged = bytearray(blob)
+        damaged[position] ^= 1 << position % 8
+        path.write_bytes(bytes(damaged))
+        try:
+            assert read_all(str(path)) == FILES
+        except ValueError:
+            pass
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_members_are_coded_in_chunks(tree, tmp_path, monkeypatch, workers):
+    monkeypatch.setattr(huffman_archive.huffman, "IO_CHUNK_SIZE", 97)
+    archive = str(tmp_path / "logs.hufa")
+    huffman_archive.create_archive(archive, [str(tree)], workers=workers, group_size=2000)
+    assert read_all(archive) == FILES
+    # Groups coded on other processes are spooled next to the archive, and the spools removed
+    assert sorted(os.listdir(tmp_path)) == ["in", "logs.hufa"]
+
+
+def rewrite_directory(archive, edit):
+    # A directory that passes the checksum but says something else
+    blob = open(archive, "rb").read()
+    trailer = huffman_archive._ARCHIVE_TRAILER
+    offset, size, _, magic = trailer.unpack(blob[-trailer.size:])
+    directory = edit(bytearray(huffman_archive.zlib.decompress(blob[offset:offset + size])))
+    stored = huffman_archive.zlib.compress(bytes(directory))
+    checksum = huffman_archive.zlib.crc32(directory)
+    with open(archive, "wb") as f:
+        f.write(blob[:offset] + stored + trailer.pack(offset, len(stored), checksum, magic))
+
+
+def set_count(index, value):
+    def edit(directory):
+        directory[4 * index:4 * index + 4] = value.to_bytes(4, "big")
+        return directory
+    return edit
+
+
+def set_name_length(value):
+    def edit(directory):
+        groups = int.from_bytes(directory[:4], "big")
+        position = huffman_archive._DIRECTORY.size + groups * huffman_archive._GROUP.size + huffman_archive._MEMBER.size
+        directory[position - 2:position] = value.to_bytes(2, "big")
+        return directory
+    return edit
+
+
+@pytest.mark.parametrize("edit", [
+    lambda directory: directory[:5],
+    set_count(0, 1 << 31),
+    set_count(1, 1 << 31),
+    set_count(1, 1),
+    set_count(0, 0),
+    set_name_length(0xFFFF),
+    lambda directory: directory[:-3] + b"\xff\xfe\xfd",
+    lambda directory: directory + b"\0",
+])
+def test_crafted_directories_are_rejected(tree, tmp_path, edit):
+    archive = str(tmp_path / "logs.hufa")
+    huffman_archive.create_archive(archive, [str(tree)], group_size=2000)
+    rewrite_directory(archive, edit)
+    with pytest.raises(ValueError):
+        read_all(archive)
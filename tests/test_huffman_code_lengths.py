@@ -0,0 +1,84 @@
+import itertools
+import random
+
+import pytest
+
+import huffman
+
+
+def cost(frequency, lengths):
+    return sum(count * lengths[symbol] for symbol, count in frequency.items())
+
+
+def kraft(lengths):
+    return sum(2.0 ** -length for length in lengths.values())
+
+
+def tables():
+    rng = random.Random(6)
+    yield {"a": 1}
+    yield {"a": 3, "b": 3}
+    yield dict.fromkeys("abcdefgh", 5)
+    yield {byte: rng.choice([1, 2, 2, 3, 8]) for byte in range(40)}
+    yield {byte: rng.randint(1, 10 ** 6) for byte in range(256)}
+    yield {chr(0x4e00 + number): 2 ** (number % 20) for number in range(300)}
+
+
+@pytest.mark.parametrize("frequency", list(tables()))
+def test_lengths_match_the_heap_built_tree(frequency):
+    lengths = huffman.build_code_lengths(frequency)
+    tree_lengths = huffman.code_lengths(huffman.build_huffman_codes(huffman.build_huffman_tree(frequency)))
+    assert cost(frequency, lengths) == cost(frequency, tree_lengths)
+    assert kraft(lengths) == 1.0 or len(frequency) == 1
+
+
+@pytest.mark.parametrize("frequency", list(tables()))
+def test_ties_do_not_depend_on_counting_order(frequency):
+    lengths = huffman.build_code_lengths(frequency)
+    items = list(frequency.items())
+    for seed in range(5):
+        random.Random(seed).shuffle(items)
+        assert huffman.build_code_lengths(dict(items)) == lengths
+
+
+def fibonacci(count):
+    # Weights that make the optimal code as deep as the alphabet is large
+    weights = [1, 1]
+    while len(weights) < count:
+        weights.append(weights[-1] + weights[-2])
+    return {chr(ord("a") + index): weight for index, weight in enumerate(weights)}
+
+
+@pytest.mark.parametrize("frequency", [fibonacci(30), {byte: 1 << byte for byte in range(40)}] + list(tables()))
+@pytest.mark.parametrize("max_length", [6, 9, 15])
+def test_limited_lengths_fit_and_form_a_prefix_code(frequency, max_length):
+    lengths = huffman.build_code_lengths(frequency, max_length)
+    limit = max(max_length, (len(frequency) - 1).bit_length())
+    assert max(lengths.values()) <= limit
+    assert kraft(lengths) <= 1.0
+    assert cost(frequency, lengths) >= cost(frequency, huffman.build_code_lengths(frequency))
+
+
+def brute_force_cost(frequency, max_length):
+    counts = list(frequency.values())
+    return min(sum(count * length for count, length in zip(counts, lengths))
+               for lengths in itertools.product(range(1, max_length + 1), repeat=len(counts))
+               if sum(2.0 ** -length for length in lengths) <= 1.0)
+
+
+@pytest.mark.parametrize("count, max_length", [(3, 2), (4, 2), (5, 3), (6, 3), (7, 3), (6, 4), (7, 4)])
+def test_package_merge_is_optimal(count, max_length):
+    rng = random.Random(count * 10 + max_length)
+    for frequency in [fibonacci(count)] + [{index: rng.randint(1, 50) for index in range(count)} for _ in range(10)]:
+        lengths = huffman.build_code_lengths(frequency, max_length)
+        assert max(lengths.values()) <= max_length
+        assert cost(frequency, lengths) == brute_force_cost(frequency, max_length)
+
+
+def test_length_limit_cost():
+    frequency = fibonacci(8)
+    optimal = cost(frequency, huffman.build_code_lengths(frequency))
+    assert huffman.length_limit_cost(frequency, 4) == pytest.approx(brute_force_cost(frequency, 4) / optimal - 1)
+    assert huffman.length_limit_cost(frequency, 4) > 0
+    assert huffman.length_limit_cost(frequency, 7) == 0.0
+    assert huffman.length_limit_cost({}, 4) == 0.0
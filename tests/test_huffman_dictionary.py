@@ -0,0 +1,82 @@
+import io
+import random
+
+import pytest
+
+import huffman
+
+SAMPLE = b'{"id": 1, "name": "alpha", "tags": ["x", "y"], "ok": true}\n' * 50
+RECORD = b'{"id": 7, "name": "gamma", "tags": [], "ok": false}\n'
+
+
+@pytest.fixture
+def dictionary():
+    return huffman.train_dictionary([io.BytesIO(SAMPLE)])
+
+
+def compress(data, dictionary):
+    out = io.BytesIO()
+    huffman.compress_file(io.BytesIO(data), out, dictionary=dictionary, verbose=False)
+    return out.getvalue()
+
+
+def decompress(blob, dictionary):
+    out = io.BytesIO()
+    huffman.decompress_file(io.BytesIO(blob), out, dictionary=dictionary, verbose=False)
+    return out.getvalue()
+
+
+def test_round_trip(dictionary):
+    blob = compress(RECORD, dictionary)
+    assert huffman.file_info(io.BytesIO(blob))["dictionary"] == dictionary.dictionary_id
+    assert len(blob) < len(RECORD)
+    assert decompress(blob, dictionary) == RECORD
+    assert huffman.read_range(io.BytesIO(blob), 5, 10, dictionary=dictionary) == RECORD[5:15]
+
+
+def test_saved_dictionary_round_trips(dictionary, tmp_path):
+    path = huffman.save_dictionary(dictionary, str(tmp_path))
+    assert path.endswith(f"{dictionary.dictionary_id:08x}{huffman.DICTIONARY_SUFFIX}")
+    blob = compress(RECORD, path)
+    assert decompress(blob, str(tmp_path)) == RECORD
+    with pytest.raises(ValueError):
+        decompress(blob, huffman.train_dictionary([io.BytesIO(RECORD)]))
+
+
+def test_damaged_dictionary_file_is_rejected(dictionary, tmp_path):
+    saved = open(huffman.save_dictionary(dictionary, str(tmp_path / "good.hufdict")), 'rb').read()
+    for size in range(len(saved)):
+        path = tmp_path / f"short{size}.hufdict"
+        path.write_bytes(saved[:size])
+        with pytest.raises(ValueError):
+            huffman.load_dictionary(str(path))
+    for position in range(len(saved)):
+        damaged = bytearray(saved)
+        damaged[position] ^= 1 << position % 8
+        path = tmp_path / f"flip{position}.hufdict"
+        path.write_bytes(bytes(damaged))
+        with pytest.raises(ValueError):
+            huffman.load_dictionary(str(path))
+
+
+def test_input_the_dictionary_cannot_shrink_is_stored(dictionary):
+    data = random.Random(4).randbytes(30000)
+    blob = compress(data, dictionary)
+    info = huffman.file_info(io.BytesIO(blob))
+    assert info["dictionary"] is None and info["stored"] == 1
+    assert len(blob) < len(data) + 64
+    assert decompress(blob, dictionary) == data
+
+
+def test_damaged_dictionary_compressed_file(dictionary):
+    blob = compress(RECORD * 3, dictionary)
+    for size in range(len(blob)):
+        with pytest.raises(ValueError):
+            decompress(blob[:size], dictionary)
+    for bit in range(len(blob) * 8):
+        damaged = bytearray(blob)
+        damaged[bit // 8] ^= 1 << bit % 8
+        try:
+            assert decompress(bytes(damaged), dictionary) == RECORD * 3
+        except ValueError:
+            pass
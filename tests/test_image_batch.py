@@ -0,0 +1,115 @@
+import io
+import os
+
+import numpy
+import pytest
+from PIL import Image
+
+import image_batch
+
+
+@pytest.fixture
+def images(tmp_path):
+    source = tmp_path / "in"
+    source.mkdir()
+    for number in range(2):
+        Image.new("RGB", (32, 24), (40 * number, 90, 200)).save(source / f"image{number}.png")
+    return source
+
+
+def convert(images, tmp_path, mode="compress", **options):
+    return image_batch.convert_images([str(images)], mode, output_dir=str(tmp_path / "out"), skip="hash",
+                                      workers=1, **options)
+
+
+def test_hash_skip_ignores_settings_the_mode_does_not_use(images, tmp_path):
+    assert convert(images, tmp_path, "optimize", quality=80)["converted"] == 2
+    assert convert(images, tmp_path, "optimize", quality=50)["skipped"] == 2
+    assert convert(images, tmp_path, "optimize", effort="max")["converted"] == 2
+    jpegs = tmp_path / "jpegs"
+    assert image_batch.convert_images([str(images)], output_dir=str(jpegs), skip="none", workers=1)["converted"] == 2
+    assert convert(jpegs, tmp_path, "decompress", quality=80)["converted"] == 2
+    assert convert(jpegs, tmp_path, "decompress", quality=50)["skipped"] == 2
+
+
+def test_hash_skip_notices_a_new_quality(images, tmp_path):
+    assert convert(images, tmp_path, effort="max")["converted"] == 2
+    assert convert(images, tmp_path, effort="fast")["skipped"] == 2
+    assert convert(images, tmp_path, quality=60)["converted"] == 2
+    assert convert(images, tmp_path, quality=60)["skipped"] == 2
+    assert convert(images, tmp_path, quality=90)["converted"] == 2
+    assert convert(images, tmp_path, quality=60, goal=("size", 2000))["converted"] == 2
+    assert convert(images, tmp_path, quality=90, goal=("size", 2000))["skipped"] == 2
+
+
+def test_earlier_outputs_of_any_mode_are_not_inputs(tmp_path):
+    for name in ("photo.png", "photo_compressed.jpg", "scan.jpg", "scan_decompressed.png", "photo_optimized.png"):
+        (tmp_path / name).write_bytes(b"")
+    found = {mode: [os.path.basename(path) for path, _ in image_batch.find_images([str(tmp_path)], mode)]
+             for mode in image_batch.OUTPUT_SUFFIXES}
+    assert found == {"compress": ["photo.png"], "decompress": ["scan.jpg"], "optimize": ["photo.png"]}
+
+
+def test_converting_over_a_hard_link_replaces_it(images, tmp_path):
+    shared = tmp_path / "shared.jpg"
+    shared.write_bytes(b"kept as it is")
+    target = tmp_path / "target.jpg"
+    os.link(shared, target)
+    image_batch.convert_image(str(images / "image0.png"), str(target), "compress")
+    assert shared.read_bytes() == b"kept as it is"
+    assert target.read_bytes()[:2] == b"\xff\xd8"
+
+
+def photo():
+    # A gradient with noise, so JPEG size and fidelity both grow with quality
+    rng = numpy.random.default_rng(5)
+    gradient = numpy.add.outer(numpy.arange(48), numpy.arange(64))[..., None] * [2, 3, 1]
+    return Image.fromarray(numpy.clip(gradient + rng.integers(0, 40, (48, 64, 3)), 0, 255).astype(numpy.uint8))
+
+
+def test_psnr():
+    reference = numpy.zeros((8, 8), dtype=numpy.uint8)
+    assert image_batch.psnr(reference, reference) == float("inf")
+    assert image_batch.psnr(reference, reference + 5) == pytest.approx(10 * numpy.log10(255 ** 2 / 25))
+
+
+def test_ssim():
+    img = photo()
+    assert image_batch.ssim(img, img) == pytest.approx(1.0)
+    low = Image.open(io.BytesIO(image_batch.encode_jpeg(img, 10)))
+    high = Image.open(io.BytesIO(image_batch.encode_jpeg(img, 90)))
+    assert image_batch.ssim(img, low) < image_batch.ssim(img, high) < 1.0
+    assert image_batch.ssim(img, img.transpose(Image.Transpose.ROTATE_180)) < 0.5
+
+
+def test_search_quality_fits_a_size():
+    img = photo()
+    budget = len(image_batch.encode_jpeg(img, 60)) + 10
+    quality, data = image_batch.search_quality(img, ("size", budget))
+    assert data == image_batch.encode_jpeg(img, quality) and len(data) <= budget
+    assert len(image_batch.encode_jpeg(img, quality + 1)) > budget
+
+
+def test_search_quality_reaches_a_metric():
+    img = photo()
+    for kind, metric in [("ssim", image_batch.ssim), ("psnr", image_batch.psnr)]:
+        goal = metric(img, Image.open(io.BytesIO(image_batch.encode_jpeg(img, 70))))
+        quality, data = image_batch.search_quality(img, (kind, goal))
+        assert metric(img, Image.open(io.BytesIO(data))) >= goal
+        assert metric(img, Image.open(io.BytesIO(image_batch.encode_jpeg(img, quality - 1)))) < goal
+
+
+def test_search_quality_stops_at_its_bounds():
+    img = photo()
+    assert image_batch.search_quality(img, ("size", 10 ** 9))[0] == 100
+    assert image_batch.search_quality(img, ("size", 10 ** 9), highest=70)[0] == 70
+    assert image_batch.search_quality(img, ("ssim", 0.0))[0] == 1
+    assert image_batch.search_quality(img, ("ssim", 0.0), lowest=30)[0] == 30
+    with pytest.raises(ValueError):
+        image_batch.search_quality(img, ("size", 10))
+    with pytest.raises(ValueError):
+        image_batch.search_quality(img, ("ssim", 1.01))
+    with pytest.raises(ValueError):
+        image_batch.search_quality(img, ("psnr", 60), highest=50)
+    with pytest.raises(ValueError):
+        image_batch.search_quality(img, ("butteraugli", 1.0))
@@ -0,0 +1,86 @@
+import io
+
+import numpy
+import pytest
+from PIL import Image, ImageCms
+
+import png_optimize
+
+
+def optimize(tmp_path, img, **options):
+    path = tmp_path / "in.png"
+    img.save(path, **options)
+    data, report = png_optimize.optimize_png(str(path), "fast", workers=2)
+    with Image.open(io.BytesIO(data)) as out:
+        out.load()
+        return data, report, out
+
+
+def color_type(data):
+    return data[25]
+
+
+def test_round_trip_is_lossless(tmp_path):
+    pixels = numpy.random.default_rng(1).integers(0, 255, (40, 30, 4), dtype=numpy.uint8)
+    img = Image.fromarray(pixels, "RGBA")
+    data, report, out = optimize(tmp_path, img)
+    assert report["output_size"] == len(data)
+    assert numpy.array_equal(numpy.asarray(out.convert("RGBA")), pixels)
+
+
+def test_grey_image_with_rgb_profile_stays_rgb(tmp_path):
+    profile = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+    img = Image.new("RGB", (64, 64), (90, 90, 90))
+    img.paste((10, 10, 10), (0, 0, 32, 64))
+    data, report, out = optimize(tmp_path, img, icc_profile=profile)
+    assert color_type(data) in (2, 3)
+    assert out.info["icc_profile"] == profile
+    with Image.open(tmp_path / "in.png") as source:
+        source.load()
+        assert [name for name, _, _, _ in png_optimize._representations(source)] == ["RGB", "palette 1-bit"]
+
+
+def test_grey_profile_gets_no_palette(tmp_path):
+    # Only the colour space field of the header matters here
+    profile = bytearray(128)
+    profile[16:20] = b"GRAY"
+    img = Image.new("L", (64, 64), 200)
+    img.paste(20, (0, 0, 32, 64))
+    data, report, out = optimize(tmp_path, img, icc_profile=bytes(profile))
+    assert color_type(data) == 0
+    assert out.info["icc_profile"] == bytes(profile)
+
+
+def test_sixteen_bit_is_refused(tmp_path):
+    path = tmp_path / "deep.png"
+    Image.new("I;16", (4, 4), 1000).save(path)
+    with pytest.raises(ValueError):
+        png_optimize.optimize_png(str(path))
+
+
+def test_thread_count_does_not_change_the_result(tmp_path):
+    pixels = numpy.random.default_rng(2).integers(0, 4, (50, 70, 3), dtype=numpy.uint8) * 60
+    path = tmp_path / "in.png"
+    Image.fromarray(pixels, "RGB").save(path)
+    single = png_optimize.optimize_png(str(path), "max", workers=1)
+    several = png_optimize.optimize_png(str(path), "max", workers=3)
+    assert single[0] == several[0]
+    assert single[1]["candidates"] == several[1]["candidates"] == 2 * 6 * 4
+
+
+@pytest.mark.parametrize("kind", list(png_optimize.FILTER_TYPES) + ["adaptive"])
+def test_strips_filter_like_the_whole_image(monkeypatch, kind):
+    rows = numpy.random.default_rng(4).integers(0, 4, (13, 21), dtype=numpy.uint8) * 60
+    whole = png_optimize.filter_rows(rows, 3, kind)
+    monkeypatch.setattr(png_optimize, "FILTER_STRIP_BYTES", 50)
+    assert png_optimize.filter_rows(rows, 3, kind) == whole
+
+
+@pytest.mark.parametrize("size", [0, 8, 16, 20, 24, 32])
+def test_short_files_are_refused(tmp_path, size):
+    buffer = io.BytesIO()
+    Image.new("RGB", (4, 4)).save(buffer, "PNG")
+    path = tmp_path / "short.png"
+    path.write_bytes(buffer.getvalue()[:size])
+    with pytest.raises(ValueError):
+        png_optimize.optimize_png(str(path))
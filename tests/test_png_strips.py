@@ -0,0 +1,106 @@
+import io
+
+import numpy
+import pytest
+from PIL import Image
+
+import image_batch
+import png_strips
+
+RNG = numpy.random.default_rng(3)
+# Few levels, so rows repeat and the encoder picks a mix of filters
+PIXELS = RNG.integers(0, 4, (23, 17, 4), dtype=numpy.uint8) * 60
+
+
+def png(img, **options):
+    buffer = io.BytesIO()
+    img.save(buffer, "PNG", **options)
+    return buffer.getvalue()
+
+
+def images():
+    rgba = Image.fromarray(PIXELS, "RGBA")
+    palette = rgba.convert("RGB").quantize(8)
+    # A full palette, so Pillow writes 8 bits a pixel
+    palette.putpalette(palette.getpalette()[:24] + [0] * (768 - 24))
+    palette.info["transparency"] = 2
+    return {
+        "L": rgba.convert("L"),
+        "LA": rgba.convert("LA"),
+        "RGB": rgba.convert("RGB"),
+        "RGBA": rgba,
+        "P": palette,
+    }
+
+
+def decode_in_strips(data, rows):
+    whole = None
+    for top, strip in png_strips.iter_strips(io.BytesIO(data), rows):
+        if whole is None:
+            whole = Image.new(strip.mode, (strip.width, PIXELS.shape[0]))
+            if strip.mode == "P":
+                whole.putpalette(strip.getpalette())
+        whole.paste(strip, (0, top))
+    return whole
+
+
+@pytest.mark.parametrize("mode", ["L", "LA", "RGB", "RGBA", "P"])
+@pytest.mark.parametrize("rows", [1, 4, 22, 23, 100])
+def test_strips_match_a_full_decode(mode, rows):
+    data = png(images()[mode])
+    with Image.open(io.BytesIO(data)) as full:
+        full.load()
+        strips = decode_in_strips(data, rows)
+        assert strips.mode == full.mode
+        assert strips.tobytes() == full.tobytes()
+
+
+def test_strips_span_several_idat_chunks(monkeypatch):
+    # Pillow writes IDAT chunks of at most ImageFile.MAXBLOCK bytes
+    monkeypatch.setattr(png_strips, "READ_SIZE", 7)
+    monkeypatch.setattr("PIL.ImageFile.MAXBLOCK", 64)
+    data = png(images()["RGBA"], compress_level=0)
+    assert data.count(b"IDAT") > 2
+    assert decode_in_strips(data, 5).tobytes() == Image.open(io.BytesIO(data)).tobytes()
+
+
+def test_low_memory_conversion_matches(tmp_path):
+    path = tmp_path / "in.png"
+    images()["RGBA"].save(path)
+    assert image_batch.open_flat(str(path), max_memory=2500).tobytes() == image_batch.open_flat(str(path)).tobytes()
+
+
+def interlaced(data):
+    # Pillow cannot write interlaced PNGs; the header is all that is read
+    out = io.BytesIO()
+    png_strips.write_chunk(out, b"IHDR", data[16:28], b"\1")
+    return data[:8] + out.getvalue() + data[33:]
+
+
+@pytest.mark.parametrize("data", [
+    png(Image.new("I;16", (4, 4), 1000)),
+    png(Image.new("1", (4, 4))),
+    png(Image.new("P", (4, 4))),
+    interlaced(png(Image.new("RGB", (4, 4)))),
+])
+def test_unsupported_pngs(data):
+    with pytest.raises(png_strips.UnsupportedPNG):
+        list(png_strips.iter_strips(io.BytesIO(data), 2))
+
+
+@pytest.mark.parametrize("mode", ["RGBA", "P"])
+def test_truncated_pngs_are_rejected(mode):
+    data = png(images()[mode])
+    for size in range(len(data)):
+        with pytest.raises(ValueError):
+            decode_in_strips(data[:size], 4)
+
+
+@pytest.mark.parametrize("mode", ["RGBA", "P"])
+def test_flipped_bits_are_rejected(mode):
+    data = png(images()[mode])
+    for bit in range(len(data) * 8):
+        damaged = bytearray(data)
+        damaged[bit // 8] ^= 1 << bit % 8
+        with pytest.raises(ValueError):
+            decode_in_strips(bytes(damaged), 4)
@@ -0,0 +1,122 @@
+import os
+
+import pytest
+from PIL import Image
+
+import preview_cache
+
+
+class Root:
+    """Stands in for Tk: after() callbacks run when run() is called"""
+
+    def __init__(self):
+        self.calls = []
+
+    def after(self, delay, function, *args):
+        self.calls.append((function, args))
+
+    def run(self):
+        while self.calls:
+            function, args = self.calls.pop(0)
+            function(*args)
+
+
+@pytest.fixture
+def images(tmp_path, monkeypatch):
+    # PhotoImages need a display; the cache only stores and hands them on
+    monkeypatch.setattr("PIL.ImageTk.PhotoImage", lambda img: ("photo", img.size))
+    paths = []
+    for number in range(3):
+        path = tmp_path / f"image{number}.png"
+        Image.new("RGB", (40 + number, 30), (number * 50, 0, 0)).save(path)
+        paths.append(str(path))
+    return paths
+
+
+def request(cache, path):
+    delivered = []
+    cache.request(path, lambda photo, error: delivered.append((photo, error)))
+    cache.root.run()
+    return delivered
+
+
+def test_memory_cache_is_lru(images, tmp_path):
+    cache = preview_cache.PreviewCache(Root(), capacity=2, directory=str(tmp_path / "thumbnails"))
+    for path in (images[0], images[1], images[0], images[2]):
+        assert request(cache, path) == [(("photo", (40 + images.index(path), 30)), None)]
+    assert [key[0] for key in cache.memory] == [images[0], images[2]]
+
+
+def test_only_the_latest_request_is_delivered(images, tmp_path):
+    cache = preview_cache.PreviewCache(Root(), directory=str(tmp_path / "thumbnails"))
+    delivered = []
+    for path in images:
+        cache.request(path, lambda photo, error, path=path: delivered.append(path))
+    cache.root.run()
+    assert delivered == [images[2]]
+    assert len(cache.memory) == 3
+
+
+def test_errors_are_delivered(images, tmp_path):
+    cache = preview_cache.PreviewCache(Root(), directory=str(tmp_path / "thumbnails"))
+    (tmp_path / "broken.png").write_bytes(b"not an image")
+    [(photo, error)] = request(cache, str(tmp_path / "broken.png"))
+    assert photo is None and error
+    [(photo, error)] = request(cache, str(tmp_path / "missing.png"))
+    assert photo is None and error
+
+
+def test_disk_cache_is_reused_until_the_file_changes(images, tmp_path, monkeypatch):
+    directory = str(tmp_path / "thumbnails")
+    path = images[0]
+    first = preview_cache.cached_thumbnail(path, preview_cache.preview_key(path), directory=directory)
+    assert len(os.listdir(directory)) == 1
+
+    decoded = []
+    load_thumbnail = preview_cache.load_thumbnail
+    monkeypatch.setattr(preview_cache, "load_thumbnail", lambda *args: decoded.append(args) or load_thumbnail(*args))
+    again = preview_cache.cached_thumbnail(path, preview_cache.preview_key(path), directory=directory)
+    assert decoded == [] and again.tobytes() == first.tobytes()
+
+    # Same size, new mtime
+    os.utime(path, ns=(1_000_000_000, 1_000_000_000))
+    preview_cache.cached_thumbnail(path, preview_cache.preview_key(path), directory=directory)
+    # New size
+    Image.new("RGB", (90, 30), (0, 0, 255)).save(path)
+    os.utime(path, ns=(1_000_000_000, 1_000_000_000))
+    changed = preview_cache.cached_thumbnail(path, preview_cache.preview_key(path), directory=directory)
+    assert len(decoded) == 2 and changed.size == (90, 30)
+    assert len(os.listdir(directory)) == 3
+
+
+def test_damaged_disk_entries_are_decoded_again(images, tmp_path):
+    directory = tmp_path / "thumbnails"
+    key = preview_cache.preview_key(images[0])
+    preview_cache.cached_thumbnail(images[0], key, directory=str(directory))
+    [entry] = directory.iterdir()
+    entry.write_bytes(b"damaged")
+    assert preview_cache.cached_thumbnail(images[0], key, directory=str(directory)).size == (40, 30)
+
+
+def test_prune_disk_cache_keeps_the_most_recent(tmp_path):
+    for number in range(5):
+        path = tmp_path / f"{number}.png"
+        path.write_bytes(b"")
+        os.utime(path, (number, number))
+    preview_cache.prune_disk_cache(str(tmp_path), capacity=2)
+    assert sorted(os.listdir(tmp_path)) == ["3.png", "4.png"]
+
+
+@pytest.mark.parametrize("mode, size, expected", [
+    ("RGB", (1200, 900), "RGB"),
+    ("L", (640, 640), "RGB"),
+    ("RGBA", (300, 100), "RGBA"),
+    ("LA", (100, 900), "RGBA"),
+])
+def test_load_thumbnail_fits_the_box(tmp_path, mode, size, expected):
+    path = tmp_path / ("in.jpg" if mode in ("RGB", "L") else "in.png")
+    Image.new(mode, size).save(path)
+    thumbnail = preview_cache.load_thumbnail(str(path), (200, 150))
+    assert thumbnail.mode == expected
+    assert thumbnail.width <= 200 and thumbnail.height <= 150
+    assert max(thumbnail.width / 200, thumbnail.height / 150) == pytest.approx(1, abs=0.02)